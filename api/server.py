@@ -2,29 +2,42 @@
 🌐 API сервер для webhook'ов и Mini App
 """
 
-from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi import FastAPI, Request, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
 import logging
 import json
 
 from bot.services.payment import process_webhook_notification
 from bot.database import (
     get_user_subscriptions, get_monthly_spending, 
-    get_user, add_subscription, update_subscription, delete_subscription
+    get_user, add_subscription, update_subscription, delete_subscription, is_premium
 )
 from bot.services.smart_analytics import generate_full_report
-from bot.services.duplicate_detector import detect_duplicates
-from bot.models import BillingCycle
+from bot.services.duplicate_detector import calculate_total_savings
+from bot.services.duplicate_scan import get_duplicate_alerts
+from bot.services.export import EXPORT_FORMATS, export_filename, iter_export
+from bot.services.subscription_batch import MAX_BATCH_CHANGES, SubscriptionChange, apply_subscription_batch
+from bot.cache import cache_stats
+from bot.serialization import api_subscription, dumps
+from bot.data.subscriptions_catalog import search_subscriptions
+from bot.models import BillingCycle, SubscriptionStatus
 from datetime import date
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="SubsManager API", version="1.0.0")
+class ORJSONResponse(JSONResponse):
+    """Ответ через общий кодировщик bot.serialization (orjson)"""
+    
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+app = FastAPI(title="SubsManager API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS для Mini App
 app.add_middleware(
@@ -56,6 +69,31 @@ class SubscriptionUpdate(BaseModel):
     notes: Optional[str] = None
 
 
+class SubscriptionBatchOperation(BaseModel):
+    """Правка в пакете: create — поля новой подписки, update — только меняемые, delete — только id"""
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    client_id: Optional[str] = None
+    name: Optional[str] = None
+    price: Optional[float] = None
+    currency: Optional[str] = None
+    billing_cycle: Optional[str] = None
+    category: Optional[str] = None
+    icon: Optional[str] = None
+    color: Optional[str] = None
+    start_date: Optional[str] = None
+    next_billing_date: Optional[str] = None
+    is_trial: Optional[bool] = None
+    trial_end_date: Optional[str] = None
+    status: Optional[str] = None
+    notes: Optional[str] = None
+
+
+class SubscriptionBatch(BaseModel):
+    telegram_id: int
+    operations: List[SubscriptionBatchOperation] = Field(min_length=1, max_length=MAX_BATCH_CHANGES)
+
+
 class TelegramAuthData(BaseModel):
     """Данные авторизации из Telegram Mini App"""
     id: int
@@ -94,7 +132,7 @@ async def yookassa_webhook(request: Request):
 @app.get("/api/health")
 async def health_check():
     """Проверка работоспособности"""
-    return {"status": "ok", "version": "1.0.0"}
+    return {"status": "ok", "version": "1.0.0", "cache": cache_stats()}
 
 
 @app.get("/api/user/{telegram_id}")
@@ -123,27 +161,11 @@ async def get_subscriptions(telegram_id: int):
     
     subscriptions = await get_user_subscriptions(telegram_id)
     
-    return {
-        "subscriptions": [
-            {
-                "id": sub.id,
-                "name": sub.name,
-                "price": sub.price,
-                "currency": sub.currency,
-                "billing_cycle": sub.billing_cycle.value,
-                "category": sub.category,
-                "icon": sub.icon,
-                "color": sub.color,
-                "status": sub.status.value,
-                "is_trial": sub.is_trial,
-                "trial_end_date": sub.trial_end_date.isoformat() if sub.trial_end_date else None,
-                "next_billing_date": sub.next_billing_date.isoformat() if sub.next_billing_date else None,
-                "notes": sub.notes
-            }
-            for sub in subscriptions
-        ],
+    # Готовый ответ минует jsonable_encoder — структуры кодирует orjson
+    return ORJSONResponse({
+        "subscriptions": [api_subscription(sub) for sub in subscriptions],
         "count": len(subscriptions)
-    }
+    })
 
 
 @app.post("/api/user/{telegram_id}/subscriptions")
@@ -198,6 +220,52 @@ async def update_subscription_api(subscription_id: int, data: SubscriptionUpdate
     return {"message": "Subscription updated"}
 
 
+def _batch_change(operation: SubscriptionBatchOperation) -> SubscriptionChange:
+    """Правка пакета в поля Subscription; неверные значения — invalid, остальные правки применяются"""
+    change = SubscriptionChange(op=operation.op, id=operation.id, client_id=operation.client_id)
+    values = operation.model_dump(exclude={"op", "id", "client_id"}, exclude_none=True)
+    
+    try:
+        if operation.op != "create" and operation.id is None:
+            raise ValueError("id is required")
+        if "billing_cycle" in values:
+            values["billing_cycle"] = BillingCycle(values["billing_cycle"])
+        if "status" in values:
+            values["status"] = SubscriptionStatus(values["status"])
+        for key in ("start_date", "next_billing_date", "trial_end_date"):
+            if key in values:
+                values[key] = date.fromisoformat(values[key])
+    except ValueError as e:
+        change.error = str(e)
+    
+    change.values = values
+    return change
+
+
+@app.post("/api/subscriptions/batch")
+async def batch_subscriptions(data: SubscriptionBatch):
+    """Пакет create / update / delete одной транзакцией; результат — по каждой операции"""
+    
+    results, subscriptions = await apply_subscription_batch(
+        data.telegram_id, [_batch_change(operation) for operation in data.operations]
+    )
+    
+    return ORJSONResponse({
+        "results": [
+            {
+                "op": result["op"],
+                "status": result["status"],
+                "id": result["id"],
+                "client_id": result["clientId"],
+                "error": result.get("error"),
+                "subscription": api_subscription(subscriptions[result["id"]])
+                if result["status"] == "ok" and result["id"] in subscriptions else None
+            }
+            for result in results
+        ]
+    })
+
+
 @app.delete("/api/subscriptions/{subscription_id}")
 async def delete_subscription_api(subscription_id: int):
     """Удалить подписку"""
@@ -249,11 +317,12 @@ async def get_analytics(telegram_id: int):
 async def get_duplicates(telegram_id: int):
     """Получить дубликаты"""
     
-    alerts = await detect_duplicates(telegram_id)
+    alerts = await get_duplicate_alerts(telegram_id)
     
     return {
         "duplicates": [
             {
+                "id": alert.id,
                 "main": {
                     "id": alert.main_subscription.id,
                     "name": alert.main_subscription.name
@@ -261,17 +330,61 @@ async def get_duplicates(telegram_id: int):
                 "duplicate": {
                     "id": alert.duplicate_subscription.id,
                     "name": alert.duplicate_subscription.name
-                },
+                } if alert.duplicate_subscription else None,
                 "overlap_type": alert.overlap_type.value,
                 "potential_saving": alert.potential_saving,
-                "recommendation": alert.recommendation
+                "recommendation": alert.recommendation,
+                "plan": {
+                    "buy": alert.plan.buy,
+                    "cancel": [sub.id for sub in alert.plan.cancel],
+                    "current_cost": alert.plan.current_cost,
+                    "plan_cost": alert.plan.plan_cost
+                } if alert.plan else None
             }
             for alert in alerts
         ],
-        "total_saving": sum(a.potential_saving for a in alerts)
+        "total_saving": calculate_total_savings(alerts)
+    }
+
+
+@app.get("/api/catalog/search")
+async def catalog_search(q: str = Query("", max_length=100), limit: int = Query(10, ge=1, le=50)):
+    """Поиск сервисов в каталоге: опечатки, транслит, начало слова"""
+    
+    results = search_subscriptions(q, limit) if q.strip() else []
+    
+    return {
+        "results": [
+            {
+                "id": service["id"],
+                "name": service["name"],
+                "icon": service.get("icon"),
+                "color": service.get("color"),
+                "category": service.get("category"),
+                "default_price": service.get("default_price")
+            }
+            for service in results
+        ]
     }
 
 
+@app.get("/api/user/{telegram_id}/export")
+async def export_subscriptions(telegram_id: int, format: str = "csv"):
+    """Выгрузка подписок и списаний (Премиум): csv, jsonl или xlsx, отдаётся потоком"""
+    
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    
+    if not await is_premium(telegram_id):
+        raise HTTPException(status_code=403, detail="Premium required")
+    
+    return StreamingResponse(
+        iter_export(telegram_id, format),
+        media_type=EXPORT_FORMATS[format][1],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format)}"'}
+    )
+
+
 # ============ СТАТИЧЕСКИЕ ФАЙЛЫ ДЛЯ MINI APP ============
 
 # Раскомментировать когда будут готовы файлы webapp
@@ -3,12 +3,25 @@ API эндпоинты для Mini App
 Адаптировано под вашу структуру БД
 """
 from aiohttp import web
+import hashlib
 import logging
-from datetime import datetime, date, timedelta
-from typing import Optional
+import time
+from datetime import datetime, date, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Tuple
 import os
 from pathlib import Path
 
+from .cache import MISSING, cache_stats, sync_cache
+from .data.subscriptions_catalog import search_subscriptions
+from .services.delta_sync import decode_cursor, load_sync_delta
+from .services.duplicate_detector import get_counterpart_name
+from .services.duplicate_scan import get_duplicate_alerts, load_duplicate_alerts
+from .services.export import EXPORT_FORMATS, export_filename, iter_export
+from .services.service_matcher import AhoCorasick
+from .services.subscription_batch import MAX_BATCH_CHANGES, apply_subscription_batch, parse_change
+from .serialization import MiniAppSubscription, JSON_CONTENT_TYPE, dumps, json_response, loaded_values
+
 logger = logging.getLogger(__name__)
 
 # Модуль базы данных
@@ -23,254 +36,272 @@ def set_database(database_module):
 # Путь к статическим файлам
 STATIC_DIR = Path(__file__).parent / 'static'
 
+# Ответ /api/sync можно хранить, но перед использованием — сверять ETag
+SYNC_CACHE_CONTROL = 'private, no-cache'
+
 
 # ========================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ========================================
 
-def subscription_to_dict(sub) -> dict:
-    """Конвертирует объект Subscription в словарь для API"""
-    # Определяем иконку по названию если нет в БД
-    icon = getattr(sub, 'icon', None) or get_icon_for_service(sub.name)
-    category = getattr(sub, 'category', None) or get_category_for_service(sub.name)
-    color = getattr(sub, 'color', None) or get_color_for_service(sub.name)
+def subscription_to_struct(sub) -> MiniAppSubscription:
+    """Конвертирует объект Subscription в структуру ответа Mini App"""
+    values = loaded_values(sub)
+    icon, category, color = values['icon'], values['category'], values['color']
     
-    # Форматируем дату
-    next_payment = None
-    if sub.next_billing_date:
-        if isinstance(sub.next_billing_date, date):
-            next_payment = datetime.combine(sub.next_billing_date, datetime.min.time()).isoformat()
-        else:
-            next_payment = sub.next_billing_date.isoformat()
+    # Иконку, категорию и цвет по названию ищем, только если чего-то нет в БД
+    if not (icon and category and color):
+        style = resolve_service_style(values['name'])
+        icon = icon or style[0]
+        category = category or style[1]
+        color = color or style[2]
     
-    # Получаем billing_cycle как строку
-    billing_cycle = 'monthly'
-    if hasattr(sub, 'billing_cycle') and sub.billing_cycle:
-        billing_cycle = sub.billing_cycle.value if hasattr(sub.billing_cycle, 'value') else str(sub.billing_cycle)
+    # Дата — с временем, как datetime.isoformat(): этот формат ждёт Mini App
+    next_payment = values['next_billing_date']
+    billing_cycle = values['billing_cycle']
     
-    return {
-        'id': sub.id,
-        'name': sub.name,
-        'price': float(sub.price),
-        'currency': getattr(sub, 'currency', 'RUB'),
-        'billingCycle': billing_cycle,
-        'nextPayment': next_payment,
-        'icon': icon,
-        'category': category,
-        'color': color,
-        'notifyDays': getattr(sub, 'notify_days', 3),
-        'status': sub.status.value if hasattr(sub.status, 'value') else str(sub.status)
-    }
+    return MiniAppSubscription(
+        id=values['id'],
+        name=values['name'],
+        price=float(values['price']),
+        currency=values['currency'],
+        billingCycle=billing_cycle.value if billing_cycle else 'monthly',
+        nextPayment=next_payment.isoformat() + 'T00:00:00' if next_payment else None,
+        icon=icon,
+        category=category,
+        color=color,
+        notifyDays=values.get('notify_days', 3),
+        status=values['status'].value
+    )
+
+
+# Ключевые слова в названии → иконка / категория / цвет.
+# Порядок важен: при нескольких совпадениях побеждает ключ, стоящий раньше.
+SERVICE_ICONS = {
+    'яндекс': '🎵', 'yandex': '🎵',
+    'кинопоиск': '🎬', 'kinopoisk': '🎬',
+    'spotify': '🎧',
+    'youtube': '▶️', 'ютуб': '▶️',
+    'netflix': '🎬',
+    'vk': '🎵', 'вк': '🎵',
+    'okko': '🎥', 'окко': '🎥',
+    'ivi': '📺', 'иви': '📺',
+    'apple': '🍎',
+    'telegram': '✈️', 'телеграм': '✈️',
+    'wink': '📱', 'винк': '📱',
+    'start': '🎬', 'старт': '🎬',
+    'мтс': '📦', 'mts': '📦',
+    'сбер': '💚', 'sber': '💚',
+    'icloud': '☁️', 'айклауд': '☁️',
+    'google': '🔵', 'гугл': '🔵',
+    'dropbox': '📦',
+    'notion': '📝',
+    'figma': '🎨',
+    'chatgpt': '🤖', 'openai': '🤖',
+    'github': '💻',
+    'linkedin': '💼',
+    'twitch': '🎮',
+    'discord': '🎮',
+    'zoom': '📹',
+    'microsoft': '🪟',
+    'adobe': '🎨',
+    'canva': '🎨',
+}
+
+SERVICE_CATEGORIES = [
+    ('Музыка', ['spotify', 'яндекс музыка', 'vk музыка', 'apple music', 'звук', 'deezer', 'tidal']),
+    ('Видео', ['netflix', 'кинопоиск', 'okko', 'ivi', 'wink', 'start', 'premier', 'hbo', 'disney', 'amediateka', 'youtube']),
+    ('Бандл', ['яндекс плюс', 'яндекс+', 'сберпрайм', 'мтс premium', 'tinkoff pro']),
+    ('Мессенджеры', ['telegram', 'discord', 'slack', 'whatsapp']),
+    ('Хранилище', ['icloud', 'google one', 'dropbox', 'onedrive', 'яндекс диск', 'облако']),
+    ('Продуктивность', ['notion', 'evernote', 'todoist', 'trello']),
+    ('Дизайн', ['figma', 'canva', 'adobe', 'photoshop']),
+    ('Разработка', ['github', 'gitlab', 'jetbrains', 'chatgpt', 'copilot']),
+]
+
+SERVICE_COLORS = {
+    'яндекс': '#FF0000',
+    'кинопоиск': '#FF6B00',
+    'spotify': '#1DB954',
+    'youtube': '#FF0000',
+    'netflix': '#E50914',
+    'vk': '#0077FF',
+    'okko': '#6B4EE6',
+    'ivi': '#EA1E63',
+    'apple': '#FC3C44',
+    'telegram': '#0088CC',
+    'wink': '#7C3AED',
+    'мтс': '#E30611',
+    'сбер': '#21A038',
+    'tinkoff': '#FFDD2D',
+    'google': '#4285F4',
+    'icloud': '#007AFF',
+    'notion': '#000000',
+    'figma': '#F24E1E',
+    'github': '#333333',
+    'discord': '#5865F2',
+    'twitch': '#9146FF',
+}
+
+DEFAULT_ICON = '💳'
+DEFAULT_CATEGORY = 'Другое'
+DEFAULT_COLOR = '#6366f1'
+
+
+def _rank_keywords(table) -> dict:
+    """Ключевое слово → (приоритет, значение); для повторов остаётся первое"""
+    ranks = {}
+    for rank, (keyword, value) in enumerate(table):
+        ranks.setdefault(keyword, (rank, value))
+    return ranks
+
+
+# Один автомат на все три таблицы — название просматривается один раз
+_ICON_RANKS = _rank_keywords(SERVICE_ICONS.items())
+_CATEGORY_RANKS = _rank_keywords(
+    (keyword, category) for category, keywords in SERVICE_CATEGORIES for keyword in keywords
+)
+_COLOR_RANKS = _rank_keywords(SERVICE_COLORS.items())
+_STYLE_AUTOMATON = AhoCorasick({
+    keyword: keyword
+    for ranks in (_ICON_RANKS, _CATEGORY_RANKS, _COLOR_RANKS)
+    for keyword in ranks
+})
+
+
+@lru_cache(maxsize=4096)
+def resolve_service_style(name: str) -> Tuple[str, str, str]:
+    """(иконка, категория, цвет) по названию сервиса — за один проход, с мемоизацией"""
+    best = [None, None, None]
+    
+    for _, _, keyword in _STYLE_AUTOMATON.iter_matches((name or '').lower()):
+        for i, ranks in enumerate((_ICON_RANKS, _CATEGORY_RANKS, _COLOR_RANKS)):
+            found = ranks.get(keyword)
+            if found and (best[i] is None or found[0] < best[i][0]):
+                best[i] = found
+    
+    defaults = (DEFAULT_ICON, DEFAULT_CATEGORY, DEFAULT_COLOR)
+    return tuple(found[1] if found else default for found, default in zip(best, defaults))
 
 
 def get_icon_for_service(name: str) -> str:
     """Возвращает иконку для сервиса по названию"""
-    name_lower = name.lower()
-    icons = {
-        'яндекс': '🎵', 'yandex': '🎵',
-        'кинопоиск': '🎬', 'kinopoisk': '🎬',
-        'spotify': '🎧',
-        'youtube': '▶️', 'ютуб': '▶️',
-        'netflix': '🎬',
-        'vk': '🎵', 'вк': '🎵',
-        'okko': '🎥', 'окко': '🎥',
-        'ivi': '📺', 'иви': '📺',
-        'apple': '🍎',
-        'telegram': '✈️', 'телеграм': '✈️',
-        'wink': '📱', 'винк': '📱',
-        'start': '🎬', 'старт': '🎬',
-        'мтс': '📦', 'mts': '📦',
-        'сбер': '💚', 'sber': '💚',
-        'icloud': '☁️', 'айклауд': '☁️',
-        'google': '🔵', 'гугл': '🔵',
-        'dropbox': '📦',
-        'notion': '📝',
-        'figma': '🎨',
-        'chatgpt': '🤖', 'openai': '🤖',
-        'github': '💻',
-        'linkedin': '💼',
-        'twitch': '🎮',
-        'discord': '🎮',
-        'zoom': '📹',
-        'microsoft': '🪟',
-        'adobe': '🎨',
-        'canva': '🎨',
-    }
-    
-    for key, icon in icons.items():
-        if key in name_lower:
-            return icon
-    
-    return '💳'
+    return resolve_service_style(name)[0]
 
 
 def get_category_for_service(name: str) -> str:
     """Возвращает категорию для сервиса"""
-    name_lower = name.lower()
-    
-    music = ['spotify', 'яндекс музыка', 'vk музыка', 'apple music', 'звук', 'deezer', 'tidal']
-    video = ['netflix', 'кинопоиск', 'okko', 'ivi', 'wink', 'start', 'premier', 'hbo', 'disney', 'amediateka', 'youtube']
-    bundles = ['яндекс плюс', 'яндекс+', 'сберпрайм', 'мтс premium', 'tinkoff pro']
-    messengers = ['telegram', 'discord', 'slack', 'whatsapp']
-    storage = ['icloud', 'google one', 'dropbox', 'onedrive', 'яндекс диск', 'облако']
-    productivity = ['notion', 'evernote', 'todoist', 'trello']
-    design = ['figma', 'canva', 'adobe', 'photoshop']
-    dev = ['github', 'gitlab', 'jetbrains', 'chatgpt', 'copilot']
-    
-    for service in music:
-        if service in name_lower:
-            return 'Музыка'
-    for service in video:
-        if service in name_lower:
-            return 'Видео'
-    for service in bundles:
-        if service in name_lower:
-            return 'Бандл'
-    for service in messengers:
-        if service in name_lower:
-            return 'Мессенджеры'
-    for service in storage:
-        if service in name_lower:
-            return 'Хранилище'
-    for service in productivity:
-        if service in name_lower:
-            return 'Продуктивность'
-    for service in design:
-        if service in name_lower:
-            return 'Дизайн'
-    for service in dev:
-        if service in name_lower:
-            return 'Разработка'
-    
-    return 'Другое'
+    return resolve_service_style(name)[1]
 
 
 def get_color_for_service(name: str) -> str:
     """Возвращает цвет для сервиса"""
-    name_lower = name.lower()
-    colors = {
-        'яндекс': '#FF0000',
-        'кинопоиск': '#FF6B00',
-        'spotify': '#1DB954',
-        'youtube': '#FF0000',
-        'netflix': '#E50914',
-        'vk': '#0077FF',
-        'okko': '#6B4EE6',
-        'ivi': '#EA1E63',
-        'apple': '#FC3C44',
-        'telegram': '#0088CC',
-        'wink': '#7C3AED',
-        'мтс': '#E30611',
-        'сбер': '#21A038',
-        'tinkoff': '#FFDD2D',
-        'google': '#4285F4',
-        'icloud': '#007AFF',
-        'notion': '#000000',
-        'figma': '#F24E1E',
-        'github': '#333333',
-        'discord': '#5865F2',
-        'twitch': '#9146FF',
-    }
-    
-    for key, color in colors.items():
-        if key in name_lower:
-            return color
-    
-    return '#6366f1'
+    return resolve_service_style(name)[2]
 
 
-def find_duplicates(subscriptions: list) -> list:
-    """Находит дубликаты/пересечения подписок"""
-    duplicates = []
-    names = [s.get('name', '').lower() if isinstance(s, dict) else s.name.lower() for s in subscriptions]
-    
-    def get_name(s):
-        return s.get('name', '') if isinstance(s, dict) else s.name
-    
-    def get_price(s):
-        return s.get('price', 0) if isinstance(s, dict) else s.price
-    
-    # Яндекс Плюс включает многое
-    has_yandex_plus = any('яндекс плюс' in n or 'яндекс+' in n or 'yandex plus' in n for n in names)
-    
-    if has_yandex_plus:
-        for sub in subscriptions:
-            name = get_name(sub).lower()
-            if 'кинопоиск' in name and 'яндекс' not in name:
-                duplicates.append({
-                    'services': ['Яндекс Плюс', get_name(sub)],
-                    'message': 'Кинопоиск уже входит в Яндекс Плюс! Можно сэкономить.',
-                    'savings': float(get_price(sub))
-                })
-            elif 'яндекс музыка' in name:
-                duplicates.append({
-                    'services': ['Яндекс Плюс', get_name(sub)],
-                    'message': 'Яндекс Музыка уже входит в Яндекс Плюс!',
-                    'savings': float(get_price(sub))
-                })
-            elif 'яндекс диск' in name:
-                duplicates.append({
-                    'services': ['Яндекс Плюс', get_name(sub)],
-                    'message': 'Расширенный Яндекс Диск входит в Яндекс Плюс!',
-                    'savings': float(get_price(sub))
-                })
-    
-    # СберПрайм
-    has_sber = any('сберпрайм' in n or 'сбер прайм' in n or 'sberprime' in n for n in names)
-    
-    if has_sber:
-        for sub in subscriptions:
-            name = get_name(sub).lower()
-            if 'okko' in name or 'окко' in name:
-                duplicates.append({
-                    'services': ['СберПрайм', get_name(sub)],
-                    'message': 'Okko входит в СберПрайм!',
-                    'savings': float(get_price(sub))
-                })
-            elif 'сберзвук' in name or 'звук' in name:
-                duplicates.append({
-                    'services': ['СберПрайм', get_name(sub)],
-                    'message': 'СберЗвук входит в СберПрайм!',
-                    'savings': float(get_price(sub))
-                })
-    
-    # МТС Premium
-    has_mts = any('мтс premium' in n or 'mts premium' in n or 'мтс премиум' in n for n in names)
+async def serialize_subscriptions(telegram_id: int, subscriptions: list) -> list:
+    """
+    subscription_to_struct для списка подписок.
+    Найденные по названию иконка и цвет сохраняются в строку — в следующий раз берутся из БД.
+    Категорию не сохраняем: в БД хранится ID категории каталога, а здесь — подпись.
+    """
+    styles = {}
+    for sub in subscriptions:
+        if sub.icon and sub.color:
+            continue
+        icon, _, color = resolve_service_style(sub.name)
+        values = {}
+        if not sub.icon and icon != DEFAULT_ICON:
+            values['icon'] = icon
+        if not sub.color and color != DEFAULT_COLOR:
+            values['color'] = color
+        if values:
+            styles[sub.id] = values
     
-    if has_mts:
-        for sub in subscriptions:
-            name = get_name(sub).lower()
-            if 'kion' in name or 'кион' in name:
-                duplicates.append({
-                    'services': ['МТС Premium', get_name(sub)],
-                    'message': 'KION входит в МТС Premium!',
-                    'savings': float(get_price(sub))
-                })
+    if styles:
+        try:
+            await db.fill_subscription_styles(telegram_id, styles)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить иконки подписок: {e}")
     
-    # Tinkoff Pro
-    has_tinkoff = any('tinkoff pro' in n or 'тинькофф про' in n for n in names)
+    return [subscription_to_struct(sub) for sub in subscriptions]
+
+
+def duplicate_alert_to_dict(alert) -> dict:
+    """Конвертирует DuplicateAlert в формат Mini App"""
+    return {
+        'id': alert.id,
+        'type': alert.overlap_type.value,
+        'services': [alert.main_subscription.name, get_counterpart_name(alert)],
+        'message': alert.recommendation,
+        'savings': round(float(alert.potential_saving), 2)
+    }
+
+
+def upcoming_payments(subscriptions: list, today: date) -> Tuple[int, list]:
+    """Число списаний на неделю вперёд и ближайшие (до 3 дней) — блок trials Mini App"""
+    upcoming = 0
+    trials = []
     
-    if has_tinkoff:
-        for sub in subscriptions:
-            name = get_name(sub).lower()
-            if 'яндекс плюс' in name:
-                duplicates.append({
-                    'services': ['Tinkoff Pro', get_name(sub)],
-                    'message': 'Яндекс Плюс входит в Tinkoff Pro!',
-                    'savings': float(get_price(sub))
-                })
+    for sub in subscriptions:
+        if not sub.next_billing_date:
+            continue
+        days_until = (sub.next_billing_date - today).days
+        
+        if 0 <= days_until <= 7:
+            upcoming += 1
+        
+        if 0 <= days_until <= 3:
+            trials.append({
+                'id': sub.id,
+                'name': sub.name,
+                'endsIn': days_until,
+                'price': float(sub.price),
+                'action': f"Списание {'сегодня' if days_until == 0 else 'завтра' if days_until == 1 else f'через {days_until} дн.'}"
+            })
     
-    return duplicates
+    return upcoming, trials
+
+
+def sync_user_to_dict(user) -> dict:
+    return {
+        'id': user.telegram_id,
+        'name': user.first_name or user.username or 'Пользователь',
+        'username': user.username or '',
+        'isPremium': db.has_premium(user)
+    }
+
+
+def sync_stats_to_dict(summary, upcoming: int) -> dict:
+    total_monthly = summary.monthly_total
+    return {
+        'totalMonthly': total_monthly,
+        'totalYearly': round(total_monthly * 12, 2),
+        'activeCount': summary.subscriptions_count,
+        'upcomingPayments': upcoming
+    }
 
 
 # ========================================
 # API HANDLERS
 # ========================================
 
+def _sync_valid_until(user) -> float:
+    """
+    До какого момента ответ /api/sync не устареет сам по себе:
+    до полуночи (сдвигаются «через N дн.») и до конца премиума
+    """
+    valid_until = datetime.combine(date.today() + timedelta(days=1), datetime.min.time()).timestamp()
+    if user.premium_expires and user.premium_expires > datetime.utcnow():
+        valid_until = min(valid_until, user.premium_expires.replace(tzinfo=timezone.utc).timestamp())
+    return valid_until
+
+
 async def handle_sync(request):
     """
     POST /api/sync
-    Главный эндпоинт синхронизации с Mini App
+    Главный эндпоинт синхронизации с Mini App.
+    Ответ помечается ETag: при совпадении If-None-Match — 304 без обращения к БД.
     """
     try:
         data = await request.json()
@@ -278,83 +309,122 @@ async def handle_sync(request):
         user_data = data.get('userData', {})
         
         if not telegram_id:
-            return web.json_response({
+            return json_response({
                 'success': False,
                 'error': 'telegramId is required'
             }, status=400)
         
         telegram_id = int(telegram_id)
-        
-        # Получаем или создаём пользователя
-        user = await db.get_or_create_user(
-            telegram_id=telegram_id,
-            username=user_data.get('username'),
-            first_name=user_data.get('first_name', 'Пользователь')
-        )
-        
-        # Получаем подписки
-        subscriptions_raw = await db.get_user_subscriptions(telegram_id)
+        username = user_data.get('username')
+        first_name = user_data.get('first_name', 'Пользователь')
+        
+        # Данные не менялись с прошлого ответа — отдаём 304
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            cached = await sync_cache.get(telegram_id)
+            if cached is not MISSING:
+                etag, cached_username, cached_first_name, valid_until = cached
+                if (
+                    etag == if_none_match
+                    and (cached_username, cached_first_name) == (username, first_name)
+                    and valid_until > time.time()
+                ):
+                    return web.Response(status=304, headers={'ETag': if_none_match, 'Cache-Control': SYNC_CACHE_CONTROL})
+        
+        # Пользователь, подписки, итоги и дубликаты — в одной сессии
+        async with db.async_session() as session:
+            user, subscriptions_raw, summary = await db.load_sync_state(session, telegram_id, username, first_name)
+            alerts = await load_duplicate_alerts(session, user.id, user.duplicates_scanned_at, subscriptions_raw)
         
         # Конвертируем в формат для Mini App
-        subscriptions = [subscription_to_dict(sub) for sub in subscriptions_raw]
-        
-        # Вычисляем статистику
-        total_monthly = await db.get_monthly_spending(telegram_id)
+        subscriptions = await serialize_subscriptions(telegram_id, subscriptions_raw)
         
         # Находим скорые списания
-        upcoming = 0
-        trials = []
-        now = datetime.now()
-        today = date.today()
+        upcoming, trials = upcoming_payments(subscriptions_raw, date.today())
         
-        for sub in subscriptions:
-            try:
-                if sub['nextPayment']:
-                    next_date = datetime.fromisoformat(sub['nextPayment'].replace('Z', '+00:00'))
-                    days_until = (next_date.date() - today).days
-                    
-                    if 0 <= days_until <= 7:
-                        upcoming += 1
-                    
-                    if 0 <= days_until <= 3:
-                        trials.append({
-                            'id': sub['id'],
-                            'name': sub['name'],
-                            'endsIn': days_until,
-                            'price': sub['price'],
-                            'action': f"Списание {'сегодня' if days_until == 0 else 'завтра' if days_until == 1 else f'через {days_until} дн.'}"
-                        })
-            except Exception as e:
-                logger.warning(f"Error parsing date for {sub.get('name')}: {e}")
-        
-        # Проверяем дубликаты
-        duplicates = find_duplicates(subscriptions)
-        
-        # Проверяем премиум статус
-        is_premium = await db.is_premium(telegram_id)
-        
-        return web.json_response({
+        body = dumps({
             'success': True,
-            'user': {
-                'id': telegram_id,
-                'name': user.first_name or user.username or 'Пользователь',
-                'username': user.username or '',
-                'isPremium': is_premium
-            },
+            'user': sync_user_to_dict(user),
             'subscriptions': subscriptions,
-            'stats': {
-                'totalMonthly': total_monthly,
-                'totalYearly': round(total_monthly * 12, 2),
-                'activeCount': len(subscriptions),
-                'upcomingPayments': upcoming
-            },
-            'duplicates': duplicates,
+            'stats': sync_stats_to_dict(summary, upcoming),
+            'duplicates': [duplicate_alert_to_dict(alert) for alert in alerts],
             'trials': trials
         })
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        await sync_cache.set(telegram_id, (etag, username, first_name, _sync_valid_until(user)))
+        
+        headers = {'ETag': etag, 'Cache-Control': SYNC_CACHE_CONTROL}
+        if if_none_match == etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type=JSON_CONTENT_TYPE, headers=headers)
         
     except Exception as e:
         logger.error(f"Sync error: {e}", exc_info=True)
-        return web.json_response({
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+async def handle_sync_delta(request):
+    """
+    POST /api/sync/delta
+    Дельта-синхронизация: {"telegramId", "userData", "cursor", "changes": [...]}.
+    Возвращает только изменённое после cursor и новый cursor; без курсора — всё (full: true).
+    changes — офлайн-правки клиента: {"op": create | update | delete, "id" | "clientId", "subscription"}
+    """
+    try:
+        data = await request.json()
+        telegram_id = data.get('telegramId')
+        user_data = data.get('userData', {})
+        
+        if not telegram_id:
+            return json_response({
+                'success': False,
+                'error': 'telegramId is required'
+            }, status=400)
+        
+        changes = data.get('changes') or []
+        if not isinstance(changes, list) or len(changes) > MAX_BATCH_CHANGES:
+            return json_response({
+                'success': False,
+                'error': f'changes must be a list of at most {MAX_BATCH_CHANGES} items'
+            }, status=400)
+        
+        telegram_id = int(telegram_id)
+        since = decode_cursor(data.get('cursor'))
+        
+        async with db.async_session() as session:
+            delta = await load_sync_delta(
+                session,
+                telegram_id,
+                since,
+                changes=[parse_change(change) for change in changes],
+                username=user_data.get('username'),
+                first_name=user_data.get('first_name', 'Пользователь')
+            )
+        
+        upcoming, trials = upcoming_payments(delta.upcoming, date.today())
+        
+        return json_response({
+            'success': True,
+            'cursor': delta.cursor,
+            'full': delta.full,
+            'user': sync_user_to_dict(delta.user),
+            'subscriptions': await serialize_subscriptions(telegram_id, delta.subscriptions),
+            'deleted': delta.deleted,
+            'stats': sync_stats_to_dict(delta.summary, upcoming),
+            'duplicates': (
+                None if delta.duplicates is None
+                else [duplicate_alert_to_dict(alert) for alert in delta.duplicates]
+            ),
+            'trials': trials,
+            'results': delta.results
+        })
+        
+    except Exception as e:
+        logger.error(f"Delta sync error: {e}", exc_info=True)
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -368,15 +438,15 @@ async def handle_get_subscriptions(request):
     try:
         telegram_id = int(request.match_info['telegram_id'])
         subscriptions_raw = await db.get_user_subscriptions(telegram_id)
-        subscriptions = [subscription_to_dict(sub) for sub in subscriptions_raw]
+        subscriptions = await serialize_subscriptions(telegram_id, subscriptions_raw)
         
-        return web.json_response({
+        return json_response({
             'success': True,
             'subscriptions': subscriptions
         })
     except Exception as e:
         logger.error(f"Get subscriptions error: {e}")
-        return web.json_response({
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -396,20 +466,21 @@ async def handle_add_subscription(request):
         next_payment = sub_data.get('nextPayment')
         if next_payment:
             if isinstance(next_payment, str):
-                # Пробуем разные форматы
                 try:
                     start_date = datetime.fromisoformat(next_payment.replace('Z', '+00:00')).date()
                 except:
-                    start_date = datetime.strptime(next_payment[:10], '%Y-%m-%d').date()
+                    try:
+                        start_date = datetime.strptime(next_payment[:10], '%Y-%m-%d').date()
+                    except:
+                        start_date = date.today() + timedelta(days=30)
             else:
                 start_date = date.today() + timedelta(days=30)
         else:
             start_date = date.today() + timedelta(days=30)
         
-        # Определяем billing_cycle (по умолчанию monthly)
+        # Определяем billing_cycle
         billing_cycle_str = sub_data.get('billingCycle', 'monthly').lower()
         
-        # Импортируем BillingCycle из models
         from .models import BillingCycle
         
         billing_cycle_map = {
@@ -417,94 +488,118 @@ async def handle_add_subscription(request):
             'monthly': BillingCycle.MONTHLY,
             'quarterly': BillingCycle.QUARTERLY,
             'yearly': BillingCycle.YEARLY,
+            'lifetime': BillingCycle.LIFETIME,
         }
         billing_cycle = billing_cycle_map.get(billing_cycle_str, BillingCycle.MONTHLY)
         
-        # Добавляем подписку
+        # Добавляем подписку со всеми полями
         new_sub = await db.add_subscription(
             telegram_id=telegram_id,
             name=sub_data.get('name'),
             price=float(sub_data.get('price', 0)),
             billing_cycle=billing_cycle,
             start_date=start_date,
-            # Дополнительные поля если есть в модели
-            # icon=sub_data.get('icon'),
-            # category=sub_data.get('category'),
-            # color=sub_data.get('color'),
+            icon=sub_data.get('icon'),
+            category=sub_data.get('category'),
+            color=sub_data.get('color'),
+            currency=sub_data.get('currency', 'RUB'),
         )
         
-        return web.json_response({
+        return json_response({
             'success': True,
-            'subscription': subscription_to_dict(new_sub)
+            'subscription': subscription_to_struct(new_sub)
         })
     except Exception as e:
         logger.error(f"Add subscription error: {e}", exc_info=True)
-        return web.json_response({
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
 
 
-async def handle_add_subscription(request):
+async def handle_update_subscription(request):
     """
-    POST /api/subscriptions
-    Добавить новую подписку
+    PUT /api/subscriptions/{id}
+    Обновить подписку
     """
     try:
-        data = await request.json()
-        telegram_id = int(data.get('telegramId'))
-        sub_data = data.get('subscription', {})
-        
-        # Парсим дату
-        next_payment = sub_data.get('nextPayment')
-        if next_payment:
-            if isinstance(next_payment, str):
-                try:
-                    start_date = datetime.fromisoformat(next_payment.replace('Z', '+00:00')).date()
-                except:
-                    try:
-                        start_date = datetime.strptime(next_payment[:10], '%Y-%m-%d').date()
-                    except:
-                        start_date = date.today() + timedelta(days=30)
-            else:
-                start_date = date.today() + timedelta(days=30)
-        else:
-            start_date = date.today() + timedelta(days=30)
-        
-        # Определяем billing_cycle
-        billing_cycle_str = sub_data.get('billingCycle', 'monthly').lower()
+        sub_id = int(request.match_info['id'])
+        sub_data = await request.json()
         
         from .models import BillingCycle
         
-        billing_cycle_map = {
-            'weekly': BillingCycle.WEEKLY,
-            'monthly': BillingCycle.MONTHLY,
-            'quarterly': BillingCycle.QUARTERLY,
-            'yearly': BillingCycle.YEARLY,
-            'lifetime': BillingCycle.LIFETIME,
-        }
-        billing_cycle = billing_cycle_map.get(billing_cycle_str, BillingCycle.MONTHLY)
+        billing_cycle = None
+        if sub_data.get('billingCycle'):
+            billing_cycle = BillingCycle(sub_data['billingCycle'].lower())
         
-        # Добавляем подписку со всеми полями
-        new_sub = await db.add_subscription(
-            telegram_id=telegram_id,
+        sub = await db.update_subscription(
+            sub_id,
             name=sub_data.get('name'),
-            price=float(sub_data.get('price', 0)),
-            billing_cycle=billing_cycle,
-            start_date=start_date,
+            price=float(sub_data['price']) if sub_data.get('price') is not None else None,
+            next_payment=sub_data.get('nextPayment'),
             icon=sub_data.get('icon'),
             category=sub_data.get('category'),
             color=sub_data.get('color'),
-            currency=sub_data.get('currency', 'RUB'),
+            billing_cycle=billing_cycle,
         )
         
-        return web.json_response({
+        if not sub:
+            return json_response({
+                'success': False,
+                'error': 'Subscription not found'
+            }, status=404)
+        
+        return json_response({
             'success': True,
-            'subscription': subscription_to_dict(new_sub)
+            'subscription': subscription_to_struct(sub)
         })
     except Exception as e:
-        logger.error(f"Add subscription error: {e}", exc_info=True)
-        return web.json_response({
+        logger.error(f"Update subscription error: {e}", exc_info=True)
+        return json_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+async def handle_subscriptions_batch(request):
+    """
+    POST /api/subscriptions/batch
+    Пакет правок одной транзакцией: {"telegramId", "changes": [{"op", "id" | "clientId", "subscription"}]}.
+    Результат — по каждой правке, с подпиской для create / update
+    """
+    try:
+        data = await request.json()
+        telegram_id = data.get('telegramId')
+        changes = data.get('changes')
+        
+        if not telegram_id:
+            return json_response({
+                'success': False,
+                'error': 'telegramId is required'
+            }, status=400)
+        
+        if not isinstance(changes, list) or not changes or len(changes) > MAX_BATCH_CHANGES:
+            return json_response({
+                'success': False,
+                'error': f'changes must be a list of 1 to {MAX_BATCH_CHANGES} items'
+            }, status=400)
+        
+        results, subscriptions = await apply_subscription_batch(
+            int(telegram_id), [parse_change(change) for change in changes]
+        )
+        
+        for result in results:
+            sub = subscriptions.get(result['id']) if result['status'] == 'ok' else None
+            if sub is not None:
+                result['subscription'] = subscription_to_struct(sub)
+        
+        return json_response({
+            'success': True,
+            'results': results
+        })
+    except Exception as e:
+        logger.error(f"Batch subscriptions error: {e}", exc_info=True)
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -520,10 +615,10 @@ async def handle_delete_subscription(request):
         
         await db.delete_subscription(sub_id)
         
-        return web.json_response({'success': True})
+        return json_response({'success': True})
     except Exception as e:
         logger.error(f"Delete subscription error: {e}")
-        return web.json_response({
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -536,23 +631,82 @@ async def handle_duplicates(request):
     """
     try:
         telegram_id = int(request.match_info['telegram_id'])
-        subscriptions_raw = await db.get_user_subscriptions(telegram_id)
-        subscriptions = [subscription_to_dict(sub) for sub in subscriptions_raw]
+        duplicates = [duplicate_alert_to_dict(alert) for alert in await get_duplicate_alerts(telegram_id)]
         
-        duplicates = find_duplicates(subscriptions)
-        
-        return web.json_response({
+        return json_response({
             'success': True,
             'duplicates': duplicates
         })
     except Exception as e:
         logger.error(f"Duplicates error: {e}")
-        return web.json_response({
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
 
 
+async def handle_catalog_search(request):
+    """
+    GET /api/catalog/search?q=...&limit=10
+    Поиск сервисов в каталоге
+    """
+    query = request.query.get('q', '').strip()
+    try:
+        limit = min(int(request.query.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    
+    results = search_subscriptions(query, limit) if query else []
+    
+    return json_response({
+        'success': True,
+        'results': [
+            {
+                'id': service['id'],
+                'name': service['name'],
+                'icon': service.get('icon'),
+                'color': service.get('color'),
+                'category': service.get('category'),
+                'price': service.get('default_price')
+            }
+            for service in results
+        ]
+    })
+
+
+async def handle_export(request):
+    """
+    GET /api/export/{telegram_id}?format=csv|jsonl|xlsx
+    Выгрузка подписок и списаний (Премиум), отдаётся потоком
+    """
+    telegram_id = int(request.match_info['telegram_id'])
+    export_format = request.query.get('format', 'csv')
+    
+    if export_format not in EXPORT_FORMATS:
+        return json_response({
+            'success': False,
+            'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"
+        }, status=400)
+    
+    if not await db.is_premium(telegram_id):
+        return json_response({
+            'success': False,
+            'error': 'Premium required'
+        }, status=403)
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': EXPORT_FORMATS[export_format][1],
+        'Content-Disposition': f'attachment; filename="{export_filename(export_format)}"'
+    })
+    await response.prepare(request)
+    
+    async for chunk in iter_export(telegram_id, export_format):
+        await response.write(chunk)
+    
+    await response.write_eof()
+    return response
+
+
 async def handle_cancel_guide(request):
     """
     GET /api/cancel-guides/{service}
@@ -680,7 +834,7 @@ async def handle_cancel_guide(request):
         'note': 'Если не получается — обратитесь в поддержку сервиса.'
     })
     
-    return web.json_response({
+    return json_response({
         'success': True,
         'guide': guide
     })
@@ -705,13 +859,13 @@ async def handle_create_payment(request):
             import os
             bot_username = os.getenv('BOT_USERNAME', 'your_bot')
         
-        return web.json_response({
+        return json_response({
             'success': True,
             'paymentUrl': f'https://t.me/{bot_username}?start=donate_{amount}'
         })
     except Exception as e:
         logger.error(f"Create payment error: {e}")
-        return web.json_response({
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -725,23 +879,23 @@ async def handle_analytics(request):
     try:
         telegram_id = int(request.match_info['telegram_id'])
         subscriptions_raw = await db.get_user_subscriptions(telegram_id)
-        subscriptions = [subscription_to_dict(sub) for sub in subscriptions_raw]
+        subscriptions = await serialize_subscriptions(telegram_id, subscriptions_raw)
         
         # Группировка по категориям
         by_category = {}
         for sub in subscriptions:
-            cat = sub.get('category', 'Другое')
+            cat = sub.category
             if cat not in by_category:
                 by_category[cat] = {'total': 0, 'count': 0, 'items': []}
-            by_category[cat]['total'] += sub.get('price', 0)
+            by_category[cat]['total'] += sub.price
             by_category[cat]['count'] += 1
-            by_category[cat]['items'].append(sub.get('name'))
+            by_category[cat]['items'].append(sub.name)
         
-        total = sum(s.get('price', 0) for s in subscriptions)
+        total = sum(s.price for s in subscriptions)
         avg = total / len(subscriptions) if subscriptions else 0
-        most_expensive = max(subscriptions, key=lambda x: x.get('price', 0)) if subscriptions else None
+        most_expensive = max(subscriptions, key=lambda x: x.price) if subscriptions else None
         
-        return web.json_response({
+        return json_response({
             'success': True,
             'analytics': {
                 'byCategory': by_category,
@@ -753,7 +907,7 @@ async def handle_analytics(request):
         })
     except Exception as e:
         logger.error(f"Analytics error: {e}")
-        return web.json_response({
+        return json_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -761,10 +915,11 @@ async def handle_analytics(request):
 
 async def handle_health(request):
     """GET /health - Health check"""
-    return web.json_response({
+    return json_response({
         'status': 'ok',
         'service': 'SubTrack API',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'cache': cache_stats()
     })
 
 
@@ -805,7 +960,8 @@ def create_app():
         
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Telegram-Init-Data, X-Telegram-Id'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Telegram-Init-Data, X-Telegram-Id, If-None-Match'
+        response.headers['Access-Control-Expose-Headers'] = 'ETag'
         return response
     
     app.middlewares.append(cors_middleware)
@@ -819,11 +975,15 @@ def create_app():
     app.router.add_route('OPTIONS', '/{path:.*}', lambda r: web.Response())
     app.router.add_get('/health', handle_health)
     app.router.add_post('/api/sync', handle_sync)
+    app.router.add_post('/api/sync/delta', handle_sync_delta)
     app.router.add_get('/api/subscriptions/{telegram_id}', handle_get_subscriptions)
     app.router.add_post('/api/subscriptions', handle_add_subscription)
+    app.router.add_post('/api/subscriptions/batch', handle_subscriptions_batch)
     app.router.add_put('/api/subscriptions/{id}', handle_update_subscription)
     app.router.add_delete('/api/subscriptions/{id}', handle_delete_subscription)
     app.router.add_get('/api/duplicates/{telegram_id}', handle_duplicates)
+    app.router.add_get('/api/catalog/search', handle_catalog_search)
+    app.router.add_get('/api/export/{telegram_id}', handle_export)
     app.router.add_get('/api/cancel-guides/{service}', handle_cancel_guide)
     app.router.add_post('/api/payments/create', handle_create_payment)
     app.router.add_get('/api/analytics/{telegram_id}', handle_analytics)
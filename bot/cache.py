@@ -0,0 +1,273 @@
+"""
+🗄️ Кэш пользователей и подписок
+В памяти процесса (TTL + LRU) или в Redis — общий для всех процессов бота и API
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import orjson
+from sqlalchemy import Date, DateTime, Enum, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from .config import config
+from .models import User, Subscription
+
+logger = logging.getLogger(__name__)
+
+
+# Отличаем «нет в кэше» от закэшированного None (пользователь не найден)
+MISSING = object()
+
+_redis = None
+
+
+def get_redis():
+    """
+    Общий клиент Redis по REDIS_URL (None, если Redis не настроен).
+    fakeredis://... — Redis в памяти процесса для тестов и локального запуска.
+    """
+    global _redis
+
+    if _redis is None and config.REDIS_URL:
+        if config.REDIS_URL.startswith("fakeredis://"):
+            from fakeredis.aioredis import FakeRedis
+            _redis = FakeRedis()
+        else:
+            from redis.asyncio import Redis
+            _redis = Redis.from_url(config.REDIS_URL)
+        logger.info("🗄️ Кэш и FSM: Redis")
+
+    return _redis
+
+
+class MemoryBackend:
+    """Словарь с ограничением размера (LRU) и временем жизни записей"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Any:
+        entry = self._data.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            return MISSING
+
+        self._data.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def clear(self, prefix: str):
+        self._data.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._data)
+
+
+# ============ СЕРИАЛИЗАЦИЯ ДЛЯ REDIS ============
+# Только данные, без pickle: значение из общего Redis не исполняет код при чтении,
+# а записанное прошлой версией моделей после деплоя становится промахом, а не ошибкой
+
+class JsonCodec:
+    """Строки, числа и кортежи из них (кортеж возвращается списком)"""
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(self, raw: bytes) -> Any:
+        return orjson.loads(raw)
+
+
+class ModelCodec:
+    """
+    Объект ORM (или None) — словарь колонок в JSON; many=True — кортеж объектов.
+    Обратно — отсоединённые объекты, как после закрытия сессии.
+    Набор колонок не совпал с моделью (данные прошлого деплоя) — MISSING
+    """
+
+    def __init__(self, model, many: bool = False):
+        self.model = model
+        self.many = many
+        self.columns = {attr.key: attr.columns[0].type for attr in inspect(model).column_attrs}
+
+    def _encode(self, obj) -> dict:
+        # Только загруженное — без ленивых запросов; недогруженный объект при чтении станет промахом
+        state = inspect(obj).dict
+        return {key: state[key] for key in self.columns if key in state}
+
+    def _decode(self, values: dict):
+        if values.keys() != self.columns.keys():
+            return MISSING
+        obj = self.model(**{key: _from_json(self.columns[key], value) for key, value in values.items()})
+        make_transient_to_detached(obj)
+        return obj
+
+    def dumps(self, value: Any) -> bytes:
+        if self.many:
+            return orjson.dumps([self._encode(obj) for obj in value])
+        return orjson.dumps(None if value is None else self._encode(value))
+
+    def loads(self, raw: bytes) -> Any:
+        data = orjson.loads(raw)
+        if not self.many:
+            return None if data is None else self._decode(data)
+
+        objects = tuple(self._decode(values) for values in data)
+        return MISSING if any(obj is MISSING for obj in objects) else objects
+
+
+def _from_json(column_type, value):
+    """Значение колонки из JSON: даты — из ISO-строк, Enum — из value"""
+    if value is None:
+        return None
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column_type, Date):
+        return date.fromisoformat(value)
+    if isinstance(column_type, Enum) and column_type.enum_class is not None:
+        return column_type.enum_class(value)
+    return value
+
+
+class RedisBackend:
+    """Redis: значения сериализуются кодеком кэша, срок жизни — PX, LRU — maxmemory-policy сервера"""
+
+    def __init__(self, redis, codec):
+        self.redis = redis
+        self.codec = codec
+
+    async def get(self, key: str) -> Any:
+        raw = await self.redis.get(key)
+        if raw is None:
+            return MISSING
+        return self.codec.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.redis.set(key, self.codec.dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self.redis.delete(key)
+
+    async def clear(self, prefix: str):
+        keys = []
+        async for key in self.redis.scan_iter(match=f"{prefix}*", count=1000):
+            keys.append(key)
+            if len(keys) >= 1000:
+                await self.redis.delete(*keys)
+                keys = []
+        if keys:
+            await self.redis.delete(*keys)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class Cache:
+    """
+    Именованный кэш поверх выбранного бэкенда, со статистикой попаданий.
+    dependents — кэши, производные от этого: сбрасываются вместе с ним.
+    codec — как значения хранятся в Redis (в памяти процесса хранятся сами объекты).
+    """
+
+    def __init__(
+        self, name: str, maxsize: int, ttl: float, dependents: Tuple["Cache", ...] = (), codec=None
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.dependents = dependents
+        self.codec = codec or JsonCodec()
+        self.hits = 0
+        self.misses = 0
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            redis = get_redis()
+            self._backend = RedisBackend(redis, self.codec) if redis is not None else MemoryBackend(self.maxsize)
+        return self._backend
+
+    def _key(self, key: Hashable) -> str:
+        return f"cache:{self.name}:{key}"
+
+    async def get(self, key: Hashable) -> Any:
+        """Значение из кэша или MISSING"""
+        try:
+            value = await self.backend.get(self._key(key))
+        except Exception as e:
+            logger.warning(f"Кэш {self.name} недоступен: {e}")
+            value = MISSING
+
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: Hashable, value: Any):
+        try:
+            await self.backend.set(self._key(key), value, self.ttl)
+        except Exception as e:
+            logger.warning(f"Кэш {self.name} недоступен: {e}")
+
+    async def invalidate(self, key: Hashable):
+        await self.backend.delete(self._key(key))
+        for dependent in self.dependents:
+            await dependent.invalidate(key)
+
+    async def clear(self):
+        await self.backend.clear(self._key(""))
+        for dependent in self.dependents:
+            await dependent.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": "redis" if isinstance(self.backend, RedisBackend) else "memory",
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# Ключ — telegram_id
+# ETag последнего ответа /api/sync: сбрасывается при любом сбросе пользователя или подписок
+sync_cache = Cache("sync", config.CACHE_MAX_USERS, config.CACHE_TTL)
+user_cache = Cache(
+    "users", config.CACHE_MAX_USERS, config.CACHE_TTL,
+    dependents=(sync_cache,), codec=ModelCodec(User)
+)
+subscriptions_cache = Cache(
+    "subscriptions", config.CACHE_MAX_USERS, config.CACHE_TTL,
+    dependents=(sync_cache,), codec=ModelCodec(Subscription, many=True)
+)
+
+
+async def invalidate_user(telegram_id: Optional[int]):
+    """Сбросить всё закэшированное по пользователю"""
+    if telegram_id is None:
+        return
+    await user_cache.invalidate(telegram_id)
+    await subscriptions_cache.invalidate(telegram_id)
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Метрики кэшей для health-эндпоинтов (счётчики — по текущему процессу)"""
+    return {cache.name: cache.stats() for cache in (user_cache, subscriptions_cache, sync_cache)}
@@ -13,6 +13,27 @@ class Config:
     PREMIUM_YEARLY_PRICE: int = 799
     LIFETIME_PRICE: int = 1499
     FREE_SUBSCRIPTIONS_LIMIT: int = 5
+    # Рассылки: Telegram пропускает ~30 сообщений/сек и ~1 сообщение/сек в чат
+    DELIVERY_WORKERS: int = int(os.getenv("DELIVERY_WORKERS", "8"))
+    DELIVERY_RATE_LIMIT: float = float(os.getenv("DELIVERY_RATE_LIMIT", "25"))
+    DELIVERY_PER_CHAT_INTERVAL: float = 1.0
+    DELIVERY_MAX_RETRIES: int = 5
+    # Кэш пользователей и списков подписок (секунды / число пользователей)
+    CACHE_TTL: float = float(os.getenv("CACHE_TTL", "60"))
+    CACHE_MAX_USERS: int = int(os.getenv("CACHE_MAX_USERS", "10000"))
+    # Общий Redis для кэша и FSM (несколько процессов бота и API); пусто — всё в памяти
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+    # Webhook вместо long polling, если задан WEBHOOK_URL (https://host без пути)
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook/telegram")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "16"))
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    DUPLICATE_SCAN_WORKERS: int = int(os.getenv("DUPLICATE_SCAN_WORKERS", "2"))
+    # При нескольких репликах планировщик должен работать только в одной
+    SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
 
 config = Config()
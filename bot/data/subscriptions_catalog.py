@@ -632,14 +632,10 @@ def get_subscriptions_by_category(category: str) -> list:
         if v.get("category") == category
     ]
 
-def search_subscriptions(query: str) -> list:
-    """Поиск подписок"""
-    query = query.lower()
-    results = []
-    for k, v in SUBSCRIPTIONS_CATALOG.items():
-        if query in v["name"].lower() or query in k:
-            results.append({"id": k, **v})
-    return results
+def search_subscriptions(query: str, limit: int = None) -> list:
+    """Поиск подписок: с опечатками, транслитом и по началу слова, лучшие первыми"""
+    from ..services.catalog_search import search_catalog
+    return search_catalog(query, limit)
 
 def get_all_categories() -> dict:
     """Получить все категории"""
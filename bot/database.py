@@ -1,11 +1,20 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update, case, insert, and_, bindparam, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, date, timedelta
-from typing import Optional, List
+from calendar import monthrange
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from typing import Optional, List, Dict, AsyncIterator, Tuple
 import os
 import logging
 
-from .models import Base, User, Subscription, SubscriptionStatus, BillingCycle, PremiumType
+from .models import (
+    Base, User, Subscription, SubscriptionCharge, SpendingSnapshot, UserSpendingSummary, SyncTombstone,
+    SubscriptionStatus, BillingCycle, PremiumType,
+    DEFAULT_TIMEZONE, get_notify_slot_utc
+)
+from .cache import MISSING, user_cache, subscriptions_cache, invalidate_user
 
 logger = logging.getLogger(__name__)
 
@@ -56,114 +65,457 @@ async def get_or_create_user(telegram_id: int, username: str = None, first_name:
             session.add(user)
             await session.commit()
             await session.refresh(user)
-        else:
-            if username: user.username = username
-            if first_name: user.first_name = first_name
+        elif _apply_user_names(user, username, first_name):
+            # Коммитим, только если имя действительно поменялось
             await session.commit()
+        await user_cache.set(telegram_id, user)
         return user
 
+def _apply_user_names(user: User, username: str = None, first_name: str = None) -> bool:
+    """Обновить имя из Telegram; True — если что-то изменилось"""
+    changed = False
+    if username and user.username != username:
+        user.username = username
+        changed = True
+    if first_name and user.first_name != first_name:
+        user.first_name = first_name
+        changed = True
+    return changed
+
 async def get_user(telegram_id: int) -> Optional[User]:
+    cached = await user_cache.get(telegram_id)
+    if cached is not MISSING:
+        return cached
     async with async_session() as session:
         result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        return result.scalar_one_or_none()
+        user = result.scalar_one_or_none()
+    await user_cache.set(telegram_id, user)
+    return user
 
 async def is_premium(telegram_id: int) -> bool:
-    user = await get_user(telegram_id)
+    return has_premium(await get_user(telegram_id))
+
+def has_premium(user: Optional[User]) -> bool:
     if not user: return False
     if user.premium_type == PremiumType.LIFETIME: return True
     if user.premium_type != PremiumType.FREE and user.premium_expires and user.premium_expires > datetime.utcnow():
         return True
     return False
 
+async def load_sync_state(
+    session: AsyncSession, telegram_id: int, username: str = None, first_name: str = None
+) -> Tuple[User, List[Subscription], UserSpendingSummary]:
+    """
+    Пользователь, его подписки (кроме отменённых) и итоги — одним запросом с JOIN.
+    В БД пишет только _prepare_sync_user.
+    """
+    result = await session.execute(
+        select(User, Subscription, UserSpendingSummary)
+        .outerjoin(Subscription, and_(
+            Subscription.user_id == User.id,
+            Subscription.status != SubscriptionStatus.CANCELLED,
+        ))
+        .outerjoin(UserSpendingSummary, UserSpendingSummary.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .order_by(Subscription.next_billing_date)
+    )
+    rows = result.all()
+    user, _, summary = rows[0] if rows else (None, None, None)
+    subscriptions = [sub for _, sub, _ in rows if sub is not None]
+    
+    user, summary = await _prepare_sync_user(session, telegram_id, user, summary, username, first_name)
+    await subscriptions_cache.set(telegram_id, tuple(subscriptions))
+    return user, subscriptions, summary
+
+async def load_sync_user(
+    session: AsyncSession, telegram_id: int, username: str = None, first_name: str = None
+) -> Tuple[User, UserSpendingSummary]:
+    """Пользователь и его итоги одним запросом — без списка подписок (дельта-синхронизация)"""
+    result = await session.execute(
+        select(User, UserSpendingSummary)
+        .outerjoin(UserSpendingSummary, UserSpendingSummary.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+    )
+    user, summary = result.first() or (None, None)
+    return await _prepare_sync_user(session, telegram_id, user, summary, username, first_name)
+
+async def _prepare_sync_user(
+    session: AsyncSession, telegram_id: int, user: Optional[User], summary: Optional[UserSpendingSummary],
+    username: str = None, first_name: str = None
+) -> Tuple[User, UserSpendingSummary]:
+    """
+    Завести пользователя, обновить имя, создать строку итогов.
+    Пишет в БД, только если пользователь новый, сменил имя или у него ещё нет строки итогов.
+    """
+    changed = False
+    if user is None:
+        user = User(telegram_id=telegram_id, username=username, first_name=first_name)
+        session.add(user)
+        await session.flush()
+        changed = True
+    else:
+        changed = _apply_user_names(user, username, first_name)
+    
+    if summary is None:
+        await refresh_user_summaries(session, [user.id])
+        summary = await session.get(UserSpendingSummary, user.id)
+        changed = True
+    
+    if changed:
+        await session.commit()
+    
+    await user_cache.set(telegram_id, user)
+    return user, summary
+
 # ========================================
 # ОПЕРАЦИИ С ПОДПИСКАМИ
 # ========================================
-async def add_subscription(telegram_id: int, name: str, price: float, billing_cycle: BillingCycle, start_date: date, **kwargs) -> Subscription:
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            user = User(telegram_id=telegram_id)
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
-        next_billing = calculate_next_billing(start_date, billing_cycle)
-        sub = Subscription(
-            user_id=user.id, 
-            name=name, 
-            price=price, 
-            billing_cycle=billing_cycle, 
-            start_date=start_date, 
-            next_billing_date=next_billing, 
-            **kwargs
-        )
-        session.add(sub)
-        await session.commit()
-        await session.refresh(sub)
-        return sub
+# Множитель цены до месячной; пожизненная подписка ежемесячно ничего не стоит
+MONTHLY_MULTIPLIERS = {
+    BillingCycle.WEEKLY: 4.33,
+    BillingCycle.MONTHLY: 1,
+    BillingCycle.QUARTERLY: 1/3,
+    BillingCycle.YEARLY: 1/12,
+    BillingCycle.LIFETIME: 0,
+}
+
+# Цена подписки в пересчёте на месяц — то же, что get_monthly_equivalent, но в SQL
+MONTHLY_PRICE_SQL = case(
+    *[
+        (Subscription.billing_cycle == cycle, Subscription.price * multiplier)
+        for cycle, multiplier in MONTHLY_MULTIPLIERS.items()
+    ],
+    else_=Subscription.price,
+)
+
+def _user_subscriptions_query(telegram_id: int):
+    """Подписки пользователя по telegram_id — один запрос с JOIN"""
+    return (
+        select(Subscription)
+        .join(User, Subscription.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+    )
 
 async def get_user_subscriptions(telegram_id: int) -> List[Subscription]:
+    cached = await subscriptions_cache.get(telegram_id)
+    if cached is not MISSING:
+        return list(cached)
     async with async_session() as session:
-        user = await get_user(telegram_id)
-        if not user: return []
         result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user.id)
+            _user_subscriptions_query(telegram_id)
             .where(Subscription.status != SubscriptionStatus.CANCELLED)
             .order_by(Subscription.next_billing_date)
         )
-        return list(result.scalars().all())
+        subs = list(result.scalars().all())
+    await subscriptions_cache.set(telegram_id, tuple(subs))
+    return subs
 
 async def get_subscription(subscription_id: int) -> Optional[Subscription]:
     async with async_session() as session:
         result = await session.execute(select(Subscription).where(Subscription.id == subscription_id))
         return result.scalar_one_or_none()
 
+async def mark_duplicates_stale(session: AsyncSession, user_ids: List[int]):
+    """
+    Подписки изменились — сохранённые дубликаты пересчитаются при следующем просмотре.
+    UPDATE выполняется всегда, даже если флаг уже сброшен: он двигает users.updated_at,
+    по которому ночной поиск дубликатов видит правки, сделанные во время его прогона
+    """
+    await session.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(duplicates_scanned_at=None)
+    )
+
+def _subscription_with_owner_query(subscription_id: int):
+    """Подписка вместе с telegram_id владельца (для сброса кэша)"""
+    return (
+        select(Subscription, User.telegram_id)
+        .join(User, Subscription.user_id == User.id)
+        .where(Subscription.id == subscription_id)
+    )
+
 async def delete_subscription(subscription_id: int):
     async with async_session() as session:
-        result = await session.execute(select(Subscription).where(Subscription.id == subscription_id))
-        sub = result.scalar_one_or_none()
-        if sub:
+        result = await session.execute(_subscription_with_owner_query(subscription_id))
+        row = result.first()
+        if row:
+            sub, telegram_id = row
+            # История списаний остаётся — для выгрузки и снимков расходов
+            await session.execute(
+                update(SubscriptionCharge)
+                .where(SubscriptionCharge.subscription_id == sub.id)
+                .values(subscription_id=None)
+            )
             await session.delete(sub)
+            session.add(SyncTombstone(user_id=sub.user_id, entity_id=sub.id))
+            await mark_duplicates_stale(session, [sub.user_id])
+            await refresh_user_summaries(session, [sub.user_id])
             await session.commit()
+            await subscriptions_cache.invalidate(telegram_id)
 
 async def get_monthly_spending(telegram_id: int) -> float:
-    subs = await get_user_subscriptions(telegram_id)
-    total = 0.0
-    for s in subs:
-        if s.status == SubscriptionStatus.ACTIVE:
-            total += get_monthly_equivalent(s.price, s.billing_cycle)
-    return round(total, 2)
+    summary = await get_spending_summary(telegram_id)
+    return round(summary.monthly_total or 0.0, 2)
+
+async def get_yearly_spending(telegram_id: int) -> float:
+    return round(await get_monthly_spending(telegram_id) * 12, 2)
+
+async def get_spending_by_category(telegram_id: int) -> Dict[str, float]:
+    """Расходы в месяц по категориям, от больших к меньшим"""
+    monthly = func.sum(MONTHLY_PRICE_SQL)
+    async with async_session() as session:
+        result = await session.execute(
+            select(func.coalesce(Subscription.category, "other"), monthly)
+            .join(User, Subscription.user_id == User.id)
+            .where(User.telegram_id == telegram_id)
+            .where(Subscription.status == SubscriptionStatus.ACTIVE)
+            .group_by(func.coalesce(Subscription.category, "other"))
+            .order_by(monthly.desc())
+        )
+        return {category: round(float(total), 2) for category, total in result.all()}
 
 async def get_subscriptions_count(telegram_id: int) -> int:
-    subs = await get_user_subscriptions(telegram_id)
-    return len(subs)
+    summary = await get_spending_summary(telegram_id)
+    return summary.subscriptions_count or 0
+
+# ========================================
+# ИТОГИ ПО ПОДПИСКАМ (user_spending_summary)
+# ========================================
+SUMMARY_FIELDS = [
+    "subscriptions_count", "active_count", "paused_count", "trials_count",
+    "monthly_total", "next_billing_date", "next_billing_amount",
+]
+
+def _empty_summary() -> dict:
+    return {
+        "subscriptions_count": 0, "active_count": 0, "paused_count": 0, "trials_count": 0,
+        "monthly_total": 0.0, "next_billing_date": None, "next_billing_amount": 0.0,
+    }
+
+async def _compute_summaries(session: AsyncSession, user_ids: List[int]) -> Dict[int, dict]:
+    """Итоги пачки пользователей по текущим подпискам — два агрегирующих запроса на всю пачку"""
+    summaries = {user_id: _empty_summary() for user_id in user_ids}
+    is_active = Subscription.status == SubscriptionStatus.ACTIVE
+    
+    result = await session.execute(
+        select(
+            Subscription.user_id,
+            func.count(Subscription.id),
+            func.sum(case((is_active, 1), else_=0)),
+            func.sum(case((Subscription.status == SubscriptionStatus.PAUSED, 1), else_=0)),
+            func.sum(case((Subscription.is_trial.is_(True), 1), else_=0)),
+            func.sum(case((is_active, MONTHLY_PRICE_SQL), else_=0.0)),
+        )
+        .where(Subscription.user_id.in_(user_ids))
+        .where(Subscription.status != SubscriptionStatus.CANCELLED)
+        .group_by(Subscription.user_id)
+    )
+    for user_id, total, active, paused, trials, monthly in result.all():
+        summaries[user_id].update(
+            subscriptions_count=total,
+            active_count=active or 0,
+            paused_count=paused or 0,
+            trials_count=trials or 0,
+            monthly_total=round(float(monthly or 0.0), 2),
+        )
+    
+    # Ближайшее списание — самая ранняя дата среди активных и сумма всех списаний этого дня
+    billable = and_(
+        is_active,
+        Subscription.billing_cycle != BillingCycle.LIFETIME,
+        Subscription.user_id.in_(user_ids),
+    )
+    next_dates = (
+        select(Subscription.user_id, func.min(Subscription.next_billing_date).label("next_date"))
+        .where(billable)
+        .group_by(Subscription.user_id)
+        .subquery()
+    )
+    result = await session.execute(
+        select(next_dates.c.user_id, next_dates.c.next_date, func.sum(Subscription.price))
+        .select_from(next_dates)
+        .join(Subscription, and_(
+            Subscription.user_id == next_dates.c.user_id,
+            Subscription.next_billing_date == next_dates.c.next_date,
+        ))
+        .where(billable)
+        .group_by(next_dates.c.user_id, next_dates.c.next_date)
+    )
+    for user_id, next_date, amount in result.all():
+        summaries[user_id].update(next_billing_date=next_date, next_billing_amount=round(float(amount or 0.0), 2))
+    
+    return summaries
+
+async def _save_summaries(session: AsyncSession, summaries: Dict[int, dict]):
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(UserSpendingSummary)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={field: stmt.excluded[field] for field in SUMMARY_FIELDS + ["updated_at"]}
+    )
+    updated_at = datetime.utcnow()
+    await session.execute(
+        stmt,
+        [dict(summary, user_id=user_id, updated_at=updated_at) for user_id, summary in summaries.items()]
+    )
+
+async def refresh_user_summaries(session: AsyncSession, user_ids: List[int]):
+    """
+    Пересчитать итоги пользователей внутри транзакции записи подписок —
+    итоги коммитятся вместе с изменением или не коммитятся вовсе.
+    """
+    if user_ids:
+        await _save_summaries(session, await _compute_summaries(session, list(user_ids)))
+
+async def get_spending_summary(telegram_id: int) -> UserSpendingSummary:
+    """Итоги пользователя одним чтением по ключу; нет строки — считаются и сохраняются"""
+    async with async_session() as session:
+        query = (
+            select(UserSpendingSummary)
+            .join(User, UserSpendingSummary.user_id == User.id)
+            .where(User.telegram_id == telegram_id)
+        )
+        summary = (await session.execute(query)).scalar_one_or_none()
+        if summary is not None:
+            return summary
+        
+        # Пользователь появился раньше таблицы итогов
+        result = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+        user_id = result.scalar_one_or_none()
+        if user_id is None:
+            return UserSpendingSummary(**_empty_summary())
+        
+        await refresh_user_summaries(session, [user_id])
+        await session.commit()
+        return (await session.execute(query)).scalar_one()
+
+def _summary_differs(stored: Optional[UserSpendingSummary], fresh: dict) -> bool:
+    if stored is None:
+        return True
+    for field in SUMMARY_FIELDS:
+        value, expected = getattr(stored, field), fresh[field]
+        if isinstance(expected, float):
+            if abs((value or 0.0) - expected) > 0.01:
+                return True
+        elif value != expected:
+            return True
+    return False
+
+async def reconcile_spending_summaries(chunk_size: int = 1000) -> int:
+    """
+    Сверить сохранённые итоги с подписками пачками по id пользователей.
+    Расхождения (параллельные записи, правки в обход database.py) логируются и исправляются.
+    Возвращает число исправленных пользователей.
+    """
+    last_user_id = 0
+    drifted_total = 0
+    
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(User.id)
+                .where(User.id > last_user_id)
+                .order_by(User.id)
+                .limit(chunk_size)
+            )
+            user_ids = list(result.scalars().all())
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+            
+            fresh = await _compute_summaries(session, user_ids)
+            result = await session.execute(
+                select(UserSpendingSummary).where(UserSpendingSummary.user_id.in_(user_ids))
+            )
+            stored = {summary.user_id: summary for summary in result.scalars().all()}
+            
+            drifted = {
+                user_id: summary for user_id, summary in fresh.items()
+                if _summary_differs(stored.get(user_id), summary)
+            }
+            if drifted:
+                await _save_summaries(session, drifted)
+                await session.commit()
+                missing = sum(1 for user_id in drifted if user_id not in stored)
+                if len(drifted) > missing:
+                    logger.warning(
+                        f"Итоги расходов разошлись с подписками у {len(drifted) - missing} пользователей: "
+                        f"{[user_id for user_id in drifted if user_id in stored][:20]}"
+                    )
+        
+        drifted_total += len(drifted)
+    
+    logger.info(f"Сверка итогов расходов: исправлено {drifted_total}")
+    return drifted_total
 
 # ========================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ========================================
-def calculate_next_billing(start_date: date, cycle: BillingCycle) -> date:
-    today = date.today()
-    next_date = start_date
-    while next_date <= today:
-        if cycle == BillingCycle.WEEKLY: 
-            next_date += timedelta(weeks=1)
-        elif cycle == BillingCycle.MONTHLY: 
-            next_date += timedelta(days=30)
-        elif cycle == BillingCycle.QUARTERLY: 
-            next_date += timedelta(days=90)
-        elif cycle == BillingCycle.YEARLY: 
-            next_date += timedelta(days=365)
-        else: 
-            break
-    return next_date
+# Длина периода в календарных месяцах (WEEKLY считается неделями, LIFETIME не повторяется)
+CYCLE_MONTHS = {
+    BillingCycle.MONTHLY: 1,
+    BillingCycle.QUARTERLY: 3,
+    BillingCycle.YEARLY: 12,
+}
+
+def add_months(d: date, months: int, day: int = None) -> date:
+    """Сдвиг на N календарных месяцев; 31-е в коротком месяце → последний день"""
+    year, month = divmod(d.year * 12 + d.month - 1 + months, 12)
+    month += 1
+    return date(year, month, min(day or d.day, monthrange(year, month)[1]))
+
+def next_billing_after(anchor: date, cycle: BillingCycle, after: date, day: int = None) -> date:
+    """
+    Первая дата списания после after в ряду anchor + k периодов — без цикла.
+    day — «родной» день списания, если anchor уже обрезан до конца месяца.
+    """
+    if anchor > after:
+        return anchor
+    
+    if cycle == BillingCycle.WEEKLY:
+        weeks = (after - anchor).days // 7 + 1
+        return anchor + timedelta(weeks=weeks)
+    
+    months = CYCLE_MONTHS.get(cycle)
+    if not months:
+        return anchor
+    
+    # Целое число периодов до месяца after, дальше максимум один шаг
+    elapsed = (after.year - anchor.year) * 12 + after.month - anchor.month
+    periods = elapsed // months * months
+    candidate = add_months(anchor, periods, day)
+    if candidate <= after:
+        candidate = add_months(anchor, periods + months, day)
+    return candidate
+
+def billing_day(start_date: date, next_billing_date: date) -> int:
+    """День месяца для списаний: день старта, если дата обрезана концом месяца"""
+    last_day = monthrange(next_billing_date.year, next_billing_date.month)[1]
+    if next_billing_date.day == last_day and start_date.day > next_billing_date.day:
+        return start_date.day
+    return next_billing_date.day
+
+def iter_billing_dates(anchor: date, cycle: BillingCycle, before: date, day: int = None):
+    """Даты списаний anchor, anchor + период, ... строго раньше before"""
+    months = CYCLE_MONTHS.get(cycle)
+    step = 0
+    current = anchor
+    while current < before:
+        yield current
+        step += 1
+        if cycle == BillingCycle.WEEKLY:
+            current = anchor + timedelta(weeks=step)
+        elif months:
+            current = add_months(anchor, step * months, day)
+        else:
+            return
+
+def calculate_next_billing(start_date: date, cycle: BillingCycle, today: date = None) -> date:
+    return next_billing_after(start_date, cycle, today or date.today())
 
 def get_monthly_equivalent(price: float, cycle: BillingCycle) -> float:
-    if cycle == BillingCycle.WEEKLY: return price * 4.33
-    elif cycle == BillingCycle.MONTHLY: return price
-    elif cycle == BillingCycle.QUARTERLY: return price / 3
-    elif cycle == BillingCycle.YEARLY: return price / 12
-    return price
+    return price * MONTHLY_MULTIPLIERS.get(cycle, 1)
 
 # ========================================
 # ДОБАВЬТЕ ЭТИ ФУНКЦИИ В database.py
@@ -187,10 +539,10 @@ async def add_subscription(
         result = await session.execute(select(User).where(User.telegram_id == telegram_id))
         user = result.scalar_one_or_none()
         if not user:
+            # Пользователь и подписка сохраняются одним коммитом
             user = User(telegram_id=telegram_id)
             session.add(user)
-            await session.commit()
-            await session.refresh(user)
+            await session.flush()
         
         next_billing = calculate_next_billing(start_date, billing_cycle)
         
@@ -208,8 +560,12 @@ async def add_subscription(
             **kwargs
         )
         session.add(sub)
+        await session.flush()
+        await mark_duplicates_stale(session, [user.id])
+        await refresh_user_summaries(session, [user.id])
         await session.commit()
         await session.refresh(sub)
+        await invalidate_user(telegram_id)
         return sub
 
 
@@ -227,13 +583,12 @@ async def update_subscription(
 ) -> Optional[Subscription]:
     """Обновить подписку"""
     async with async_session() as session:
-        result = await session.execute(
-            select(Subscription).where(Subscription.id == subscription_id)
-        )
-        sub = result.scalar_one_or_none()
+        result = await session.execute(_subscription_with_owner_query(subscription_id))
+        row = result.first()
         
-        if not sub:
+        if not row:
             return None
+        sub, telegram_id = row
         
         # Обновляем только переданные поля
         if name is not None:
@@ -261,11 +616,68 @@ async def update_subscription(
             except:
                 pass
         
+        await mark_duplicates_stale(session, [sub.user_id])
+        await refresh_user_summaries(session, [sub.user_id])
         await session.commit()
         await session.refresh(sub)
+        await subscriptions_cache.invalidate(telegram_id)
         return sub
 
 
+async def add_subscriptions_bulk(telegram_id: int, items: List[dict]) -> int:
+    """
+    Добавить много подписок одной транзакцией: один INSERT на все строки (executemany).
+    items — словари с полями Subscription.
+    """
+    if not items:
+        return 0
+    
+    async with async_session() as session:
+        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        user = result.scalar_one_or_none()
+        if not user:
+            user = User(telegram_id=telegram_id)
+            session.add(user)
+            await session.flush()
+        
+        await session.execute(
+            insert(Subscription),
+            [dict(item, user_id=user.id) for item in items]
+        )
+        await mark_duplicates_stale(session, [user.id])
+        await refresh_user_summaries(session, [user.id])
+        await session.commit()
+    
+    await invalidate_user(telegram_id)
+    return len(items)
+
+
+async def fill_subscription_styles(telegram_id: int, styles: Dict[int, Dict[str, str]]):
+    """
+    Сохранить выведенные по названию иконку и цвет: {id подписки: {"icon": ..., "color": ...}}.
+    Заполняются только пустые поля; updated_at и edited_at не двигаются — клиент уже получил
+    те же значения, и подписка не должна попасть в дельту или стать конфликтом
+    """
+    table = Subscription.__table__
+    async with async_session() as session:
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                icon=func.coalesce(table.c.icon, bindparam("b_icon")),
+                color=func.coalesce(table.c.color, bindparam("b_color")),
+                updated_at=table.c.updated_at,
+                edited_at=table.c.edited_at,
+            ),
+            [
+                {"b_id": subscription_id, "b_icon": values.get("icon"), "b_color": values.get("color")}
+                for subscription_id, values in styles.items()
+            ]
+        )
+        await session.commit()
+    await subscriptions_cache.invalidate(telegram_id)
+
+
 async def get_subscription_by_id(subscription_id: int) -> Optional[Subscription]:
     """Получить подписку по ID"""
     async with async_session() as session:
@@ -290,18 +702,15 @@ async def create_user(
         session.add(user)
         await session.commit()
         await session.refresh(user)
+        await user_cache.invalidate(telegram_id)
         return user
 
 
 async def get_all_subscriptions(telegram_id: int) -> List[Subscription]:
     """Получить ВСЕ подписки (включая отменённые) для аналитики"""
     async with async_session() as session:
-        user = await get_user(telegram_id)
-        if not user:
-            return []
         result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user.id)
+            _user_subscriptions_query(telegram_id)
             .order_by(Subscription.next_billing_date)
         )
         return list(result.scalars().all())
@@ -309,17 +718,12 @@ async def get_all_subscriptions(telegram_id: int) -> List[Subscription]:
 
 async def get_upcoming_payments(telegram_id: int, days: int = 7) -> List[Subscription]:
     """Получить подписки со скорым списанием"""
+    today = date.today()
+    end_date = today + timedelta(days=days)
+    
     async with async_session() as session:
-        user = await get_user(telegram_id)
-        if not user:
-            return []
-        
-        today = date.today()
-        end_date = today + timedelta(days=days)
-        
         result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user.id)
+            _user_subscriptions_query(telegram_id)
             .where(Subscription.status == SubscriptionStatus.ACTIVE)
             .where(Subscription.next_billing_date >= today)
             .where(Subscription.next_billing_date <= end_date)
@@ -328,6 +732,305 @@ async def get_upcoming_payments(telegram_id: int, days: int = 7) -> List[Subscri
         return list(result.scalars().all())
 
 
+async def get_upcoming_billings(telegram_id: int, days: int = 7) -> List[Subscription]:
+    """Ближайшие списания пользователя (для экрана напоминаний)"""
+    return await get_upcoming_payments(telegram_id, days=days)
+
+
+def _insert_ignore_conflicts(model):
+    """INSERT ... ON CONFLICT DO NOTHING для текущего диалекта"""
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
+
+
+async def roll_forward_billing_dates(today: date = None, chunk_size: int = 1000) -> Tuple[int, int]:
+    """
+    Перенести все просроченные next_billing_date на ближайшую дату не раньше today.
+    Пройденные списания пишутся в subscription_charges.
+    Таблица обходится пачками по id, каждая пачка — отдельная транзакция
+    с одним bulk UPDATE, одним bulk INSERT и пересчётом итогов затронутых пользователей.
+    Возвращает (перенесено подписок, записано списаний).
+    """
+    today = today or date.today()
+    yesterday = today - timedelta(days=1)
+    last_id = 0
+    rolled = charged = 0
+    
+    # Перенос — служебная запись: updated_at двигается (новая дата уйдёт клиенту в дельте),
+    # edited_at — нет, иначе правка клиента этой подписки станет конфликтом
+    table = Subscription.__table__
+    roll_forward = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(next_billing_date=bindparam("b_next_billing_date"), edited_at=table.c.edited_at)
+    )
+    
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(
+                    Subscription.id, Subscription.user_id, Subscription.name, Subscription.price, Subscription.currency,
+                    Subscription.start_date, Subscription.next_billing_date, Subscription.billing_cycle
+                )
+                .where(Subscription.status == SubscriptionStatus.ACTIVE)
+                .where(Subscription.next_billing_date < today)
+                .where(Subscription.id > last_id)
+                .order_by(Subscription.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            updates, charges = [], []
+            user_ids = set()
+            for row in rows:
+                day = billing_day(row.start_date or row.next_billing_date, row.next_billing_date)
+                next_date = next_billing_after(row.next_billing_date, row.billing_cycle, yesterday, day)
+                if next_date < today:
+                    # LIFETIME и прочие неповторяющиеся — переносить некуда
+                    continue
+                
+                updates.append({"b_id": row.id, "b_next_billing_date": next_date})
+                user_ids.add(row.user_id)
+                charges.extend(
+                    {
+                        "subscription_id": row.id,
+                        "user_id": row.user_id,
+                        "name": row.name,
+                        "amount": row.price,
+                        "currency": row.currency or "RUB",
+                        "charged_on": charged_on,
+                    }
+                    for charged_on in iter_billing_dates(row.next_billing_date, row.billing_cycle, today, day)
+                )
+            
+            if charges:
+                await session.execute(_insert_ignore_conflicts(SubscriptionCharge), charges)
+            if updates:
+                await session.execute(roll_forward, updates)
+                await refresh_user_summaries(session, sorted(user_ids))
+            await session.commit()
+        
+        rolled += len(updates)
+        charged += len(charges)
+    
+    if rolled:
+        await subscriptions_cache.clear()
+    logger.info(f"Перенос дат списания: {rolled} подписок, {charged} списаний")
+    return rolled, charged
+
+
+async def refresh_spending_snapshots(chunk_size: int = 5000) -> int:
+    """
+    Дописать в spending_snapshots списания, ещё не свёрнутые в снимки (in_snapshot = false).
+    Они читаются пачками по id, каждая пачка сворачивается до (пользователь, месяц, категория),
+    дописывается и отмечается своей транзакцией. Списание, закоммиченное позже списаний
+    с большим id (перенос дат ещё идёт), попадёт в следующую пачку или следующий прогон.
+    Возвращает число добавленных строк.
+    """
+    appended = 0
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(
+                    SubscriptionCharge.id, SubscriptionCharge.user_id, SubscriptionCharge.amount,
+                    SubscriptionCharge.charged_on, Subscription.category
+                )
+                .outerjoin(Subscription, SubscriptionCharge.subscription_id == Subscription.id)
+                .where(~SubscriptionCharge.in_snapshot)  # NOT in_snapshot — по частичному индексу
+                .order_by(SubscriptionCharge.id)
+                .limit(chunk_size)
+                .with_for_update(of=SubscriptionCharge, skip_locked=True)
+            )
+            charges = result.all()
+            if not charges:
+                break
+            last_charge_id = charges[-1].id
+            
+            totals: Dict[Tuple[int, date, str], List[float]] = {}
+            for charge in charges:
+                key = (charge.user_id, charge.charged_on.replace(day=1), charge.category or "other")
+                total = totals.setdefault(key, [0.0, 0])
+                total[0] += charge.amount
+                total[1] += 1
+            
+            await session.execute(
+                insert(SpendingSnapshot),
+                [
+                    {
+                        "user_id": user_id,
+                        "month": month,
+                        "category": category,
+                        "amount": round(amount, 2),
+                        "charges_count": count,
+                        "last_charge_id": last_charge_id,
+                    }
+                    for (user_id, month, category), (amount, count) in totals.items()
+                ]
+            )
+            await session.execute(
+                update(SubscriptionCharge)
+                .where(SubscriptionCharge.id.in_([charge.id for charge in charges]))
+                .values(in_snapshot=True)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        
+        appended += len(totals)
+    
+    logger.info(f"История расходов: добавлено {appended} строк")
+    return appended
+
+
+async def get_spending_history(telegram_id: int, since: date, until: date) -> Dict[date, float]:
+    """Списания по месяцам [since, until): {первое число месяца: сумма}"""
+    user_id = select(User.id).where(User.telegram_id == telegram_id).scalar_subquery()
+    async with async_session() as session:
+        result = await session.execute(
+            select(SpendingSnapshot.month, func.sum(SpendingSnapshot.amount))
+            .where(SpendingSnapshot.user_id == user_id)
+            .where(SpendingSnapshot.month >= since)
+            .where(SpendingSnapshot.month < until)
+            .group_by(SpendingSnapshot.month)
+            .order_by(SpendingSnapshot.month)
+        )
+        return {month: round(float(total), 2) for month, total in result.all()}
+
+
+async def get_expiring_trials(telegram_id: int, days: int = 7) -> List[Subscription]:
+    """Триалы, которые заканчиваются в ближайшие N дней"""
+    today = date.today()
+    end_date = today + timedelta(days=days)
+    
+    async with async_session() as session:
+        result = await session.execute(
+            _user_subscriptions_query(telegram_id)
+            .where(Subscription.is_trial == True)
+            .where(Subscription.status != SubscriptionStatus.CANCELLED)
+            .where(Subscription.trial_end_date >= today)
+            .where(Subscription.trial_end_date <= end_date)
+            .order_by(Subscription.trial_end_date)
+        )
+        return list(result.scalars().all())
+
+
+# Максимум из настроек «за сколько дней напоминать»
+MAX_NOTIFY_BEFORE_DAYS = 14
+
+
+@lru_cache(maxsize=None)
+def _get_zone(tz_name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def get_local_today(tz_name: Optional[str]) -> date:
+    """Сегодняшняя дата в часовом поясе пользователя"""
+    return datetime.now(_get_zone(tz_name)).date()
+
+
+async def iter_due_billings(
+    slots: Optional[List[int]] = None,
+    batch_size: int = 500
+) -> AsyncIterator[List[Tuple[int, date, List[Subscription]]]]:
+    """
+    Ближайшие списания всех пользователей — страницами по batch_size строк (keyset).
+    Строки группируются по telegram_id с учётом notify_before_days и часового пояса пользователя.
+    Отдаёт пачки (telegram_id, локальная дата пользователя, подписки) уже после закрытия сессии:
+    пока вызывающий ждёт доставку, курсор и соединение с БД не заняты.
+    Пользователь на границе страниц дочитывается следующей страницей и попадает в одну пачку.
+    slots — минуты суток UTC: берутся только пользователи с этими notify_slot_utc.
+    """
+    today = date.today()
+    # Локальная дата пользователя может отличаться от UTC на сутки в обе стороны
+    start_date = today - timedelta(days=1)
+    end_date = today + timedelta(days=MAX_NOTIFY_BEFORE_DAYS + 1)
+    
+    stmt = (
+        select(User.telegram_id, User.notify_before_days, User.timezone, Subscription)
+        .join(Subscription, Subscription.user_id == User.id)
+        .where(Subscription.status == SubscriptionStatus.ACTIVE)
+        .where(Subscription.next_billing_date >= start_date)
+        .where(Subscription.next_billing_date <= end_date)
+        .order_by(User.telegram_id, Subscription.next_billing_date, Subscription.id)
+        .limit(batch_size)
+    )
+    if slots is not None:
+        stmt = stmt.where(User.notify_slot_utc.in_(slots))
+    position = tuple_(User.telegram_id, Subscription.next_billing_date, Subscription.id)
+    
+    last = None
+    current_id = None
+    local_today = today
+    due: List[Subscription] = []
+    
+    while True:
+        page = stmt if last is None else stmt.where(position > tuple_(*last))
+        async with async_session() as session:
+            result = await session.execute(page)
+            rows = result.all()
+        if not rows:
+            break
+        
+        telegram_id, _, _, sub = rows[-1]
+        last = (telegram_id, sub.next_billing_date, sub.id)
+        
+        batch = []
+        for telegram_id, notify_days, tz_name, sub in rows:
+            if telegram_id != current_id:
+                if due:
+                    batch.append((current_id, local_today, due))
+                current_id, due = telegram_id, []
+                local_today = get_local_today(tz_name)
+            
+            limit = notify_days if notify_days is not None else 3
+            if 0 <= (sub.next_billing_date - local_today).days <= limit:
+                due.append(sub)
+        
+        if batch:
+            yield batch
+        if len(rows) < batch_size:
+            break
+    
+    if due:
+        yield [(current_id, local_today, due)]
+
+
+async def refresh_notify_slots() -> int:
+    """
+    Пересчитать notify_slot_utc (переход на летнее время, новые пользователи).
+    Один UPDATE на каждую пару (часовой пояс, время), а не на пользователя.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.timezone, User.notify_time).distinct()
+        )
+        pairs = result.all()
+        
+        updated = 0
+        for tz_name, notify_time in pairs:
+            slot = get_notify_slot_utc(notify_time, tz_name)
+            result = await session.execute(
+                update(User)
+                .where(User.timezone.is_not_distinct_from(tz_name))
+                .where(User.notify_time.is_not_distinct_from(notify_time))
+                .where(User.notify_slot_utc.is_distinct_from(slot))
+                .values(notify_slot_utc=slot)
+                .execution_options(synchronize_session=False)
+            )
+            updated += result.rowcount
+        
+        await session.commit()
+    
+    if updated:
+        await user_cache.clear()
+    return updated
+
+
 async def set_premium(
     telegram_id: int, 
     premium_type: PremiumType, 
@@ -349,5 +1052,14 @@ async def set_premium(
         
         await session.commit()
         await session.refresh(user)
+        await user_cache.invalidate(telegram_id)
         return user
 
+
+async def update_user_premium(
+    telegram_id: int, 
+    premium_type: PremiumType, 
+    expires: datetime = None
+) -> User:
+    """Обновить премиум после оплаты"""
+    return await set_premium(telegram_id, premium_type, expires)
@@ -1,5 +1,5 @@
 from aiogram import Router
-from . import start, subscriptions, analytics, reminders, payment, settings, duplicates
+from . import start, subscriptions, bulk_import, analytics, reminders, payment, settings, duplicates
 
 def setup_routers() -> Router:
     """Настройка всех роутеров"""
@@ -7,6 +7,7 @@ def setup_routers() -> Router:
     
     router.include_router(start.router)
     router.include_router(subscriptions.router)
+    router.include_router(bulk_import.router)
     router.include_router(duplicates.router)  # Новый!
     router.include_router(analytics.router)
     router.include_router(reminders.router)
@@ -5,15 +5,16 @@ from aiogram.types import InlineKeyboardButton
 from datetime import date
 
 from ..services.smart_analytics import (
-    generate_full_report, generate_smart_tips,
+    generate_full_report, generate_smart_tips, get_spending_trends,
     get_spending_forecast, get_comparison_stats,
     get_priority_emoji, get_category_emoji,
     TipPriority, TipCategory, AnalyticsReport
 )
 from ..database import (
     get_monthly_spending, get_yearly_spending,
-    get_spending_by_category, get_user_subscriptions, is_premium
+    get_spending_by_category, is_premium
 )
+from ..services.export import EXPORT_FORMATS, ExportInputFile
 from ..keyboards.inline import get_analytics_keyboard, get_main_menu_keyboard, get_back_keyboard
 from ..config import config
 
@@ -210,15 +211,15 @@ async def show_trends_report(callback: CallbackQuery):
     # Проверяем премиум для расширенной аналитики
     has_premium = await is_premium(callback.from_user.id)
     
-    report = await generate_full_report(callback.from_user.id)
+    trends = await get_spending_trends(callback.from_user.id)
     
     text = """
 📉 <b>Тренды расходов</b>
 
 """
     
-    if report.trends:
-        for trend in report.trends:
+    if trends:
+        for trend in trends:
             if trend.direction == "up":
                 emoji = "📈"
                 change_text = f"+{trend.change_percent:.1f}%"
@@ -230,22 +231,26 @@ async def show_trends_report(callback: CallbackQuery):
                 change_text = "0%"
             
             text += f"{emoji} <b>{trend.period}:</b> {trend.amount:,.0f}₽ ({change_text})\n"
+    else:
+        text += "История появится после первого месяца списаний.\n"
     
     text += """
 
 💡 <b>Анализ:</b>
 """
     
-    if report.trends and len(report.trends) >= 2:
-        first = report.trends[0]
-        last = report.trends[-1]
+    if len(trends) >= 2:
+        first = trends[0]
+        last = trends[-1]
         
-        if first.amount > last.amount:
+        if not first.amount or not last.amount:
+            text += "Не во все месяцы были списания — сравнивать пока не с чем."
+        elif first.amount > last.amount:
             growth = ((first.amount / last.amount) - 1) * 100
             text += f"Расходы выросли на {growth:.0f}% за последние месяцы.\n"
             text += "Рекомендуем проверить, все ли подписки нужны."
         elif first.amount < last.amount:
-            decrease = ((last.amount / first.amount) - 1) * 100
+            decrease = (1 - first.amount / last.amount) * 100
             text += f"Отлично! Расходы снизились на {decrease:.0f}%.\n"
             text += "Ты на правильном пути к оптимизации!"
         else:
@@ -376,40 +381,45 @@ async def export_data(callback: CallbackQuery):
         await callback.answer()
         return
     
-    # Для премиум пользователей — генерируем отчёт
-    subscriptions = await get_user_subscriptions(callback.from_user.id)
-    report = await generate_full_report(callback.from_user.id)
-    
-    # Формируем текстовый отчёт
-    report_text = "📊 ОТЧЁТ ПО ПОДПИСКАМ\n"
-    report_text += f"Дата: {date.today().strftime('%d.%m.%Y')}\n"
-    report_text += "=" * 40 + "\n\n"
-    
-    report_text += f"ОБЩАЯ СТАТИСТИКА\n"
-    report_text += f"Подписок: {report.subscriptions_count}\n"
-    report_text += f"В месяц: {report.total_monthly:,.0f}₽\n"
-    report_text += f"В год: {report.total_yearly:,.0f}₽\n\n"
-    
-    report_text += "СПИСОК ПОДПИСОК\n"
-    report_text += "-" * 40 + "\n"
+    # Для премиум пользователей — выбор формата
+    text = """
+📤 <b>Экспорт данных</b>
+
+Все подписки, включая отменённые, и история списаний.
+
+📗 <b>Excel</b> — два листа: подписки и списания
+📄 <b>CSV</b> — одна таблица для любых программ
+🧾 <b>JSON</b> — построчно, для импорта и скриптов
+"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="📗 Excel", callback_data="export:xlsx"),
+        InlineKeyboardButton(text="📄 CSV", callback_data="export:csv"),
+        InlineKeyboardButton(text="🧾 JSON", callback_data="export:jsonl")
+    )
+    builder.row(
+        InlineKeyboardButton(text="◀️ Назад", callback_data="analytics")
+    )
     
-    for sub in subscriptions:
-        status = "✓" if sub.status.value == "active" else "⏸" if sub.status.value == "paused" else "✗"
-        report_text += f"{status} {sub.name}: {sub.price:,.0f}₽\n"
+    await callback.message.edit_text(text, reply_markup=builder.as_markup())
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("export:"))
+async def send_export(callback: CallbackQuery):
+    """Отправить выгрузку — файл пишется и загружается в Telegram кусками"""
+    export_format = callback.data.split(":")[1]
     
-    # Отправляем как документ
-    from aiogram.types import BufferedInputFile
+    if export_format not in EXPORT_FORMATS or not await is_premium(callback.from_user.id):
+        await callback.answer("Экспорт недоступен", show_alert=True)
+        return
     
-    file = BufferedInputFile(
-        report_text.encode('utf-8'),
-        filename=f"subscriptions_report_{date.today().strftime('%Y%m%d')}.txt"
-    )
+    await callback.answer("Готовлю файл...")
     
     await callback.message.answer_document(
-        file,
-        caption="📤 Твой отчёт по подпискам"
+        ExportInputFile(callback.from_user.id, export_format),
+        caption=f"📤 Твои подписки и списания на {date.today().strftime('%d.%m.%Y')}"
     )
-    await callback.answer("Отчёт сформирован!")
 
 
 @router.callback_query(F.data == "compare_with_average")
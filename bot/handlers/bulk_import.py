@@ -0,0 +1,192 @@
+from aiogram import Router, F, Bot
+from aiogram.types import Message, CallbackQuery
+from aiogram.fsm.context import FSMContext
+from aiogram.filters import Command
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.types import InlineKeyboardButton
+import io
+import logging
+
+from ..states import ImportSubscriptions
+from ..database import (
+    add_subscriptions_bulk, get_user_subscriptions, get_subscriptions_count, is_premium
+)
+from ..models import BillingCycle
+from ..keyboards.inline import get_back_keyboard, get_main_menu_keyboard
+from ..services.importer import ImportItem, parse_import_file
+from ..services.recurring_scan import add_ledger_charges
+from ..utils.helpers import get_cycle_name
+from ..config import config
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+MAX_IMPORT_FILE_SIZE = 5 * 1024 * 1024
+MAX_IMPORT_ITEMS = 50
+
+
+def get_import_keyboard(items: list, selected: list):
+    """Найденные подписки с галочками + импорт"""
+    builder = InlineKeyboardBuilder()
+    
+    for index, item in enumerate(items):
+        mark = "✅" if index in selected else "⬜"
+        builder.row(InlineKeyboardButton(
+            text=f"{mark} {item['name']} — {item['price']:,.0f}₽{get_cycle_name(BillingCycle(item['billing_cycle']), short=True)}",
+            callback_data=f"import_toggle:{index}"
+        ))
+    
+    builder.row(
+        InlineKeyboardButton(text=f"📥 Импортировать ({len(selected)})", callback_data="import_confirm"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="back_to_menu")
+    )
+    return builder.as_markup()
+
+
+@router.message(Command("import"))
+@router.callback_query(F.data == "import_subscriptions")
+async def start_import(update: Message | CallbackQuery, state: FSMContext):
+    """Начало импорта"""
+    await state.clear()
+    await state.set_state(ImportSubscriptions.waiting_file)
+    
+    text = """
+📥 <b>Импорт подписок</b>
+
+Пришли файл одним сообщением:
+
+📄 <b>CSV со списком</b> — колонки «Название» и «Цена» (можно «Период» и «Следующее списание»)
+🏦 <b>Выписка банка</b> — CSV из Т-Банка, Сбера, Альфы и др. или OFX
+
+Из выписки найду регулярные списания: один продавец, ровный интервал, похожая сумма.
+"""
+    if isinstance(update, CallbackQuery):
+        await update.message.edit_text(text, reply_markup=get_back_keyboard("add_subscription"))
+        await update.answer()
+    else:
+        await update.answer(text, reply_markup=get_back_keyboard("add_subscription"))
+
+
+@router.message(ImportSubscriptions.waiting_file, F.document)
+async def process_import_file(message: Message, state: FSMContext, bot: Bot):
+    """Разбор файла и предпросмотр"""
+    document = message.document
+    
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer("❌ Файл больше 5 МБ. Выгрузи выписку за меньший период.")
+        return
+    
+    buffer = io.BytesIO()
+    await bot.download(document, destination=buffer)
+    buffer.seek(0)
+    
+    try:
+        result = parse_import_file(buffer)
+    except (ValueError, UnicodeDecodeError):
+        await message.answer(
+            "❌ Не получилось разобрать файл. Поддерживаются CSV и OFX.",
+            reply_markup=get_back_keyboard("add_subscription")
+        )
+        return
+    except Exception as e:
+        logger.error(f"Import parse error: {e}", exc_info=True)
+        await message.answer("❌ Ошибка при чтении файла", reply_markup=get_back_keyboard("add_subscription"))
+        return
+    
+    # Расходы выписки копятся в истории — по ней ищутся забытые подписки и подорожания
+    if result.entries:
+        await add_ledger_charges(message.from_user.id, result.entries)
+    
+    # Уже отслеживаемые подписки не дублируем
+    existing = await get_user_subscriptions(message.from_user.id)
+    known_services = {s.service_id for s in existing if s.service_id}
+    known_names = {s.name.lower() for s in existing}
+    items = [
+        item for item in result.items
+        if item.service_id not in known_services and item.name.lower() not in known_names
+    ][:MAX_IMPORT_ITEMS]
+    
+    if not items:
+        await state.clear()
+        await message.answer(
+            "🤷 Новых подписок в файле не нашлось.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    data = [item.to_dict() for item in items]
+    selected = list(range(len(data)))
+    await state.update_data(import_items=data, import_selected=selected)
+    await state.set_state(ImportSubscriptions.confirming)
+    
+    total = sum(item.price for item in items if item.billing_cycle == BillingCycle.MONTHLY.value)
+    text = f"""
+📥 <b>Найдено подписок: {len(items)}</b>
+
+Ежемесячных — на {total:,.0f}₽/мес.
+Сними галочки с лишних и нажми «Импортировать».
+"""
+    await message.answer(text, reply_markup=get_import_keyboard(data, selected))
+
+
+@router.message(ImportSubscriptions.waiting_file)
+async def import_file_expected(message: Message):
+    """Вместо файла прислали текст"""
+    await message.answer(
+        "📎 Пришли файл CSV или OFX документом",
+        reply_markup=get_back_keyboard("add_subscription")
+    )
+
+
+@router.callback_query(F.data.startswith("import_toggle:"), ImportSubscriptions.confirming)
+async def toggle_import_item(callback: CallbackQuery, state: FSMContext):
+    """Отметить / снять подписку"""
+    index = int(callback.data.split(":")[1])
+    data = await state.get_data()
+    selected = data.get("import_selected", [])
+    
+    if index in selected:
+        selected.remove(index)
+    else:
+        selected.append(index)
+    
+    await state.update_data(import_selected=selected)
+    await callback.message.edit_reply_markup(
+        reply_markup=get_import_keyboard(data.get("import_items", []), selected)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "import_confirm", ImportSubscriptions.confirming)
+async def confirm_import(callback: CallbackQuery, state: FSMContext):
+    """Добавить выбранные подписки одной вставкой"""
+    data = await state.get_data()
+    items = data.get("import_items", [])
+    selected = sorted(data.get("import_selected", []))
+    chosen = [ImportItem(**items[i]) for i in selected if i < len(items)]
+    
+    if not chosen:
+        await callback.answer("Ничего не выбрано", show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    skipped = 0
+    
+    # Лимит бесплатной версии
+    if not await is_premium(user_id):
+        available = max(config.FREE_SUBSCRIPTIONS_LIMIT - await get_subscriptions_count(user_id), 0)
+        skipped = max(len(chosen) - available, 0)
+        chosen = chosen[:available]
+    
+    added = await add_subscriptions_bulk(user_id, [item.to_row() for item in chosen])
+    await state.clear()
+    
+    text = f"✅ <b>Добавлено подписок: {added}</b>"
+    if skipped:
+        text += (
+            f"\n\n⚠️ Ещё {skipped} не поместились в лимит бесплатной версии "
+            f"({config.FREE_SUBSCRIPTIONS_LIMIT} подписок)."
+        )
+    
+    await callback.message.edit_text(text, reply_markup=get_main_menu_keyboard())
+    await callback.answer()
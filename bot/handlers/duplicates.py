@@ -4,9 +4,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 
 from ..services.duplicate_detector import (
-    detect_duplicates, get_total_potential_savings,
-    get_overlap_type_text, get_overlap_type_emoji, OverlapType
+    calculate_total_savings, get_counterpart_name, get_overlap_type_text, get_overlap_type_emoji, OverlapType
 )
+from ..services.duplicate_scan import get_duplicate_alerts, dismiss_duplicate_alert
 from ..database import get_subscription, is_premium
 from ..keyboards.inline import get_main_menu_keyboard, get_back_keyboard
 from ..data.cancel_guides import get_cancel_guide, get_cancel_difficulty_emoji
@@ -18,7 +18,7 @@ router = Router()
 async def show_duplicates(callback: CallbackQuery):
     """Показать найденные дубликаты"""
     
-    alerts = await detect_duplicates(callback.from_user.id)
+    alerts = await get_duplicate_alerts(callback.from_user.id)
     
     if not alerts:
         text = """
@@ -37,7 +37,7 @@ async def show_duplicates(callback: CallbackQuery):
         await callback.answer()
         return
     
-    total_saving = await get_total_potential_savings(callback.from_user.id)
+    total_saving = calculate_total_savings(alerts)
     
     text = f"""
 🔄 <b>Детектор дубликатов</b>
@@ -52,15 +52,15 @@ async def show_duplicates(callback: CallbackQuery):
     
     builder = InlineKeyboardBuilder()
     
-    for i, alert in enumerate(alerts[:7]):  # Показываем до 7
+    for alert in alerts[:7]:  # Показываем до 7
         emoji = get_overlap_type_emoji(alert.overlap_type)
         name1 = alert.main_subscription.name[:15]
-        name2 = alert.duplicate_subscription.name[:15]
+        name2 = get_counterpart_name(alert)[:15]
         
         builder.row(
             InlineKeyboardButton(
                 text=f"{emoji} {name1} ↔ {name2}",
-                callback_data=f"dup_detail:{i}"
+                callback_data=f"dup_detail:{alert.id}"
             )
         )
     
@@ -80,8 +80,8 @@ async def show_duplicates(callback: CallbackQuery):
 async def show_duplicates_summary(callback: CallbackQuery):
     """Сводка по дубликатам"""
     
-    alerts = await detect_duplicates(callback.from_user.id)
-    total_saving = await get_total_potential_savings(callback.from_user.id)
+    alerts = await get_duplicate_alerts(callback.from_user.id)
+    total_saving = calculate_total_savings(alerts)
     
     # Группируем по типу
     by_type = {}
@@ -128,27 +128,31 @@ async def show_duplicates_summary(callback: CallbackQuery):
 async def show_duplicate_detail(callback: CallbackQuery):
     """Детали дубликата"""
     
-    index = int(callback.data.split(":")[1])
-    alerts = await detect_duplicates(callback.from_user.id)
+    alert_id = int(callback.data.split(":")[1])
+    alerts = await get_duplicate_alerts(callback.from_user.id)
+    alert = next((a for a in alerts if a.id == alert_id), None)
     
-    if index >= len(alerts):
+    if not alert:
         await callback.answer("Не найдено", show_alert=True)
         return
     
-    alert = alerts[index]
     main_sub = alert.main_subscription
     dup_sub = alert.duplicate_subscription
     
     type_text = get_overlap_type_text(alert.overlap_type)
     
+    if dup_sub:
+        counterpart = f"<b>Пересекается с:</b>\n{dup_sub.icon or '📦'} {dup_sub.name} — {dup_sub.price:,.0f}₽"
+    else:
+        counterpart = f"<b>Вместо неё оформить:</b>\n🧮 {get_counterpart_name(alert)}"
+    
     text = f"""
 {type_text}
 
 <b>Основная подписка:</b>
 {main_sub.icon or '📦'} {main_sub.name} — {main_sub.price:,.0f}₽
 
-<b>Пересекается с:</b>
-{dup_sub.icon or '📦'} {dup_sub.name} — {dup_sub.price:,.0f}₽
+{counterpart}
 
 💡 <b>Рекомендация:</b>
 {alert.recommendation}
@@ -158,29 +162,25 @@ async def show_duplicate_detail(callback: CallbackQuery):
     
     builder = InlineKeyboardBuilder()
     
-    # Если есть инструкция по отмене дубликата
-    if dup_sub.service_id:
-        guide = get_cancel_guide(dup_sub.service_id)
+    # Если есть инструкция по отмене дубликата (без пары отменяется основная)
+    to_cancel = dup_sub or main_sub
+    if to_cancel.service_id:
+        guide = get_cancel_guide(to_cancel.service_id)
         if guide:
             builder.row(
                 InlineKeyboardButton(
-                    text=f"📋 Как отменить {dup_sub.name}",
-                    callback_data=f"cancel_guide:{dup_sub.id}"
+                    text=f"📋 Как отменить {to_cancel.name}",
+                    callback_data=f"cancel_guide:{to_cancel.id}"
                 )
             )
     
-    builder.row(
-        InlineKeyboardButton(
-            text=f"👁️ {main_sub.name}",
-            callback_data=f"view_sub:{main_sub.id}"
-        ),
-        InlineKeyboardButton(
-            text=f"👁️ {dup_sub.name}",
-            callback_data=f"view_sub:{dup_sub.id}"
-        )
-    )
+    builder.row(*(
+        InlineKeyboardButton(text=f"👁️ {sub.name}", callback_data=f"view_sub:{sub.id}")
+        for sub in (main_sub, dup_sub) if sub
+    ))
     
     builder.row(
+        InlineKeyboardButton(text="🙈 Не показывать", callback_data=f"dup_dismiss:{alert.id}"),
         InlineKeyboardButton(text="◀️ К списку", callback_data="duplicates")
     )
     
@@ -188,6 +188,20 @@ async def show_duplicate_detail(callback: CallbackQuery):
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("dup_dismiss:"))
+async def dismiss_duplicate(callback: CallbackQuery):
+    """Скрыть алерт о дубликате"""
+    
+    alert_id = int(callback.data.split(":")[1])
+    
+    if not await dismiss_duplicate_alert(alert_id, callback.from_user.id):
+        await callback.answer("Не найдено", show_alert=True)
+        return
+    
+    await callback.answer("🙈 Больше не покажу")
+    await show_duplicates(callback)
+
+
 @router.callback_query(F.data.startswith("cancel_guide:"))
 async def show_cancel_guide(callback: CallbackQuery):
     """Показать инструкцию по отмене"""
@@ -296,6 +310,9 @@ async def mark_as_cancelled(callback: CallbackQuery):
                 monthly_saved = get_monthly_equivalent(subscription.price, subscription.billing_cycle)
                 db_user.total_saved += monthly_saved * 12  # Годовая экономия
                 await session.commit()
+                
+                from ..cache import invalidate_user
+                await invalidate_user(callback.from_user.id)
     
     text = f"""
 ✅ <b>Отлично!</b>
@@ -6,7 +6,8 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 
 from ..database import get_user, async_session, is_premium
-from ..models import User
+from ..cache import invalidate_user
+from ..models import User, get_notify_slot_utc
 from ..keyboards.inline import get_settings_keyboard, get_premium_keyboard, get_back_keyboard
 from sqlalchemy import select
 
@@ -99,6 +100,7 @@ async def save_notify_days(callback: CallbackQuery):
         if user:
             user.notify_before_days = days
             await session.commit()
+            await invalidate_user(callback.from_user.id)
     
     await callback.answer(f"✅ Буду напоминать за {days} дн.")
     
@@ -153,7 +155,9 @@ async def save_notify_time(callback: CallbackQuery):
         user = result.scalar_one_or_none()
         if user:
             user.notify_time = time
+            user.notify_slot_utc = get_notify_slot_utc(user.notify_time, user.timezone)
             await session.commit()
+            await invalidate_user(callback.from_user.id)
     
     await callback.answer(f"✅ Уведомления в {time}")
     
@@ -177,6 +181,7 @@ async def toggle_monthly_reports(callback: CallbackQuery):
             user.notify_monthly_report = not user.notify_monthly_report
             new_status = user.notify_monthly_report
             await session.commit()
+            await invalidate_user(callback.from_user.id)
     
     status_text = "включены" if new_status else "отключены"
     await callback.answer(f"Месячные отчёты {status_text}")
@@ -240,7 +245,9 @@ async def save_timezone(callback: CallbackQuery):
         user = result.scalar_one_or_none()
         if user:
             user.timezone = timezone
+            user.notify_slot_utc = get_notify_slot_utc(user.notify_time, user.timezone)
             await session.commit()
+            await invalidate_user(callback.from_user.id)
     
     await callback.answer("✅ Часовой пояс обновлён")
     
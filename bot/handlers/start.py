@@ -3,7 +3,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 
-from ..database import get_or_create_user, get_monthly_spending, get_user_subscriptions
+from ..database import get_or_create_user, get_monthly_spending, get_user_subscriptions, get_spending_summary
 from ..keyboards.inline import get_main_menu_keyboard
 from ..keyboards.reply import get_main_reply_keyboard
 
@@ -105,6 +105,7 @@ async def cmd_help(message: Message):
 /start — Начать работу
 /menu — Главное меню
 /add — Добавить подписку
+/import — Импорт из CSV или выписки банка
 /list — Список подписок
 /stats — Статистика расходов
 /settings — Настройки
@@ -130,10 +131,10 @@ async def cmd_stats(message: Message):
     """Быстрая статистика"""
     from ..keyboards.inline import get_analytics_keyboard
     
-    subscriptions = await get_user_subscriptions(message.from_user.id)
-    monthly = await get_monthly_spending(message.from_user.id)
+    summary = await get_spending_summary(message.from_user.id)
+    monthly = summary.monthly_total
     
-    if not subscriptions:
+    if not summary.subscriptions_count:
         await message.answer(
             "У тебя пока нет подписок. Добавь первую!",
             reply_markup=get_main_menu_keyboard()
@@ -143,7 +144,7 @@ async def cmd_stats(message: Message):
     text = f"""
 📊 **Статистика расходов**
 
-💳 Активных подписок: **{len(subscriptions)}**
+💳 Активных подписок: **{summary.subscriptions_count}**
 📅 В месяц: **{monthly:,.0f}₽**
 📆 В год: **{monthly * 12:,.0f}₽**
 
@@ -9,7 +9,7 @@ from ..states import AddSubscription, EditSubscription, CustomSubscription, Sear
 from ..database import (
     get_or_create_user, add_subscription, get_user_subscriptions,
     get_subscription, update_subscription, delete_subscription,
-    get_subscriptions_count, is_premium, get_expiring_trials
+    get_subscriptions_count, is_premium, get_expiring_trials, get_spending_summary
 )
 from ..models import SubscriptionStatus, BillingCycle
 from ..keyboards.inline import (
@@ -52,30 +52,17 @@ async def show_subscriptions(update: Message | CallbackQuery, state: FSMContext)
             {"text": "➕ Добавить подписку", "callback_data": "add_subscription"}
         ])
     else:
-        # Считаем общую сумму
-        total_monthly = 0
-        for sub in subscriptions:
-            if sub.billing_cycle == BillingCycle.WEEKLY:
-                total_monthly += sub.price * 4.33
-            elif sub.billing_cycle == BillingCycle.MONTHLY:
-                total_monthly += sub.price
-            elif sub.billing_cycle == BillingCycle.QUARTERLY:
-                total_monthly += sub.price / 3
-            elif sub.billing_cycle == BillingCycle.YEARLY:
-                total_monthly += sub.price / 12
-        
-        active_count = len([s for s in subscriptions if s.status == SubscriptionStatus.ACTIVE])
-        trial_count = len([s for s in subscriptions if s.is_trial])
+        summary = await get_spending_summary(user_id)
         
         text = f"""
 📋 <b>Мои подписки</b>
 
-📊 Всего: <b>{len(subscriptions)}</b> подписок
-✅ Активных: <b>{active_count}</b>
-⏱️ Триалов: <b>{trial_count}</b>
+📊 Всего: <b>{summary.subscriptions_count}</b> подписок
+✅ Активных: <b>{summary.active_count}</b>
+⏱️ Триалов: <b>{summary.trials_count}</b>
 
-💰 В месяц: <b>{total_monthly:,.0f}₽</b>
-📅 В год: <b>{total_monthly * 12:,.0f}₽</b>
+💰 В месяц: <b>{summary.monthly_total:,.0f}₽</b>
+📅 В год: <b>{summary.monthly_total * 12:,.0f}₽</b>
 
 Выбери подписку для подробностей:
 """
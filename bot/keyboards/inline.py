@@ -49,7 +49,8 @@ def get_categories_keyboard() -> InlineKeyboardMarkup:
         )
     
     builder.row(
-        InlineKeyboardButton(text="✏️ Своя подписка", callback_data="custom_subscription")
+        InlineKeyboardButton(text="✏️ Своя подписка", callback_data="custom_subscription"),
+        InlineKeyboardButton(text="📥 Импорт", callback_data="import_subscriptions")
     )
     builder.row(
         InlineKeyboardButton(text="🔍 Поиск", callback_data="search_subscription"),
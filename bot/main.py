@@ -1,14 +1,19 @@
 import asyncio
 import logging
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 
+from . import database
+from .api import create_app, set_database
 from .config import config
+from .cache import get_redis
 from .database import init_db
 from .handlers import setup_routers
 from .services.scheduler import setup_scheduler
+from .webhook import WebhookIngestor
 
 # Логирование
 logging.basicConfig(
@@ -17,6 +22,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Webhook-режим: апдейты приходят в aiohttp-приложение Mini App API"""
+    set_database(database)
+    app = create_app()
+    
+    ingestor = WebhookIngestor(bot, dp)
+    ingestor.setup(app)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    
+    await bot.set_webhook(
+        url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+        secret_token=ingestor.secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Webhook: {config.WEBHOOK_URL}{config.WEBHOOK_PATH}, воркеров {ingestor.workers}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
     """Главная функция запуска бота"""
     
@@ -30,7 +60,13 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    storage = MemoryStorage()
+    # FSM в Redis — состояние диалога переживает рестарт и видно всем воркерам
+    redis = get_redis()
+    if redis is not None:
+        from aiogram.fsm.storage.redis import RedisStorage
+        storage = RedisStorage(redis=redis)
+    else:
+        storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
     
     # Подключение роутеров
@@ -38,15 +74,20 @@ async def main():
     dp.include_router(router)
     
     # Запуск планировщика уведомлений
-    scheduler = await setup_scheduler(bot)
+    scheduler = await setup_scheduler(bot) if config.SCHEDULER_ENABLED else None
     
     # Запуск бота
     logger.info("Бот запущен!")
     
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.WEBHOOK_URL:
+            await run_webhook(bot, dp)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
-        scheduler.shutdown()
+        if scheduler:
+            scheduler.shutdown()
         await bot.session.close()
 
 def run():
@@ -1,8 +1,9 @@
-from datetime import datetime, date
+from datetime import datetime, date, time, timezone
 from typing import Optional, List
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from sqlalchemy import (
     Column, Integer, String, Float, Boolean, 
-    DateTime, Date, ForeignKey, Text, Enum, JSON
+    DateTime, Date, ForeignKey, Text, Enum, JSON, Index, UniqueConstraint, text
 )
 from sqlalchemy.orm import relationship, DeclarativeBase
 from sqlalchemy.ext.asyncio import AsyncAttrs
@@ -30,6 +31,28 @@ class PremiumType(enum.Enum):
     YEARLY = "yearly"
     LIFETIME = "lifetime"
 
+DEFAULT_TIMEZONE = "Europe/Moscow"
+DEFAULT_NOTIFY_TIME = "10:00"
+
+
+def get_notify_slot_utc(notify_time: Optional[str], tz_name: Optional[str], on: date = None) -> int:
+    """Минута суток по UTC, в которую пользователь ждёт уведомления"""
+    try:
+        tz = ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = ZoneInfo(DEFAULT_TIMEZONE)
+    
+    hours, minutes = (int(part) for part in (notify_time or DEFAULT_NOTIFY_TIME).split(":"))
+    local = datetime.combine(on or date.today(), time(hours, minutes), tzinfo=tz)
+    utc = local.astimezone(timezone.utc)
+    return utc.hour * 60 + utc.minute
+
+
+def _default_notify_slot(context) -> int:
+    params = context.get_current_parameters()
+    return get_notify_slot_utc(params.get("notify_time"), params.get("timezone"))
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -38,7 +61,7 @@ class User(Base):
     username = Column(String(255), nullable=True)
     first_name = Column(String(255), nullable=True)
     language = Column(String(10), default="ru")
-    timezone = Column(String(50), default="Europe/Moscow")
+    timezone = Column(String(50), default=DEFAULT_TIMEZONE)
     
     # Премиум статус
     premium_type = Column(Enum(PremiumType), default=PremiumType.FREE)
@@ -46,12 +69,17 @@ class User(Base):
     
     # Настройки уведомлений
     notify_before_days = Column(Integer, default=3)
-    notify_time = Column(String(5), default="10:00")
+    notify_time = Column(String(5), default=DEFAULT_NOTIFY_TIME)
+    # notify_time в часовом поясе пользователя, переведённое в минуту суток UTC
+    notify_slot_utc = Column(Integer, default=_default_notify_slot, index=True)
     notify_monthly_report = Column(Boolean, default=True)
     
     # Статистика
     total_saved = Column(Float, default=0.0)  # Сколько сэкономил благодаря боту
     
+    # Когда дубликаты последний раз пересчитывались; None — подписки менялись после этого
+    duplicates_scanned_at = Column(DateTime, nullable=True)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -96,10 +124,30 @@ class Subscription(Base):
     
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Последняя правка пользователя: служебные записи (стили, перенос дат) его не двигают.
+    # По нему дельта-синхронизация отличает конфликт от собственной правки клиента
+    edited_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Отношения
     user = relationship("User", back_populates="subscriptions")
     reminders = relationship("Reminder", back_populates="subscription", cascade="all, delete-orphan")
+    # Без каскада: история списаний переживает удаление подписки (subscription_id обнуляется)
+    charges = relationship("SubscriptionCharge", back_populates="subscription", passive_deletes=True)
+    
+    __table_args__ = (
+        # Список подписок пользователя и его ближайшие списания
+        Index("ix_subscriptions_user_status_next_billing", "user_id", "status", "next_billing_date"),
+        # Окно списаний по всем пользователям (рассылка напоминаний)
+        Index("ix_subscriptions_status_next_billing", "status", "next_billing_date"),
+        # Только триалы — их немного, индекс маленький
+        Index(
+            "ix_subscriptions_user_trial_end", "user_id", "trial_end_date",
+            postgresql_where=text("is_trial"),
+            sqlite_where=text("is_trial = 1")
+        ),
+        # Дельта-синхронизация: что изменилось у пользователя после курсора
+        Index("ix_subscriptions_user_updated_at", "user_id", "updated_at"),
+    )
 
 class Reminder(Base):
     __tablename__ = "reminders"
@@ -117,6 +165,152 @@ class Reminder(Base):
     
     subscription = relationship("Subscription", back_populates="reminders")
 
+class SubscriptionCharge(Base):
+    """Списание по подписке — фиксируется, когда next_billing_date переносится вперёд"""
+    __tablename__ = "subscription_charges"
+    
+    id = Column(Integer, primary_key=True)
+    # NULL — подписку удалили, списание осталось в истории
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id", ondelete="SET NULL"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    name = Column(String(255))  # Название подписки на момент списания
+    amount = Column(Float, nullable=False)
+    currency = Column(String(3), default="RUB")
+    charged_on = Column(Date, nullable=False)
+    
+    # Уже свёрнуто в spending_snapshots. Отметка ставится в той же транзакции, что и запись
+    # снимка, — в отличие от водяного знака по id, не зависит от порядка коммитов
+    in_snapshot = Column(Boolean, default=False, nullable=False)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    subscription = relationship("Subscription", back_populates="charges")
+    
+    __table_args__ = (
+        # Повторный прогон переноса не задваивает историю
+        UniqueConstraint("subscription_id", "charged_on", name="uq_subscription_charges_subscription_date"),
+        Index("ix_subscription_charges_user_charged_on", "user_id", "charged_on"),
+        # Ещё не свёрнутые в снимки — их немного, индекс маленький
+        Index(
+            "ix_subscription_charges_pending", "id",
+            postgresql_where=text("NOT in_snapshot"),
+            sqlite_where=text("in_snapshot = 0")
+        ),
+    )
+
+class UserSpendingSummary(Base):
+    """Итоги по подпискам пользователя — обновляются в той же транзакции, что и сами подписки"""
+    __tablename__ = "user_spending_summary"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    
+    subscriptions_count = Column(Integer, default=0)  # Все, кроме отменённых
+    active_count = Column(Integer, default=0)
+    paused_count = Column(Integer, default=0)
+    trials_count = Column(Integer, default=0)
+    monthly_total = Column(Float, default=0.0)  # Активные в пересчёте на месяц
+    
+    next_billing_date = Column(Date, nullable=True)
+    next_billing_amount = Column(Float, default=0.0)  # Все списания этого дня
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class SpendingSnapshot(Base):
+    """
+    Списания пользователя за месяц по категории. Таблица только дополняется:
+    каждый прогон refresh_spending_snapshots дописывает прирост по новым списаниям,
+    сумма месяца — сумма его строк.
+    """
+    __tablename__ = "spending_snapshots"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    month = Column(Date, nullable=False)  # Первое число месяца
+    category = Column(String(50), nullable=False)
+    amount = Column(Float, nullable=False)
+    charges_count = Column(Integer, default=0)
+    
+    # Пачка refresh_spending_snapshots, дописавшая строку, — последний id её списаний.
+    # Только для разбора истории: повторный учёт списаний исключает subscription_charges.in_snapshot
+    last_charge_id = Column(Integer, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Экран трендов — один диапазон по индексу, сумма берётся из него же
+        Index("ix_spending_snapshots_user_month", "user_id", "month", "amount"),
+    )
+
+class LedgerCharge(Base):
+    """Списание из выписки банка — сырая история операций по продавцам"""
+    __tablename__ = "ledger_charges"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    merchant = Column(String(255), nullable=False)  # Ключ продавца (importer.merchant_key)
+    service_id = Column(String(100), nullable=True)
+    description = Column(String(255), nullable=True)
+    
+    amount = Column(Float, nullable=False)  # Положительная сумма списания
+    currency = Column(String(3), default="RUB")
+    charged_on = Column(Date, nullable=False)
+    source = Column(String(20), default="import")
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Повторная загрузка той же выписки не задваивает историю
+        UniqueConstraint("user_id", "merchant", "charged_on", "amount", name="uq_ledger_charges_entry"),
+        Index("ix_ledger_charges_user_merchant_charged_on", "user_id", "merchant", "charged_on"),
+    )
+
+class RecurringCharge(Base):
+    """Регулярное списание, найденное в ledger_charges (пересчитывается фоновой задачей)"""
+    __tablename__ = "recurring_charges"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    merchant = Column(String(255), nullable=False)
+    service_id = Column(String(100), nullable=True)
+    name = Column(String(255), nullable=False)
+    
+    billing_cycle = Column(Enum(BillingCycle), nullable=False)
+    price = Column(Float, nullable=False)  # Сумма последнего списания
+    currency = Column(String(3), default="RUB")
+    previous_price = Column(Float, nullable=True)  # Сумма до последнего изменения цены
+    price_changed_on = Column(Date, nullable=True)
+    
+    first_charged_on = Column(Date, nullable=False)
+    last_charged_on = Column(Date, nullable=False)
+    next_expected_on = Column(Date, nullable=True)
+    charges_count = Column(Integer, default=0)
+    is_active = Column(Boolean, default=True)  # Последнее списание не старше одного периода
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "merchant", name="uq_recurring_charges_user_merchant"),
+    )
+
+class SyncTombstone(Base):
+    """Удалённая запись — чтобы дельта-синхронизация Mini App узнала об удалении"""
+    __tablename__ = "sync_tombstones"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    entity = Column(String(30), nullable=False, default="subscription")
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_sync_tombstones_user_deleted_at", "user_id", "deleted_at"),
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
     
@@ -144,11 +338,22 @@ class DuplicateAlert(Base):
     main_subscription_id = Column(Integer, nullable=False)
     duplicate_subscription_id = Column(Integer, nullable=False)
     
-    overlap_type = Column(String(100), nullable=False)  # included, similar, redundant
+    overlap_type = Column(String(100), nullable=False)  # included, similar, redundant, bundle_plan
     potential_saving = Column(Float, nullable=True)
     recommendation = Column(Text, nullable=True)
+    priority = Column(Integer, default=3)
+    details = Column(JSON, nullable=True)  # bundle_plan: что оформить и что отменить
     
     is_dismissed = Column(Boolean, default=False)
     dismissed_at = Column(DateTime, nullable=True)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Ключ для upsert при пересчёте: одна строка на пару подписок и тип пересечения
+        UniqueConstraint(
+            "user_id", "main_subscription_id", "duplicate_subscription_id", "overlap_type",
+            name="uq_duplicate_alerts_pair"
+        ),
+    )
\ No newline at end of file
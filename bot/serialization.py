@@ -0,0 +1,101 @@
+"""
+⚡ Сериализация ответов API
+Один кодировщик orjson для обоих серверов (aiohttp для Mini App и FastAPI) и типизированные
+структуры ответа: dataclass со __slots__ orjson кодирует сам, без промежуточных словарей
+"""
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Mapping, Optional
+
+import orjson
+from aiohttp import web
+
+# Ключи-числа ({id подписки: ...}) кодируются строками, как в стандартном json
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+def dumps(data: Any) -> bytes:
+    """JSON в UTF-8: dataclass, date / datetime и Enum — без default-хуков"""
+    return orjson.dumps(data, option=JSON_OPTIONS)
+
+
+def json_response(data: Any, status: int = 200, headers: Optional[Mapping[str, str]] = None) -> web.Response:
+    """Замена web.json_response: тело кодируется orjson сразу в байты"""
+    return web.Response(body=dumps(data), status=status, headers=headers, content_type=JSON_CONTENT_TYPE)
+
+
+# ============ СТРУКТУРЫ ОТВЕТА ============
+
+# Колонки подписки, которые читают структуры ответа
+SUBSCRIPTION_FIELDS = frozenset({
+    "id", "name", "price", "currency", "billing_cycle", "next_billing_date", "icon", "category",
+    "color", "status", "is_trial", "trial_end_date", "notes",
+})
+
+
+def loaded_values(obj, fields: frozenset = SUBSCRIPTION_FIELDS) -> Mapping[str, Any]:
+    """
+    Значения колонок объекта ORM прямо из __dict__: чтение через дескриптор SQLAlchemy
+    стоит около 0.5 мкс, а на подписку их больше десятка.
+    Если что-то не загружено (expire), читаем как обычно — через getattr.
+    """
+    values = obj.__dict__
+    if fields <= values.keys():
+        return values
+    return {key: getattr(obj, key) for key in fields}
+
+
+@dataclass(slots=True)
+class MiniAppSubscription:
+    """Подписка в формате Mini App (bot/api.py) — имена полей как в JSON"""
+    id: int
+    name: str
+    price: float
+    currency: Optional[str]
+    billingCycle: str
+    nextPayment: Optional[str]  # ISO с временем: 2024-05-01T00:00:00
+    icon: str
+    category: str
+    color: str
+    notifyDays: int
+    status: str
+
+
+@dataclass(slots=True)
+class ApiSubscription:
+    """Подписка в ответах FastAPI (api/server.py)"""
+    id: int
+    name: str
+    price: float
+    currency: Optional[str]
+    billing_cycle: str
+    category: Optional[str]
+    icon: Optional[str]
+    color: Optional[str]
+    status: str
+    is_trial: Optional[bool]
+    trial_end_date: Optional[date]
+    next_billing_date: Optional[date]
+    notes: Optional[str]
+
+
+def api_subscription(sub) -> ApiSubscription:
+    values = loaded_values(sub)
+    return ApiSubscription(
+        id=values["id"],
+        name=values["name"],
+        price=values["price"],
+        currency=values["currency"],
+        billing_cycle=values["billing_cycle"].value,
+        category=values["category"],
+        icon=values["icon"],
+        color=values["color"],
+        status=values["status"].value,
+        is_trial=values["is_trial"],
+        trial_end_date=values["trial_end_date"],
+        next_billing_date=values["next_billing_date"],
+        notes=values["notes"],
+    )
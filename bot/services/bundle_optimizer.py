@@ -0,0 +1,180 @@
+"""
+🧮 Оптимизатор бандлов
+Самый дешёвый набор подписок, покрывающий все сервисы пользователя
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from ..data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
+from ..models import Subscription
+
+# 2^16 состояний — верхняя граница для точного перебора
+MAX_PLAN_ITEMS = 16
+
+
+@dataclass
+class BundlePlan:
+    """Оптимальный план: что оставить, что отменить, что оформить"""
+    keep: List[Subscription]
+    cancel: List[Subscription]
+    buy: List[str]  # service_id бандлов из каталога
+    current_cost: float
+    plan_cost: float
+    saving: float
+    buy_names: List[str] = field(default_factory=list)
+
+
+def solve_min_cost_cover(
+    full_mask: int,
+    options: List[Tuple[int, float]]
+) -> Optional[Tuple[float, List[int]]]:
+    """
+    Минимальная стоимость покрытия full_mask набором options (маска, цена).
+    DP по маскам покрытых сервисов: из каждого состояния берём только варианты,
+    покрывающие младший непокрытый бит — любой план обязан его покрыть.
+    Возвращает (стоимость, индексы выбранных вариантов) или None.
+    """
+    if full_mask == 0:
+        return 0.0, []
+    
+    size = full_mask + 1
+    cost = [float("inf")] * size
+    came_from: List[Tuple[int, int]] = [(-1, -1)] * size
+    cost[0] = 0.0
+    
+    # Варианты, сгруппированные по битам, которые они покрывают
+    by_bit: Dict[int, List[int]] = {}
+    for index, (mask, _) in enumerate(options):
+        bit = mask
+        while bit:
+            low = bit & -bit
+            by_bit.setdefault(low, []).append(index)
+            bit ^= low
+    
+    for mask in range(size):
+        current = cost[mask]
+        if current == float("inf") or mask == full_mask:
+            continue
+        
+        missing = full_mask & ~mask
+        low = missing & -missing
+        
+        for index in by_bit.get(low, ()):
+            option_mask, option_cost = options[index]
+            new_mask = mask | option_mask
+            if current + option_cost < cost[new_mask]:
+                cost[new_mask] = current + option_cost
+                came_from[new_mask] = (mask, index)
+    
+    if cost[full_mask] == float("inf"):
+        return None
+    
+    chosen = []
+    mask = full_mask
+    while mask:
+        mask, index = came_from[mask]
+        chosen.append(index)
+    
+    return cost[full_mask], chosen
+
+
+def find_best_bundle_plan(
+    subscriptions: List[Subscription],
+    included_index: Mapping[str, Tuple[str, ...]],
+    monthly_price: Callable[[Subscription], float]
+) -> Optional[BundlePlan]:
+    """
+    Кодирует сервисы пользователя битами, каждую подписку и каждый бандл каталога —
+    маской покрываемых сервисов, и находит точный минимум стоимости.
+    None — если дешевле текущего набора не получается.
+    """
+    owned = [s for s in subscriptions if s.service_id]
+    if len(owned) < 2:
+        return None
+    
+    bits: Dict[str, int] = {}
+    for sub in owned:
+        bits.setdefault(sub.service_id, 1 << len(bits))
+    
+    def cover_mask(service_id: str) -> int:
+        mask = bits.get(service_id, 0)
+        for included_id in included_index.get(service_id, ()):
+            mask |= bits.get(included_id, 0)
+        return mask
+    
+    # Варианты: (маска, цена в месяц, подписка пользователя или бандл каталога)
+    options: List[Tuple[int, float, object]] = [
+        (cover_mask(sub.service_id), monthly_price(sub), sub)
+        for sub in owned
+    ]
+    owned_ids = set(bits)
+    for bundle_id in included_index:
+        if bundle_id in owned_ids:
+            continue
+        mask = cover_mask(bundle_id)
+        price = SUBSCRIPTIONS_CATALOG.get(bundle_id, {}).get("default_price")
+        if mask and price:
+            options.append((mask, float(price), bundle_id))
+    
+    # Сервисы, которые покрывает единственный вариант, — этот вариант обязателен
+    covering: Dict[int, List[int]] = {}
+    for index, (mask, _, _) in enumerate(options):
+        for bit in bits.values():
+            if mask & bit:
+                covering.setdefault(bit, []).append(index)
+    
+    forced = {indexes[0] for indexes in covering.values() if len(indexes) == 1}
+    remaining = 0
+    for bit in bits.values():
+        remaining |= bit
+    for index in forced:
+        remaining &= ~options[index][0]
+    
+    # Оставшиеся спорные сервисы перенумеровываем в плотную маску
+    dense_bits = {}
+    bit = remaining
+    while bit:
+        low = bit & -bit
+        dense_bits[low] = 1 << len(dense_bits)
+        bit ^= low
+    
+    if len(dense_bits) > MAX_PLAN_ITEMS:
+        return None
+    
+    def to_dense(mask: int) -> int:
+        return sum(dense for sparse, dense in dense_bits.items() if mask & sparse)
+    
+    candidates = [
+        index for index, (mask, _, _) in enumerate(options)
+        if index not in forced and mask & remaining
+    ]
+    solution = solve_min_cost_cover(
+        (1 << len(dense_bits)) - 1,
+        [(to_dense(options[index][0]), options[index][1]) for index in candidates]
+    )
+    if solution is None:
+        return None
+    
+    chosen = forced | {candidates[index] for index in solution[1]}
+    
+    keep = [options[i][2] for i in sorted(chosen) if i < len(owned)]
+    cancel = [sub for i, sub in enumerate(owned) if i not in chosen]
+    buy = [options[i][2] for i in sorted(chosen) if i >= len(owned)]
+    
+    current_cost = sum(options[i][1] for i in range(len(owned)))
+    plan_cost = sum(options[i][1] for i in chosen)
+    saving = round(current_cost - plan_cost, 2)
+    
+    if saving <= 0:
+        return None
+    
+    return BundlePlan(
+        keep=keep,
+        cancel=cancel,
+        buy=buy,
+        current_cost=round(current_cost, 2),
+        plan_cost=round(plan_cost, 2),
+        saving=saving,
+        buy_names=[SUBSCRIPTIONS_CATALOG[b].get("name", b) for b in buy],
+    )
@@ -0,0 +1,184 @@
+"""
+🔍 Поиск по каталогу подписок
+Инвертированный индекс по триграммам (опечатки) + префиксное дерево (автодополнение),
+кириллица и латиница приводятся к одной транслитерации
+"""
+
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from ..data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
+from .service_matcher import SERVICE_ALIASES, normalize_name
+
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n",
+    "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f",
+    "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y",
+    "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+
+# Латинские написания, которые звучат одинаково: yandex / яндекс → iandeks
+PHONETIC = [("ph", "f"), ("x", "ks"), ("y", "i"), ("w", "v"), ("q", "k"), ("c", "k")]
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# Минимальное сходство по триграммам (коэффициент Дайса), ниже — не совпадение
+MIN_SIMILARITY = 0.45
+PREFIX_SCORE = 0.9
+
+
+def to_search_tokens(text: str) -> List[str]:
+    """Слова строки в единой латинской транслитерации"""
+    text = normalize_name(text).translate(TRANSLIT)
+    for source, target in PHONETIC:
+        text = text.replace(source, target)
+    return [token for token in _NON_WORD.split(text) if token]
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PrefixTrie:
+    """Префиксное дерево слов; в каждом узле — номера слов с этим префиксом"""
+    
+    def __init__(self):
+        self._children: List[Dict[str, int]] = [{}]
+        self._tokens: List[Set[int]] = [set()]
+    
+    def add(self, token: str, token_id: int):
+        node = 0
+        for char in token:
+            next_node = self._children[node].get(char)
+            if next_node is None:
+                next_node = len(self._children)
+                self._children[node][char] = next_node
+                self._children.append({})
+                self._tokens.append(set())
+            node = next_node
+            self._tokens[node].add(token_id)
+    
+    def find(self, prefix: str) -> Set[int]:
+        node = 0
+        for char in prefix:
+            node = self._children[node].get(char)
+            if node is None:
+                return set()
+        return self._tokens[node]
+
+
+class CatalogSearchIndex:
+    """
+    Индекс строится один раз. Документ — сервис каталога,
+    его слова — из названия, ID и синонимов.
+    Запрос оценивается по каждому слову: точное совпадение 1.0,
+    префикс 0.9, иначе сходство триграмм.
+    """
+    
+    def __init__(self, catalog: Mapping[str, dict], aliases: Mapping[str, Iterable[str]] = None):
+        self.catalog = catalog
+        self._doc_ids: List[str] = list(catalog)
+        self._names: List[str] = [normalize_name(info["name"]) for info in catalog.values()]
+        
+        self._token_ids: Dict[str, int] = {}
+        self._token_docs: List[Set[int]] = []
+        self._token_trigrams: List[int] = []
+        self._trigram_index: Dict[str, List[int]] = {}
+        self._trie = PrefixTrie()
+        
+        aliases = aliases or {}
+        for doc, service_id in enumerate(self._doc_ids):
+            texts = [catalog[service_id]["name"], service_id, *aliases.get(service_id, ())]
+            for text in texts:
+                for token in to_search_tokens(text):
+                    self._token_docs[self._add_token(token)].add(doc)
+    
+    def _add_token(self, token: str) -> int:
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            token_id = len(self._token_docs)
+            self._token_ids[token] = token_id
+            self._token_docs.append(set())
+            
+            trigrams = _trigrams(token)
+            self._token_trigrams.append(len(trigrams))
+            for trigram in trigrams:
+                self._trigram_index.setdefault(trigram, []).append(token_id)
+            
+            self._trie.add(token, token_id)
+        return token_id
+    
+    def _match_token(self, query_token: str) -> Dict[int, float]:
+        """Документ → лучшая оценка совпадения одного слова запроса"""
+        token_scores: Dict[int, float] = {}
+        
+        # Опечатки: слова, делящие с запросом достаточно триграмм
+        trigrams = _trigrams(query_token)
+        shared: Dict[int, int] = {}
+        for trigram in trigrams:
+            for token_id in self._trigram_index.get(trigram, ()):
+                shared[token_id] = shared.get(token_id, 0) + 1
+        for token_id, count in shared.items():
+            similarity = 2 * count / (len(trigrams) + self._token_trigrams[token_id])
+            if similarity >= MIN_SIMILARITY:
+                token_scores[token_id] = similarity
+        
+        # Автодополнение: слова, начинающиеся с запроса
+        for token_id in self._trie.find(query_token):
+            token_scores[token_id] = max(token_scores.get(token_id, 0.0), PREFIX_SCORE)
+        
+        exact = self._token_ids.get(query_token)
+        if exact is not None:
+            token_scores[exact] = 1.0
+        
+        doc_scores: Dict[int, float] = {}
+        for token_id, score in token_scores.items():
+            for doc in self._token_docs[token_id]:
+                if score > doc_scores.get(doc, 0.0):
+                    doc_scores[doc] = score
+        return doc_scores
+    
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """[(service_id, оценка)] по убыванию оценки"""
+        query_tokens = to_search_tokens(query)
+        if not query_tokens:
+            return []
+        
+        totals: Dict[int, float] = {}
+        for query_token in query_tokens:
+            for doc, score in self._match_token(query_token).items():
+                totals[doc] = totals.get(doc, 0.0) + score
+        
+        # Полное совпадение с названием — выше всего
+        normalized = normalize_name(query)
+        ranked = sorted(
+            (
+                (totals[doc] / len(query_tokens) + (0.5 if self._names[doc] == normalized else 0.0), doc)
+                for doc in totals
+            ),
+            key=lambda item: (-item[0], len(self._names[item[1]]), self._names[item[1]])
+        )
+        if limit:
+            ranked = ranked[:limit]
+        return [(self._doc_ids[doc], round(score, 3)) for score, doc in ranked]
+
+
+_index: Optional[CatalogSearchIndex] = None
+
+
+def get_catalog_index() -> CatalogSearchIndex:
+    """Индекс каталога, строится при первом поиске"""
+    global _index
+    if _index is None:
+        _index = CatalogSearchIndex(SUBSCRIPTIONS_CATALOG, SERVICE_ALIASES)
+    return _index
+
+
+def search_catalog(query: str, limit: Optional[int] = None) -> List[dict]:
+    """Сервисы каталога по запросу, лучшие первыми: [{"id": ..., **описание}]"""
+    return [
+        {"id": service_id, **SUBSCRIPTIONS_CATALOG[service_id]}
+        for service_id, _ in get_catalog_index().search(query, limit)
+    ]
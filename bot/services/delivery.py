@@ -0,0 +1,192 @@
+"""
+📨 Движок доставки сообщений
+Пул воркеров + token bucket под лимиты Telegram
+"""
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNetworkError, TelegramServerError
+)
+
+from ..config import config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, запас не больше capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (flood control от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class OutgoingMessage:
+    """Сообщение в очереди на отправку"""
+    chat_id: int
+    text: str
+    kwargs: dict = field(default_factory=dict)
+    attempt: int = 0
+
+
+@dataclass
+class DeliveryStats:
+    """Итоги рассылки"""
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retried: int = 0
+
+
+class DeliveryEngine:
+    """
+    Рассылка через ограниченный пул воркеров.
+    Глобальный лимит — token bucket, по чату — минимальный интервал между сообщениями.
+    RetryAfter приостанавливает всю рассылку, сетевые ошибки повторяются с backoff.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = None,
+        rate: float = None,
+        per_chat_interval: float = None,
+        max_retries: int = None
+    ):
+        self.bot = bot
+        self.workers = workers or config.DELIVERY_WORKERS
+        self.per_chat_interval = per_chat_interval if per_chat_interval is not None else config.DELIVERY_PER_CHAT_INTERVAL
+        self.max_retries = max_retries if max_retries is not None else config.DELIVERY_MAX_RETRIES
+        self.bucket = TokenBucket(rate or config.DELIVERY_RATE_LIMIT)
+        self.stats = DeliveryStats()
+
+        # Очередь ограничена — продюсер ждёт, если воркеры не успевают
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        self._tasks = []
+        self._chat_next_slot: Dict[int, float] = {}
+
+    async def __aenter__(self) -> "DeliveryEngine":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def start(self):
+        """Запустить воркеры"""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker())
+                for _ in range(self.workers)
+            ]
+
+    async def submit(self, chat_id: int, text: str, **kwargs):
+        """Поставить сообщение в очередь"""
+        await self._queue.put(OutgoingMessage(chat_id=chat_id, text=text, kwargs=kwargs))
+
+    async def close(self) -> DeliveryStats:
+        """Дождаться отправки всех сообщений и остановить воркеры"""
+        await self._queue.join()
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        return self.stats
+
+    async def _worker(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                self.stats.failed += 1
+                logger.error(f"Ошибка доставки {message.chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _wait_chat_slot(self, chat_id: int):
+        """Не чаще одного сообщения в per_chat_interval для одного чата"""
+        now = time.monotonic()
+        slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+        self._chat_next_slot[chat_id] = slot + self.per_chat_interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, message: OutgoingMessage):
+        while True:
+            await self._wait_chat_slot(message.chat_id)
+            await self.bucket.acquire()
+
+            try:
+                await self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+                self.stats.sent += 1
+                return
+
+            except TelegramRetryAfter as e:
+                # Flood control — тормозим всех воркеров, а не только этот
+                logger.warning(f"RetryAfter {e.retry_after}s для {message.chat_id}")
+                self.bucket.pause(e.retry_after)
+                delay = e.retry_after
+
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота — повторять бессмысленно
+                self.stats.blocked += 1
+                return
+
+            except TelegramBadRequest as e:
+                self.stats.failed += 1
+                logger.error(f"Сообщение {message.chat_id} отклонено: {e}")
+                return
+
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = min(60, 2 ** message.attempt) + random.random()
+                logger.warning(f"Сбой отправки {message.chat_id}: {e}, повтор через {delay:.1f}s")
+
+            message.attempt += 1
+            if message.attempt > self.max_retries:
+                self.stats.failed += 1
+                logger.error(f"Сообщение {message.chat_id} не доставлено после {self.max_retries} повторов")
+                return
+
+            self.stats.retried += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,178 @@
+"""
+🔄 Дельта-синхронизация Mini App
+Клиент присылает курсор прошлой синхронизации и получает только изменённое:
+подписки — по updated_at, удаления — из sync_tombstones.
+Офлайн-правки клиента приходят той же пачкой и применяются одной транзакцией
+"""
+
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, delete, func
+
+from ..database import async_session, get_user_subscriptions, load_sync_user
+from ..models import (
+    User, Subscription, SubscriptionStatus, UserSpendingSummary, SyncTombstone,
+    DuplicateAlert as DuplicateAlertRow
+)
+from .duplicate_detector import DuplicateAlert
+from .duplicate_scan import load_duplicate_alerts
+from .subscription_batch import SubscriptionChange, apply_subscription_changes
+
+logger = logging.getLogger(__name__)
+
+# Запас на транзакции, закоммиченные уже после курсора, но с более ранним updated_at.
+# Такие строки придут повторно — клиент применяет их по id, повтор безвреден
+CURSOR_OVERLAP = timedelta(seconds=5)
+
+# Сколько хранятся надгробия; курсор старше — полная синхронизация
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+# «Скорые списания» в ответе Mini App
+UPCOMING_DAYS = 7
+
+
+@dataclass
+class SyncDelta:
+    user: User
+    summary: UserSpendingSummary
+    cursor: str  # Передать в следующий запрос
+    full: bool  # Курсора не было — subscriptions содержит все подписки
+    subscriptions: List[Subscription]  # Новые и изменённые (без отменённых)
+    deleted: List[int]  # Удалённые и отменённые
+    upcoming: List[Subscription]  # Списания в ближайшие UPCOMING_DAYS дней
+    duplicates: Optional[List[DuplicateAlert]]  # None — не менялись
+    results: List[dict] = field(default_factory=list)  # По одному на правку клиента
+
+
+# ============ КУРСОР ============
+
+def encode_cursor(moment: datetime) -> str:
+    return moment.isoformat(timespec="microseconds")
+
+
+def decode_cursor(cursor, now: datetime = None) -> Optional[datetime]:
+    """Момент прошлой синхронизации; None — курсора нет, он битый, из будущего или старше надгробий"""
+    if not cursor or not isinstance(cursor, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(cursor)
+    except ValueError:
+        return None
+    
+    now = now or datetime.utcnow()
+    if moment.tzinfo is not None or moment > now or moment < now - TOMBSTONE_RETENTION:
+        return None
+    return moment
+
+
+# ============ ДЕЛЬТА ============
+
+async def load_sync_delta(
+    session,
+    telegram_id: int,
+    since: Optional[datetime] = None,
+    changes: List[SubscriptionChange] = (),
+    username: str = None,
+    first_name: str = None,
+    today: date = None
+) -> SyncDelta:
+    """
+    Изменения с момента since (None — полная синхронизация).
+    Сначала применяются правки клиента, затем читается дельта — в ней уже их результат.
+    Курсор берётся после коммита правок: иначе следующая правка той же подписки
+    выглядела бы как чужая (edited_at позже курсора) и стала бы конфликтом.
+    """
+    today = today or date.today()
+    
+    user, summary = await load_sync_user(session, telegram_id, username, first_name)
+    
+    results = []
+    if changes:
+        results = await apply_subscription_changes(session, user, changes, since, today)
+        await session.refresh(summary)
+    cursor = datetime.utcnow()
+    
+    if since is None:
+        result = await session.execute(
+            select(Subscription)
+            .where(Subscription.user_id == user.id)
+            .where(Subscription.status != SubscriptionStatus.CANCELLED)
+            .order_by(Subscription.next_billing_date)
+        )
+        subscriptions = list(result.scalars().all())
+        deleted = []
+    else:
+        after = since - CURSOR_OVERLAP
+        result = await session.execute(
+            select(Subscription)
+            .where(Subscription.user_id == user.id)
+            .where(Subscription.updated_at > after)
+            .order_by(Subscription.next_billing_date)
+        )
+        changed = result.scalars().all()
+        subscriptions = [sub for sub in changed if sub.status != SubscriptionStatus.CANCELLED]
+        deleted = [sub.id for sub in changed if sub.status == SubscriptionStatus.CANCELLED]
+        
+        result = await session.execute(
+            select(SyncTombstone.entity_id)
+            .where(SyncTombstone.user_id == user.id)
+            .where(SyncTombstone.entity == "subscription")
+            .where(SyncTombstone.deleted_at > after)
+        )
+        deleted.extend(result.scalars().all())
+    
+    result = await session.execute(
+        select(Subscription)
+        .where(Subscription.user_id == user.id)
+        .where(Subscription.status != SubscriptionStatus.CANCELLED)
+        .where(Subscription.next_billing_date.between(today, today + timedelta(days=UPCOMING_DAYS)))
+        .order_by(Subscription.next_billing_date)
+    )
+    upcoming = list(result.scalars().all())
+    
+    # Дубликаты — целиком, но только если пересчитывались или пользователь что-то скрыл
+    duplicates = None
+    if await _duplicates_changed(session, user, since):
+        all_subscriptions = subscriptions if since is None else await get_user_subscriptions(telegram_id)
+        duplicates = await load_duplicate_alerts(session, user.id, user.duplicates_scanned_at, all_subscriptions)
+    
+    return SyncDelta(
+        user=user,
+        summary=summary,
+        cursor=encode_cursor(cursor),
+        full=since is None,
+        subscriptions=subscriptions,
+        deleted=deleted,
+        upcoming=upcoming,
+        duplicates=duplicates,
+        results=results,
+    )
+
+
+async def _duplicates_changed(session, user: User, since: Optional[datetime]) -> bool:
+    if since is None or user.duplicates_scanned_at is None:
+        return True
+    after = since - CURSOR_OVERLAP
+    if user.duplicates_scanned_at > after:
+        return True
+    
+    result = await session.execute(
+        select(func.max(DuplicateAlertRow.dismissed_at)).where(DuplicateAlertRow.user_id == user.id)
+    )
+    dismissed_at = result.scalar()
+    return dismissed_at is not None and dismissed_at > after
+
+
+async def purge_sync_tombstones(retention: timedelta = TOMBSTONE_RETENTION) -> int:
+    """Удалить надгробия старше срока — курсоры такой давности всё равно получают полную синхронизацию"""
+    async with async_session() as session:
+        result = await session.execute(
+            delete(SyncTombstone).where(SyncTombstone.deleted_at < datetime.utcnow() - retention)
+        )
+        await session.commit()
+    
+    logger.info(f"Надгробия синхронизации: удалено {result.rowcount}")
+    return result.rowcount
@@ -3,29 +3,47 @@
 Находит пересечения и переплаты
 """
 
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Mapping
 from dataclasses import dataclass
 from enum import Enum
+from types import MappingProxyType
 
 from ..data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
 from ..models import Subscription, BillingCycle
 from ..database import get_user_subscriptions
+from .bundle_optimizer import BundlePlan, find_best_bundle_plan
+from .service_matcher import match_service_id
 
 class OverlapType(Enum):
     INCLUDED = "included"           # Один сервис включён в другой
     SIMILAR = "similar"             # Похожие сервисы (одна категория)
     REDUNDANT = "redundant"         # Избыточные (одинаковый функционал)
     FAMILY_UPGRADE = "family"       # Можно объединить в семейную подписку
+    BUNDLE_PLAN = "bundle_plan"     # Оптимальный набор бандлов вместо текущих подписок
 
 @dataclass
 class DuplicateAlert:
     """Информация о найденном дубликате"""
     main_subscription: Subscription
-    duplicate_subscription: Subscription
+    duplicate_subscription: Optional[Subscription]  # None — план с бандлом отменяет одну подписку
     overlap_type: OverlapType
     potential_saving: float
     recommendation: str
     priority: int  # 1-5, где 5 — самое важное
+    plan: Optional[BundlePlan] = None  # Только для BUNDLE_PLAN
+    id: Optional[int] = None  # ID сохранённой строки duplicate_alerts
+
+
+@dataclass(frozen=True)
+class SubscriptionSnapshot:
+    """Поля подписки, нужные детектору, — передаются в процессы пула"""
+    id: int
+    service_id: Optional[str]
+    name: str
+    price: float
+    billing_cycle: BillingCycle
+    category: Optional[str]
+    icon: Optional[str]
 
 # Карта включённых сервисов
 INCLUSION_MAP = {
@@ -34,6 +52,7 @@ INCLUSION_MAP = {
     "sber_prime": ["sber_zvuk", "okko", "sber_disk"],
     "mts_premium": ["mts_music", "kion", "mts_library"],
     "vk_combo": ["vk_music"],
+    "tinkoff_pro": ["yandex_plus"],
 }
 
 # Сервисы одной категории, которые дублируют друг друга
@@ -72,6 +91,58 @@ BUNDLE_RECOMMENDATIONS = {
 }
 
 
+def _build_inclusion_index() -> Mapping[str, Tuple[str, ...]]:
+    """service_id → какие сервисы в него входят (INCLUSION_MAP + каталог, без повторов)"""
+    index: Dict[str, Dict[str, None]] = {}
+    
+    for service_id, included in INCLUSION_MAP.items():
+        index.setdefault(service_id, {}).update(dict.fromkeys(included))
+    
+    for service_id, info in SUBSCRIPTIONS_CATALOG.items():
+        included = info.get("included_services") or []
+        if included:
+            index.setdefault(service_id, {}).update(dict.fromkeys(included))
+    
+    return MappingProxyType({
+        service_id: tuple(included)
+        for service_id, included in index.items()
+        if included
+    })
+
+
+def _build_similar_index() -> Mapping[str, int]:
+    """service_id → номер группы похожих сервисов"""
+    index: Dict[str, int] = {}
+    group_number = 0
+    
+    for groups in SIMILAR_SERVICES.values():
+        for group in groups:
+            for service_id in group:
+                index.setdefault(service_id, group_number)
+            group_number += 1
+    
+    return MappingProxyType(index)
+
+
+def _build_bundle_index() -> Mapping[str, Tuple[Tuple[str, Mapping], ...]]:
+    """service_id → ((второй сервис пары, описание бандла), ...)"""
+    index: Dict[str, list] = {}
+    
+    for (service1, service2), bundle_info in BUNDLE_RECOMMENDATIONS.items():
+        index.setdefault(service1, []).append((service2, MappingProxyType(dict(bundle_info))))
+    
+    return MappingProxyType({
+        service_id: tuple(pairs)
+        for service_id, pairs in index.items()
+    })
+
+
+# Индексы строятся один раз при импорте и не меняются — поиск за O(1) на подписку
+INCLUDED_SERVICES_INDEX = _build_inclusion_index()
+SIMILAR_GROUP_INDEX = _build_similar_index()
+BUNDLE_PAIR_INDEX = _build_bundle_index()
+
+
 def calculate_monthly_price(price: float, cycle: BillingCycle) -> float:
     """Расчёт месячной стоимости"""
     multipliers = {
@@ -88,11 +159,18 @@ async def detect_duplicates(telegram_id: int) -> List[DuplicateAlert]:
     """
     Главная функция: находит все дубликаты и пересечения
     """
-    subscriptions = await get_user_subscriptions(telegram_id)
-    
+    return analyze_subscriptions(await get_user_subscriptions(telegram_id))
+
+
+def analyze_subscriptions(subscriptions: List[Subscription]) -> List[DuplicateAlert]:
+    """
+    Поиск дубликатов по готовому списку подписок — без обращений к БД.
+    Подходят и ORM-объекты, и снимки с теми же полями (фоновый пересчёт).
+    """
     if len(subscriptions) < 2:
         return []
     
+    subscriptions = resolve_service_ids(subscriptions)
     alerts = []
     
     # 1. Проверяем включённые сервисы
@@ -101,8 +179,17 @@ async def detect_duplicates(telegram_id: int) -> List[DuplicateAlert]:
     # 2. Проверяем похожие сервисы
     alerts.extend(_check_similar_services(subscriptions))
     
-    # 3. Проверяем возможность объединения в бандлы
-    alerts.extend(_check_bundle_opportunities(subscriptions))
+    # 3. Ищем самый дешёвый набор бандлов; фиксированные пары, которые он уже покрывает, не дублируем
+    plan_alert = _check_bundle_plan(subscriptions)
+    bundle_alerts = _check_bundle_opportunities(subscriptions)
+    if plan_alert:
+        cancelled = {s.id for s in plan_alert.plan.cancel}
+        bundle_alerts = [
+            a for a in bundle_alerts
+            if not {a.main_subscription.id, a.duplicate_subscription.id} <= cancelled
+        ]
+        alerts.append(plan_alert)
+    alerts.extend(bundle_alerts)
     
     # Сортируем по приоритету и потенциальной экономии
     alerts.sort(key=lambda x: (-x.priority, -x.potential_saving))
@@ -110,6 +197,22 @@ async def detect_duplicates(telegram_id: int) -> List[DuplicateAlert]:
     return alerts
 
 
+def resolve_service_ids(subscriptions: List[Subscription]) -> List[Subscription]:
+    """
+    Подписки, добавленные вручную без service_id, сопоставляются с каталогом по названию.
+    Такие подписки заменяются снимками с найденным service_id, остальные не трогаем.
+    """
+    resolved = []
+    for sub in subscriptions:
+        service_id = sub.service_id or match_service_id(sub.name)
+        if service_id != sub.service_id:
+            sub = SubscriptionSnapshot(
+                sub.id, service_id, sub.name, sub.price, sub.billing_cycle, sub.category, sub.icon
+            )
+        resolved.append(sub)
+    return resolved
+
+
 def _check_included_services(subscriptions: List[Subscription]) -> List[DuplicateAlert]:
     """Проверяет, не платит ли пользователь за сервис, который уже включён в другую подписку"""
     alerts = []
@@ -122,13 +225,7 @@ def _check_included_services(subscriptions: List[Subscription]) -> List[Duplicat
             continue
             
         # Проверяем, включает ли эта подписка другие сервисы
-        included = INCLUSION_MAP.get(sub.service_id, [])
-        
-        # Также проверяем поле included_services из каталога
-        catalog_info = SUBSCRIPTIONS_CATALOG.get(sub.service_id, {})
-        included.extend(catalog_info.get("included_services", []))
-        
-        for included_service_id in included:
+        for included_service_id in INCLUDED_SERVICES_INDEX.get(sub.service_id, ()):
             if included_service_id in sub_by_service:
                 duplicate_sub = sub_by_service[included_service_id]
                 
@@ -151,41 +248,35 @@ def _check_similar_services(subscriptions: List[Subscription]) -> List[Duplicate
     """Проверяет наличие похожих сервисов одной категории"""
     alerts = []
     
-    # Группируем подписки по категориям
-    by_category = {}
+    # Группируем подписки по группам похожих сервисов
+    by_group: Dict[int, List[Subscription]] = {}
     for sub in subscriptions:
-        if sub.category:
-            if sub.category not in by_category:
-                by_category[sub.category] = []
-            by_category[sub.category].append(sub)
+        group = SIMILAR_GROUP_INDEX.get(sub.service_id)
+        if group is not None:
+            by_group.setdefault(group, []).append(sub)
     
-    # Проверяем каждую группу
-    for category, subs in by_category.items():
-        if len(subs) < 2:
+    # Ищем пары сервисов, которые дублируют функционал
+    for found_in_group in by_group.values():
+        if len(found_in_group) < 2:
             continue
         
-        # Ищем пары сервисов, которые дублируют функционал
-        for similar_group in SIMILAR_SERVICES.get(category, []):
-            found_in_group = [s for s in subs if s.service_id in similar_group]
+        # Сортируем по цене — оставляем самый дешёвый
+        found_in_group.sort(
+            key=lambda s: calculate_monthly_price(s.price, s.billing_cycle)
+        )
+        
+        cheapest = found_in_group[0]
+        for duplicate in found_in_group[1:]:
+            saving = calculate_monthly_price(duplicate.price, duplicate.billing_cycle)
             
-            if len(found_in_group) >= 2:
-                # Сортируем по цене — оставляем самый дешёвый
-                found_in_group.sort(
-                    key=lambda s: calculate_monthly_price(s.price, s.billing_cycle)
-                )
-                
-                cheapest = found_in_group[0]
-                for duplicate in found_in_group[1:]:
-                    saving = calculate_monthly_price(duplicate.price, duplicate.billing_cycle)
-                    
-                    alerts.append(DuplicateAlert(
-                        main_subscription=cheapest,
-                        duplicate_subscription=duplicate,
-                        overlap_type=OverlapType.SIMILAR,
-                        potential_saving=saving,
-                        recommendation=f"🤔 {duplicate.name} и {cheapest.name} — похожие сервисы. Нужны ли оба?",
-                        priority=3
-                    ))
+            alerts.append(DuplicateAlert(
+                main_subscription=cheapest,
+                duplicate_subscription=duplicate,
+                overlap_type=OverlapType.SIMILAR,
+                potential_saving=saving,
+                recommendation=f"🤔 {duplicate.name} и {cheapest.name} — похожие сервисы. Нужны ли оба?",
+                priority=3
+            ))
     
     return alerts
 
@@ -194,13 +285,13 @@ def _check_bundle_opportunities(subscriptions: List[Subscription]) -> List[Dupli
     """Проверяет, можно ли объединить подписки в выгодный бандл"""
     alerts = []
     
-    sub_ids = {s.service_id for s in subscriptions if s.service_id}
     sub_by_id = {s.service_id: s for s in subscriptions if s.service_id}
     
-    for (service1, service2), bundle_info in BUNDLE_RECOMMENDATIONS.items():
-        if service1 in sub_ids and service2 in sub_ids:
-            sub1 = sub_by_id[service1]
-            sub2 = sub_by_id[service2]
+    for service1, sub1 in sub_by_id.items():
+        for service2, bundle_info in BUNDLE_PAIR_INDEX.get(service1, ()):
+            sub2 = sub_by_id.get(service2)
+            if sub2 is None:
+                continue
             
             # Считаем текущие траты
             current_cost = (
@@ -224,13 +315,54 @@ def _check_bundle_opportunities(subscriptions: List[Subscription]) -> List[Dupli
     return alerts
 
 
+def _check_bundle_plan(subscriptions: List[Subscription]) -> Optional[DuplicateAlert]:
+    """Точный оптимум по всем бандлам каталога — только если он предлагает оформить бандл"""
+    plan = find_best_bundle_plan(
+        subscriptions,
+        INCLUDED_SERVICES_INDEX,
+        lambda s: calculate_monthly_price(s.price, s.billing_cycle)
+    )
+    
+    # Без нового бандла план сводится к уже найденным «включено в другую подписку»
+    if not plan or not plan.buy:
+        return None
+    
+    cancel = sorted(
+        plan.cancel,
+        key=lambda s: -calculate_monthly_price(s.price, s.billing_cycle)
+    )
+    
+    return DuplicateAlert(
+        main_subscription=cancel[0],
+        duplicate_subscription=cancel[1] if len(cancel) > 1 else None,
+        overlap_type=OverlapType.BUNDLE_PLAN,
+        potential_saving=plan.saving,
+        recommendation=(
+            f"🧮 Оформи {', '.join(plan.buy_names)} и отмени "
+            f"{', '.join(s.name for s in cancel)}: "
+            f"{plan.plan_cost:.0f}₽ вместо {plan.current_cost:.0f}₽ в месяц. "
+            f"Экономия: {plan.saving:.0f}₽/мес"
+        ),
+        priority=4,
+        plan=plan
+    )
+
+
+def get_counterpart_name(alert: DuplicateAlert) -> str:
+    """Вторая сторона пары: подписка-дубликат или бандл, который предлагается оформить вместо основной"""
+    if alert.duplicate_subscription is not None:
+        return alert.duplicate_subscription.name
+    return ", ".join(alert.plan.buy_names) if alert.plan else ""
+
+
 def get_overlap_type_text(overlap_type: OverlapType) -> str:
     """Получить текстовое описание типа пересечения"""
     return {
         OverlapType.INCLUDED: "🔄 Уже включено",
         OverlapType.SIMILAR: "🔀 Похожие сервисы",
         OverlapType.REDUNDANT: "💰 Можно объединить",
-        OverlapType.FAMILY_UPGRADE: "👨‍👩‍👧‍👦 Семейный план выгоднее"
+        OverlapType.FAMILY_UPGRADE: "👨‍👩‍👧‍👦 Семейный план выгоднее",
+        OverlapType.BUNDLE_PLAN: "🧮 Оптимальный набор"
     }.get(overlap_type, "❓ Неизвестно")
 
 
@@ -240,19 +372,31 @@ def get_overlap_type_emoji(overlap_type: OverlapType) -> str:
         OverlapType.INCLUDED: "🔄",
         OverlapType.SIMILAR: "🔀",
         OverlapType.REDUNDANT: "💰",
-        OverlapType.FAMILY_UPGRADE: "👨‍👩‍👧‍👦"
+        OverlapType.FAMILY_UPGRADE: "👨‍👩‍👧‍👦",
+        OverlapType.BUNDLE_PLAN: "🧮"
     }.get(overlap_type, "❓")
 
 
 async def get_total_potential_savings(telegram_id: int) -> float:
     """Получить общую потенциальную экономию"""
-    alerts = await detect_duplicates(telegram_id)
-    
+    return calculate_total_savings(await detect_duplicates(telegram_id))
+
+
+def calculate_total_savings(alerts: List[DuplicateAlert]) -> float:
+    """Общая экономия по списку алертов"""
     # Учитываем только уникальные дубликаты
     seen = set()
     total = 0.0
     
+    # План бандлов уже учитывает все свои отмены
+    for alert in alerts:
+        if alert.plan:
+            seen.update(s.id for s in alert.plan.cancel)
+            total += alert.potential_saving
+    
     for alert in alerts:
+        if alert.plan:
+            continue
         dup_id = alert.duplicate_subscription.id
         if dup_id not in seen:
             seen.add(dup_id)
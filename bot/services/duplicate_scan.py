@@ -0,0 +1,274 @@
+"""
+🗂️ Фоновый поиск дубликатов по всем пользователям
+Результаты сохраняются в duplicate_alerts, скрытые пользователем алерты остаются скрытыми
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..cache import sync_cache
+from ..config import config
+from ..database import async_session, engine, get_user_subscriptions
+from ..models import User, Subscription, SubscriptionStatus, DuplicateAlert as DuplicateAlertRow
+from .bundle_optimizer import BundlePlan
+from .duplicate_detector import (
+    DuplicateAlert, OverlapType, SubscriptionSnapshot, analyze_subscriptions, resolve_service_ids
+)
+
+logger = logging.getLogger(__name__)
+
+ALERT_KEY = ["user_id", "main_subscription_id", "duplicate_subscription_id", "overlap_type"]
+
+# duplicate_subscription_id алерта без пары (план с бандлом отменяет одну подписку):
+# NULL в ключе upsert не совпадает сам с собой, и скрытый алерт всплывал бы заново
+NO_PAIR = 0
+
+
+def _alert_to_row(user_id: int, alert: DuplicateAlert) -> dict:
+    details = None
+    if alert.plan:
+        details = {
+            "buy": alert.plan.buy,
+            "buy_names": alert.plan.buy_names,
+            "cancel": [s.id for s in alert.plan.cancel],
+            "current_cost": alert.plan.current_cost,
+            "plan_cost": alert.plan.plan_cost,
+        }
+    
+    return {
+        "user_id": user_id,
+        "main_subscription_id": alert.main_subscription.id,
+        "duplicate_subscription_id": alert.duplicate_subscription.id if alert.duplicate_subscription else NO_PAIR,
+        "overlap_type": alert.overlap_type.value,
+        "potential_saving": round(alert.potential_saving, 2),
+        "recommendation": alert.recommendation,
+        "priority": alert.priority,
+        "details": details,
+    }
+
+
+def analyze_users(users: List[Tuple[int, List[SubscriptionSnapshot]]]) -> List[dict]:
+    """Строки duplicate_alerts для пачки пользователей (выполняется в процессе пула)"""
+    rows = {}
+    for user_id, subscriptions in users:
+        for alert in analyze_subscriptions(subscriptions):
+            row = _alert_to_row(user_id, alert)
+            rows[tuple(row[key] for key in ALERT_KEY)] = row
+    return list(rows.values())
+
+
+async def _unchanged_users(session, versions: Dict[int, datetime]) -> List[int]:
+    """
+    Пользователи, чья строка users не менялась после снимка (updated_at тот же).
+    Любая правка подписок двигает updated_at (mark_duplicates_stale); строки блокируются
+    до коммита, так что правка не проскочит между проверкой и сохранением
+    """
+    result = await session.execute(
+        select(User.id, User.updated_at)
+        .where(User.id.in_(list(versions)))
+        .with_for_update()
+    )
+    return [user_id for user_id, updated_at in result.all() if updated_at == versions[user_id]]
+
+
+async def _save_alerts(session, user_ids: List[int], rows: List[dict], scanned_at: datetime):
+    """
+    Upsert найденных алертов по ключу пары; is_dismissed не трогаем.
+    Пропавшие пересечения удаляем, кроме скрытых — чтобы не всплыли снова.
+    """
+    if not user_ids:
+        return
+    
+    if rows:
+        dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(DuplicateAlertRow)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=ALERT_KEY,
+            set_={
+                "potential_saving": stmt.excluded.potential_saving,
+                "recommendation": stmt.excluded.recommendation,
+                "priority": stmt.excluded.priority,
+                "details": stmt.excluded.details,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        )
+        await session.execute(stmt, [dict(row, updated_at=scanned_at) for row in rows])
+    
+    await session.execute(
+        delete(DuplicateAlertRow)
+        .where(DuplicateAlertRow.user_id.in_(user_ids))
+        .where(or_(DuplicateAlertRow.updated_at.is_(None), DuplicateAlertRow.updated_at < scanned_at))
+        .where(DuplicateAlertRow.is_dismissed.isnot(True))
+    )
+    await session.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(duplicates_scanned_at=scanned_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _load_snapshots(session, user_ids: List[int]) -> Dict[int, List[SubscriptionSnapshot]]:
+    result = await session.execute(
+        select(
+            Subscription.user_id, Subscription.id, Subscription.service_id, Subscription.name,
+            Subscription.price, Subscription.billing_cycle, Subscription.category, Subscription.icon
+        )
+        .where(Subscription.user_id.in_(user_ids))
+        .where(Subscription.status != SubscriptionStatus.CANCELLED)
+        .order_by(Subscription.user_id, Subscription.next_billing_date)
+    )
+    
+    snapshots: Dict[int, List[SubscriptionSnapshot]] = {}
+    for user_id, *fields in result.all():
+        snapshots.setdefault(user_id, []).append(SubscriptionSnapshot(*fields))
+    return snapshots
+
+
+async def scan_all_duplicates(chunk_size: int = 500, workers: int = None) -> int:
+    """
+    Пересчитать дубликаты всех пользователей.
+    Пользователи читаются пачками по id, детектор работает в пуле процессов,
+    каждая пачка сохраняется своей транзакцией.
+    """
+    workers = workers or config.DUPLICATE_SCAN_WORKERS
+    loop = asyncio.get_running_loop()
+    last_user_id = 0
+    saved = 0
+    
+    # spawn: дочерним процессам не достаются event loop и соединения с БД
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while True:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(User.id, User.updated_at)
+                    .where(User.id > last_user_id)
+                    .order_by(User.id)
+                    .limit(chunk_size)
+                )
+                versions = dict(result.all())
+                if not versions:
+                    break
+                user_ids = list(versions)
+                last_user_id = user_ids[-1]
+                
+                scanned_at = datetime.utcnow()
+                users = [
+                    (user_id, subs)
+                    for user_id, subs in (await _load_snapshots(session, user_ids)).items()
+                    if len(subs) >= 2
+                ]
+                
+                parts = [users[i::workers] for i in range(workers) if users[i::workers]]
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(pool, analyze_users, part)
+                    for part in parts
+                ))
+                # Кто правил подписки, пока работал пул, — снимок устарел: их не трогаем,
+                # флаг уже сброшен, и дубликаты пересчитаются при следующем просмотре
+                unchanged = await _unchanged_users(session, versions)
+                fresh = set(unchanged)
+                rows = [row for part in results for row in part if row["user_id"] in fresh]
+                
+                await _save_alerts(session, unchanged, rows, scanned_at)
+                await session.commit()
+            
+            saved += len(rows)
+    
+    # Алерты входят в ответ /api/sync — сохранённые ETag устарели
+    await sync_cache.clear()
+    logger.info(f"Поиск дубликатов: сохранено {saved} алертов")
+    return saved
+
+
+async def get_duplicate_alerts(telegram_id: int) -> List[DuplicateAlert]:
+    """
+    Сохранённые алерты пользователя без скрытых.
+    Если подписки менялись после последнего пересчёта — пересчитываем только его.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.id, User.duplicates_scanned_at).where(User.telegram_id == telegram_id)
+        )
+        row = result.first()
+        if not row:
+            return []
+        user_id, scanned_at = row
+        
+        subscriptions = await get_user_subscriptions(telegram_id)
+        return await load_duplicate_alerts(session, user_id, scanned_at, subscriptions)
+
+
+async def load_duplicate_alerts(
+    session, user_id: int, scanned_at: Optional[datetime], subscriptions: List[Subscription]
+) -> List[DuplicateAlert]:
+    """Алерты пользователя в уже открытой сессии (подписки — без отменённых)"""
+    if scanned_at is None:
+        await _save_alerts(session, [user_id], analyze_users([(user_id, subscriptions)]), datetime.utcnow())
+        await session.commit()
+    
+    result = await session.execute(
+        select(DuplicateAlertRow)
+        .where(DuplicateAlertRow.user_id == user_id)
+        .where(DuplicateAlertRow.is_dismissed.isnot(True))
+    )
+    rows = result.scalars().all()
+    
+    by_id = {s.id: s for s in subscriptions}
+    resolved = resolve_service_ids(subscriptions)
+    alerts = []
+    
+    for row in rows:
+        main_sub = by_id.get(row.main_subscription_id)
+        dup_sub = by_id.get(row.duplicate_subscription_id)
+        if not main_sub or (not dup_sub and row.duplicate_subscription_id != NO_PAIR):
+            continue
+        
+        plan = None
+        if row.details:
+            cancel_ids = set(row.details.get("cancel", []))
+            plan = BundlePlan(
+                keep=[by_id[s.id] for s in resolved if s.service_id and s.id not in cancel_ids],
+                cancel=[s for s in subscriptions if s.id in cancel_ids],
+                buy=row.details.get("buy", []),
+                current_cost=row.details.get("current_cost", 0.0),
+                plan_cost=row.details.get("plan_cost", 0.0),
+                saving=row.potential_saving or 0.0,
+                buy_names=row.details.get("buy_names", []),
+            )
+        
+        alerts.append(DuplicateAlert(
+            main_subscription=main_sub,
+            duplicate_subscription=dup_sub,
+            overlap_type=OverlapType(row.overlap_type),
+            potential_saving=row.potential_saving or 0.0,
+            recommendation=row.recommendation or "",
+            priority=row.priority or 3,
+            plan=plan,
+            id=row.id
+        ))
+    
+    alerts.sort(key=lambda x: (-x.priority, -x.potential_saving))
+    return alerts
+
+
+async def dismiss_duplicate_alert(alert_id: int, telegram_id: int) -> bool:
+    """Скрыть алерт — пересчёт его не вернёт"""
+    async with async_session() as session:
+        user_id = select(User.id).where(User.telegram_id == telegram_id).scalar_subquery()
+        result = await session.execute(
+            update(DuplicateAlertRow)
+            .where(DuplicateAlertRow.id == alert_id)
+            .where(DuplicateAlertRow.user_id == user_id)
+            .values(is_dismissed=True, dismissed_at=datetime.utcnow())
+        )
+        await session.commit()
+    await sync_cache.invalidate(telegram_id)
+    return result.rowcount > 0
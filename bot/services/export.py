@@ -0,0 +1,284 @@
+"""
+📤 Экспорт подписок и истории списаний
+CSV, JSON Lines и XLSX пишутся потоком из серверного курсора — память не зависит от объёма
+"""
+
+import csv
+import io
+import json
+import re
+import zipfile
+from datetime import date, datetime
+from enum import Enum
+from typing import AsyncIterator, Callable, Dict, List, Tuple
+from xml.sax.saxutils import escape
+
+from aiogram.types import InputFile
+from sqlalchemy import select, func
+
+from ..database import async_session
+from ..models import User, Subscription, SubscriptionCharge
+
+# Строк из курсора за одну выборку и размер отдаваемого куска
+FETCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+SUBSCRIPTION_FIELDS = [
+    "subscription_id", "name", "service_id", "category", "price", "currency", "billing_cycle",
+    "status", "is_trial", "start_date", "next_billing_date", "trial_end_date", "created_at",
+]
+CHARGE_FIELDS = ["subscription_id", "name", "price", "currency", "charged_on"]
+
+# CSV — одна таблица: record = subscription | charge
+CSV_FIELDS = ["record"] + SUBSCRIPTION_FIELDS + ["charged_on"]
+
+FIELD_TITLES = {
+    "subscription_id": "ID подписки",
+    "name": "Название",
+    "service_id": "Сервис",
+    "category": "Категория",
+    "price": "Сумма",
+    "currency": "Валюта",
+    "billing_cycle": "Период",
+    "status": "Статус",
+    "is_trial": "Пробный период",
+    "start_date": "Начало",
+    "next_billing_date": "Следующее списание",
+    "trial_end_date": "Конец пробного периода",
+    "created_at": "Добавлена",
+    "charged_on": "Дата списания",
+}
+
+
+def _plain(value):
+    """Значение ячейки: перечисления — по значению, даты — ISO"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+async def iter_subscription_rows(session, telegram_id: int) -> AsyncIterator[dict]:
+    """Все подписки пользователя, включая отменённые"""
+    result = await session.stream(
+        select(
+            Subscription.id.label("subscription_id"), Subscription.name, Subscription.service_id,
+            Subscription.category, Subscription.price, Subscription.currency, Subscription.billing_cycle,
+            Subscription.status, Subscription.is_trial, Subscription.start_date,
+            Subscription.next_billing_date, Subscription.trial_end_date, Subscription.created_at
+        )
+        .join(User, Subscription.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .order_by(Subscription.id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    async for row in result.mappings():
+        yield {key: _plain(value) for key, value in row.items()}
+
+
+async def iter_charge_rows(session, telegram_id: int) -> AsyncIterator[dict]:
+    """История списаний пользователя по дате"""
+    result = await session.stream(
+        select(
+            SubscriptionCharge.subscription_id,
+            func.coalesce(Subscription.name, SubscriptionCharge.name).label("name"),
+            SubscriptionCharge.amount.label("price"), SubscriptionCharge.currency,
+            SubscriptionCharge.charged_on
+        )
+        # Списания удалённых подписок — тоже в истории, название берётся из самого списания
+        .outerjoin(Subscription, SubscriptionCharge.subscription_id == Subscription.id)
+        .join(User, SubscriptionCharge.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .order_by(SubscriptionCharge.charged_on, SubscriptionCharge.id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    async for row in result.mappings():
+        yield {key: _plain(value) for key, value in row.items()}
+
+
+async def iter_records(telegram_id: int) -> AsyncIterator[Tuple[str, dict]]:
+    """("subscription" | "charge", строка) — сначала подписки, потом списания"""
+    async with async_session() as session:
+        async for row in iter_subscription_rows(session, telegram_id):
+            yield "subscription", row
+        async for row in iter_charge_rows(session, telegram_id):
+            yield "charge", row
+
+
+# ============ CSV / JSON LINES ============
+
+async def iter_csv(telegram_id: int) -> AsyncIterator[bytes]:
+    """CSV в UTF-8 с BOM — Excel открывает кириллицу без настройки"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    buffer.write("\ufeff")
+    writer.writeheader()
+    
+    async for record, row in iter_records(telegram_id):
+        writer.writerow({"record": record, **row})
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def iter_jsonl(telegram_id: int) -> AsyncIterator[bytes]:
+    """Одна JSON-запись на строку, поле record — тип записи"""
+    lines: List[str] = []
+    size = 0
+    
+    async for record, row in iter_records(telegram_id):
+        line = json.dumps({"record": record, **row}, ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(lines).encode("utf-8")
+            lines, size = [], 0
+    
+    yield "".join(lines).encode("utf-8")
+
+
+# ============ XLSX ============
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>
+<sheet name="Подписки" sheetId="1" r:id="rId1"/>
+<sheet name="Списания" sheetId="2" r:id="rId2"/>
+</sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet2.xml"/>
+</Relationships>"""
+
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = "</sheetData></worksheet>"
+
+# Управляющие символы запрещены в XML
+_INVALID_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_INVALID_XML.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values) -> str:
+    return "<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>"
+
+
+class _ChunkSink(io.RawIOBase):
+    """Несекабельный поток для ZipFile: записанное забирается кусками через drain()"""
+    
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+async def iter_xlsx(telegram_id: int) -> AsyncIterator[bytes]:
+    """
+    Книга с листами «Подписки» и «Списания».
+    ZIP пишется в несекабельный поток (размеры — в data descriptor),
+    строки — inline-строками, без sharedStrings, поэтому ничего не копится в памяти.
+    """
+    sink = _ChunkSink()
+    
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as book:
+        book.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        book.writestr("_rels/.rels", _ROOT_RELS)
+        book.writestr("xl/workbook.xml", _WORKBOOK)
+        book.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        
+        async with async_session() as session:
+            sheets = [
+                ("xl/worksheets/sheet1.xml", SUBSCRIPTION_FIELDS, iter_subscription_rows),
+                ("xl/worksheets/sheet2.xml", CHARGE_FIELDS, iter_charge_rows),
+            ]
+            for path, fields, iter_rows in sheets:
+                with book.open(path, "w") as sheet:
+                    sheet.write((_SHEET_HEAD + _xlsx_row(FIELD_TITLES[f] for f in fields)).encode("utf-8"))
+                    async for row in iter_rows(session, telegram_id):
+                        sheet.write(_xlsx_row(row[f] for f in fields).encode("utf-8"))
+                        if sink.size >= CHUNK_SIZE:
+                            yield sink.drain()
+                    sheet.write(_SHEET_TAIL.encode("utf-8"))
+                yield sink.drain()
+    
+    yield sink.drain()
+
+
+# ============ ФОРМАТЫ ============
+
+EXPORT_FORMATS: Dict[str, Tuple[Callable[[int], AsyncIterator[bytes]], str]] = {
+    "csv": (iter_csv, "text/csv; charset=utf-8"),
+    "jsonl": (iter_jsonl, "application/x-ndjson"),
+    "xlsx": (iter_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def export_filename(export_format: str) -> str:
+    return f"subscriptions_{date.today().strftime('%Y%m%d')}.{export_format}"
+
+
+def iter_export(telegram_id: int, export_format: str) -> AsyncIterator[bytes]:
+    """Поток байтов выгрузки в нужном формате (ValueError — неизвестный формат)"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+    return EXPORT_FORMATS[export_format][0](telegram_id)
+
+
+class ExportInputFile(InputFile):
+    """Файл выгрузки для Telegram: отправляется кусками по мере чтения из БД"""
+    
+    def __init__(self, telegram_id: int, export_format: str):
+        super().__init__(filename=export_filename(export_format))
+        self.telegram_id = telegram_id
+        self.export_format = export_format
+    
+    async def read(self, bot) -> AsyncIterator[bytes]:
+        async for chunk in iter_export(self.telegram_id, self.export_format):
+            if chunk:
+                yield chunk
@@ -0,0 +1,413 @@
+"""
+📥 Массовый импорт подписок
+CSV со списком подписок, выписки банков (CSV) и OFX: файл читается построчно,
+регулярные списания находятся по продавцу и периодичности
+"""
+
+import codecs
+import csv
+import io
+import itertools
+import re
+from dataclasses import dataclass, asdict, field
+from datetime import date, datetime, timedelta
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from ..data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
+from ..database import next_billing_after
+from ..models import BillingCycle
+from .periodicity import detect_recurring_charges, to_ordinals
+from .service_matcher import match_service_id, normalize_name
+
+
+@dataclass
+class Transaction:
+    """Операция из выписки"""
+    posted: date
+    amount: float  # Расход — отрицательный
+    description: str
+    currency: str = "RUB"
+
+
+@dataclass
+class ImportItem:
+    """Подписка, готовая к добавлению"""
+    name: str
+    price: float
+    billing_cycle: str  # BillingCycle.value
+    start_date: str  # ISO
+    next_billing_date: str  # ISO
+    currency: str = "RUB"
+    service_id: Optional[str] = None
+    charges: int = 0  # Сколько списаний найдено в выписке
+    
+    def to_dict(self) -> dict:
+        return asdict(self)
+    
+    def to_row(self) -> dict:
+        """Поля Subscription для массовой вставки"""
+        service = SUBSCRIPTIONS_CATALOG.get(self.service_id, {}) if self.service_id else {}
+        return {
+            "name": self.name,
+            "price": self.price,
+            "currency": self.currency,
+            "billing_cycle": BillingCycle(self.billing_cycle),
+            "start_date": date.fromisoformat(self.start_date),
+            "next_billing_date": date.fromisoformat(self.next_billing_date),
+            "service_id": self.service_id,
+            "icon": service.get("icon"),
+            "color": service.get("color"),
+            "category": service.get("category"),
+        }
+
+
+@dataclass
+class ImportResult:
+    """Разобранный файл: подписки для предпросмотра и расходы выписки для истории"""
+    items: List[ImportItem]
+    entries: List[dict] = field(default_factory=list)
+
+
+# ============ ЧТЕНИЕ ФАЙЛА ============
+
+def open_text(raw: BinaryIO) -> TextIO:
+    """
+    Текстовый поток поверх байтов: UTF-8 (с BOM или без), иначе cp1251 —
+    в ней выгружают выписки многие банки. Кодировка определяется по первым 64 КБ.
+    """
+    head = raw.read(64 * 1024)
+    raw.seek(0)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp1251"
+    return io.TextIOWrapper(raw, encoding=encoding, newline="")
+
+
+# Названия колонок в разных выгрузках (после normalize_name)
+COLUMN_ALIASES = {
+    "name": ["name", "название", "подписка", "сервис", "service"],
+    "price": ["price", "цена", "стоимость", "сумма подписки"],
+    "billing_cycle": ["billing_cycle", "период", "периодичность", "cycle"],
+    "next_billing_date": ["next_billing_date", "следующее списание", "следующий платеж", "next payment"],
+    "status": ["status", "статус"],
+    "record": ["record"],
+    "date": ["дата операции", "дата", "date", "дата платежа", "дата транзакции", "дата проводки", "posted"],
+    "amount": [
+        "сумма операции", "сумма", "amount", "сумма платежа",
+        "сумма в валюте счета", "сумма в валюте карты", "сумма в рублях",
+    ],
+    "debit": ["расход", "списание", "дебет", "debit"],
+    "description": [
+        "описание", "описание операции", "назначение платежа", "description",
+        "merchant", "контрагент", "получатель", "место совершения операции",
+    ],
+    "currency": ["валюта операции", "валюта", "currency"],
+}
+
+CYCLE_NAMES = {
+    "weekly": BillingCycle.WEEKLY, "еженедельно": BillingCycle.WEEKLY, "неделя": BillingCycle.WEEKLY,
+    "monthly": BillingCycle.MONTHLY, "ежемесячно": BillingCycle.MONTHLY, "месяц": BillingCycle.MONTHLY,
+    "quarterly": BillingCycle.QUARTERLY, "ежеквартально": BillingCycle.QUARTERLY, "квартал": BillingCycle.QUARTERLY,
+    "yearly": BillingCycle.YEARLY, "ежегодно": BillingCycle.YEARLY, "год": BillingCycle.YEARLY,
+}
+
+DATE_FORMATS = ["%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y"]
+
+# Неуспешные операции в выписке Т-Банка
+FAILED_STATUSES = {"failed", "отклонена", "отменена"}
+
+
+def parse_amount(value: str) -> Optional[float]:
+    """«-1 299,00» → -1299.0"""
+    value = (value or "").replace("\xa0", "").replace(" ", "").replace("−", "-").replace(",", ".")
+    value = re.sub(r"[^\d.\-]", "", value)
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_date(value: str) -> Optional[date]:
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:19], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _map_columns(header: List[str]) -> Dict[str, int]:
+    """Поле → номер колонки"""
+    positions = {normalize_name(title).strip('"'): index for index, title in enumerate(header)}
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in positions:
+                columns[field] = positions[alias]
+                break
+    return columns
+
+
+def iter_csv_rows(stream: TextIO) -> Iterator[Tuple[Dict[str, int], List[str]]]:
+    """Строки CSV с картой колонок; разделитель (; , таб) — по заголовку"""
+    header_line = stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(header_line, delimiters=";,\t")
+        delimiter = dialect.delimiter
+    except csv.Error:
+        delimiter = ";"
+    
+    columns = _map_columns(next(csv.reader([header_line], delimiter=delimiter), []))
+    for row in csv.reader(stream, delimiter=delimiter):
+        if row:
+            yield columns, row
+
+
+_OFX_TAG = re.compile(r"<(/?)([A-Z0-9.]+)>([^<\r\n]*)")
+
+# OFX 1.x (SGML) начинается с OFXHEADER:100, OFX 2.x (XML) — с <?xml ...?>,
+# за которым идёт <?OFX OFXHEADER="200" ...?>; перед ними бывают пустые строки
+_OFX_MARKERS = ("OFXHEADER", "<OFX>")
+
+# Сколько начала файла просматривается в поисках заголовка OFX
+OFX_SNIFF_CHARS = 4096
+
+
+def _sniff_ofx(stream: TextIO) -> Tuple[bool, List[str]]:
+    """Похож ли файл на OFX; прочитанные строки возвращаются, чтобы разбор начался с начала"""
+    head = []
+    size = 0
+    while size < OFX_SNIFF_CHARS:
+        line = stream.readline()
+        if not line:
+            break
+        head.append(line)
+        size += len(line)
+        if any(marker in line.upper() for marker in _OFX_MARKERS):
+            return True, head
+    return False, head
+
+
+def iter_ofx_transactions(stream: Iterable[str]) -> Iterator[Transaction]:
+    """Операции <STMTTRN> из OFX (SGML и XML), построчно"""
+    current: Optional[Dict[str, str]] = None
+    currency = "RUB"
+    
+    for line in stream:
+        for closing, tag, value in _OFX_TAG.findall(line):
+            value = value.strip()
+            if tag == "CURDEF" and value:
+                currency = value
+            elif tag == "STMTTRN":
+                if closing and current is not None:
+                    try:
+                        posted = datetime.strptime(current.get("DTPOSTED", "")[:8], "%Y%m%d").date()
+                    except ValueError:
+                        posted = None
+                    amount = parse_amount(current.get("TRNAMT", ""))
+                    if posted and amount is not None:
+                        yield Transaction(
+                            posted=posted,
+                            amount=amount,
+                            description=current.get("NAME") or current.get("MEMO", ""),
+                            currency=currency,
+                        )
+                    current = None
+                elif not closing:
+                    current = {}
+            elif current is not None and not closing and value:
+                current[tag] = value
+
+
+# ============ ПОИСК РЕГУЛЯРНЫХ СПИСАНИЙ ============
+
+_MERCHANT_NOISE = re.compile(r"[^a-zа-я+ ]+")
+
+# Переводы и снятия наличных регулярны, но это не подписки
+NOT_SUBSCRIPTIONS = re.compile(r"^(перевод|пополнение|снятие|зачисление|возврат|cash|atm|transfer)")
+
+
+def merchant_key(description: str) -> Tuple[str, Optional[str]]:
+    """
+    (ключ группировки, service_id): «YANDEX*5815*PLUS MOSCOW» → yandex_plus.
+    Без совпадения с каталогом — первые слова описания без цифр и знаков.
+    """
+    cleaned = " ".join(_MERCHANT_NOISE.sub(" ", normalize_name(description)).split())
+    if NOT_SUBSCRIPTIONS.match(cleaned):
+        return "", None
+    service_id = match_service_id(cleaned)
+    if service_id:
+        return f"service:{service_id}", service_id
+    return " ".join(cleaned.split()[:3]), None
+
+
+def ledger_entries(transactions: Iterable[Transaction]) -> List[dict]:
+    """Расходы выписки с ключом продавца — строки ledger_charges (сумма положительная)"""
+    entries = []
+    has_negative = False
+    
+    for transaction in transactions:
+        key, service_id = merchant_key(transaction.description)
+        if not key:
+            continue
+        has_negative = has_negative or transaction.amount < 0
+        entries.append({
+            "merchant": key,
+            "service_id": service_id,
+            "description": transaction.description.strip()[:255],
+            "amount": transaction.amount,
+            "currency": transaction.currency or "RUB",
+            "charged_on": transaction.posted,
+        })
+    
+    # Если в выписке есть отрицательные суммы — это расходы, положительные — поступления
+    return [
+        dict(entry, amount=abs(entry["amount"]))
+        for entry in entries
+        if entry["amount"] < 0 or not has_negative
+    ]
+
+
+def detect_recurring(entries: List[dict], today: date = None) -> List[ImportItem]:
+    """Регулярные списания среди расходов выписки: один продавец, ровный интервал, стабильная сумма"""
+    today = today or date.today()
+    patterns = detect_recurring_charges(
+        [0] * len(entries),
+        [entry["merchant"] for entry in entries],
+        to_ordinals([entry["charged_on"] for entry in entries]),
+        [entry["amount"] for entry in entries],
+        today
+    )
+    
+    items = []
+    for pattern in patterns:
+        last = entries[pattern.last_index]
+        service_id = last["service_id"]
+        catalog_name = SUBSCRIPTIONS_CATALOG.get(service_id, {}).get("name") if service_id else None
+        
+        items.append(ImportItem(
+            name=catalog_name or last["description"][:100],
+            price=pattern.price,
+            billing_cycle=pattern.cycle.value,
+            start_date=pattern.first_charged_on.isoformat(),
+            next_billing_date=pattern.next_expected_on(today).isoformat(),
+            currency=last["currency"],
+            service_id=service_id,
+            charges=pattern.charges,
+        ))
+    
+    items.sort(key=lambda item: -item.price)
+    return items
+
+
+# ============ РАЗБОР ФАЙЛА ============
+
+def _item_from_row(columns: Dict[str, int], row: List[str], today: date) -> Optional[ImportItem]:
+    """Строка списка подписок (в т.ч. наш экспорт) → ImportItem"""
+    def cell(field: str) -> str:
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ""
+    
+    if columns.get("record") is not None and cell("record") != "subscription":
+        return None
+    if cell("status").lower() in ("cancelled", "отменена"):
+        return None
+    
+    name = cell("name")
+    price = parse_amount(cell("price"))
+    if not name or price is None:
+        return None
+    
+    cycle = CYCLE_NAMES.get(cell("billing_cycle").lower(), BillingCycle.MONTHLY)
+    next_date = parse_date(cell("next_billing_date"))
+    if next_date is None or next_date < today:
+        next_date = next_billing_after(next_date or today, cycle, today - timedelta(days=1))
+    
+    return ImportItem(
+        name=name[:100],
+        price=abs(price),
+        billing_cycle=cycle.value,
+        start_date=today.isoformat(),
+        next_billing_date=next_date.isoformat(),
+        service_id=match_service_id(name),
+    )
+
+
+def parse_import_file(file: Union[BinaryIO, TextIO], today: date = None) -> ImportResult:
+    """
+    Подписки из файла. Формат определяется по содержимому:
+    OFX → выписка; CSV с колонками название+цена → список подписок;
+    CSV с датой, суммой и описанием → выписка банка (Т-Банк, Сбер, Альфа и др.).
+    """
+    today = today or date.today()
+    stream = file if isinstance(file, io.TextIOBase) else open_text(file)
+    
+    is_ofx, head = _sniff_ofx(stream)
+    lines = itertools.chain(head, stream)
+    if is_ofx:
+        entries = ledger_entries(iter_ofx_transactions(lines))
+        return ImportResult(detect_recurring(entries, today), entries)
+    
+    rows = iter_csv_rows(_LineStream(lines))
+    first = next(rows, None)
+    if first is None:
+        return ImportResult([])
+    columns = first[0]
+    rows = _prepend(first, rows)
+    
+    if "name" in columns and "price" in columns:
+        items = (_item_from_row(columns, row, today) for columns, row in rows)
+        return ImportResult([item for item in items if item])
+    
+    if "date" in columns and "description" in columns and ("amount" in columns or "debit" in columns):
+        entries = ledger_entries(_iter_bank_transactions(rows))
+        return ImportResult(detect_recurring(entries, today), entries)
+    
+    raise ValueError("Не удалось распознать формат файла")
+
+
+def _iter_bank_transactions(rows: Iterable[Tuple[Dict[str, int], List[str]]]) -> Iterator[Transaction]:
+    for columns, row in rows:
+        def cell(field: str) -> str:
+            index = columns.get(field)
+            return row[index].strip() if index is not None and index < len(row) else ""
+        
+        if cell("status").lower() in FAILED_STATUSES:
+            continue
+        
+        posted = parse_date(cell("date"))
+        if "debit" in columns:
+            debit = parse_amount(cell("debit"))
+            amount = -abs(debit) if debit else None
+        else:
+            amount = parse_amount(cell("amount"))
+        if posted is None or not amount:
+            continue
+        
+        yield Transaction(
+            posted=posted,
+            amount=amount,
+            description=cell("description"),
+            currency=cell("currency") or "RUB",
+        )
+
+
+def _prepend(first, rest: Iterable) -> Iterator:
+    yield first
+    yield from rest
+
+
+class _LineStream:
+    """Итератор строк с readline() — для csv.Sniffer по первой строке"""
+    
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+    
+    def readline(self) -> str:
+        return next(self._lines, "")
+    
+    def __iter__(self):
+        return self._lines
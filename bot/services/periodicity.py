@@ -0,0 +1,157 @@
+"""
+📈 Поиск регулярных списаний в истории операций
+Один векторный проход NumPy по всем продавцам всех пользователей:
+интервалы между списаниями раскладываются по корзинам периодов, суммы — по уровням цены
+"""
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..database import next_billing_after
+from ..models import BillingCycle
+
+# Корзины интервалов между списаниями: (период, от, до дней включительно, минимум списаний)
+CYCLE_BINS = [
+    (BillingCycle.WEEKLY, 6, 8, 3),
+    (BillingCycle.MONTHLY, 26, 35, 2),
+    (BillingCycle.QUARTERLY, 84, 98, 2),
+    (BillingCycle.YEARLY, 350, 380, 2),
+]
+
+# Границы для np.digitize: нечётный номер — интервал попал в корзину
+_CYCLE_EDGES = np.array([edge for _, low, high, _ in CYCLE_BINS for edge in (low, high + 1)])
+_CYCLE_MAX_DAYS = np.array([high for _, _, high, _ in CYCLE_BINS])
+_MIN_CHARGES = np.array([min_charges for *_, min_charges in CYCLE_BINS])
+
+# Соседние списания, отличающиеся меньше чем на 5%, — одна цена (курс, копейки)
+AMOUNT_JITTER = 0.05
+
+# Доля интервалов, попавших в основную корзину, и допустимая доля смен цены
+MIN_CYCLE_SHARE = 2 / 3
+MAX_PRICE_JUMP_SHARE = 1 / 3
+
+
+@dataclass
+class RecurringPattern:
+    """Регулярные списания одного продавца у одного пользователя"""
+    user_id: int
+    merchant: str
+    cycle: BillingCycle
+    price: float  # Последнее списание
+    previous_price: Optional[float]  # Цена до последнего изменения
+    price_changed_on: Optional[date]
+    first_charged_on: date
+    last_charged_on: date
+    charges: int
+    is_active: bool  # Последнее списание не старше одного периода
+    last_index: int  # Номер последнего списания во входных массивах
+    
+    def next_expected_on(self, today: date) -> date:
+        return next_billing_after(self.last_charged_on, self.cycle, today - timedelta(days=1))
+
+
+def to_ordinals(dates: Sequence[date]) -> np.ndarray:
+    return np.fromiter((d.toordinal() for d in dates), dtype=np.int64, count=len(dates))
+
+
+def detect_recurring_charges(
+    user_ids: Sequence[int],
+    merchants: Sequence[str],
+    days: Sequence[int],
+    amounts: Sequence[float],
+    today: date = None
+) -> List[RecurringPattern]:
+    """
+    Регулярные списания по столбцам истории: пользователь, ключ продавца,
+    день (date.toordinal()) и сумма. Порядок строк любой.
+
+    Группа (пользователь, продавец) регулярна, если не меньше 2/3 интервалов
+    попали в одну корзину периода, а цена менялась не чаще, чем в каждом третьем интервале.
+    Всё, кроме сборки результата, считается без циклов Python.
+    """
+    today = today or date.today()
+    days = np.asarray(days, dtype=np.int64)
+    if days.size == 0:
+        return []
+    
+    users = np.asarray(user_ids, dtype=np.int64)
+    amounts = np.abs(np.asarray(amounts, dtype=np.float64))
+    # Коды продавцов через словарь: np.unique по строкам на миллионах строк в разы медленнее
+    merchant_codes: Dict[str, int] = {}
+    codes = np.fromiter(
+        (merchant_codes.setdefault(merchant, len(merchant_codes)) for merchant in merchants),
+        dtype=np.int64, count=len(merchants)
+    )
+    merchant_names = list(merchant_codes)
+    
+    order = np.lexsort((days, codes, users))
+    users, codes, days, amounts = users[order], codes[order], days[order], amounts[order]
+    
+    # Несколько операций у продавца в один день — одно списание
+    keep = np.ones(days.size, dtype=bool)
+    keep[1:] = (users[1:] != users[:-1]) | (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])
+    order, users, codes, days, amounts = order[keep], users[keep], codes[keep], days[keep], amounts[keep]
+    
+    # Группы (пользователь, продавец) — непрерывные отрезки после сортировки
+    is_start = np.ones(days.size, dtype=bool)
+    is_start[1:] = (users[1:] != users[:-1]) | (codes[1:] != codes[:-1])
+    group = np.cumsum(is_start) - 1
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, days.size))
+    ends = starts + counts - 1
+    n_groups = starts.size
+    n_intervals = counts - 1
+    
+    # Пары соседних списаний внутри группы
+    pairs = np.flatnonzero(~is_start[1:])
+    pair_group = group[pairs + 1]
+    intervals = days[pairs + 1] - days[pairs]
+    
+    # Гистограмма интервалов по корзинам периодов, период — самая заполненная корзина
+    bins = np.digitize(intervals, _CYCLE_EDGES)
+    in_bin = bins % 2 == 1
+    histogram = np.bincount(
+        pair_group[in_bin] * len(CYCLE_BINS) + bins[in_bin] // 2,
+        minlength=n_groups * len(CYCLE_BINS)
+    ).reshape(n_groups, len(CYCLE_BINS))
+    cycle_bin = histogram.argmax(axis=1)
+    cycle_hits = histogram[np.arange(n_groups), cycle_bin]
+    
+    # Уровни цены: скачок — соседние суммы расходятся больше чем на AMOUNT_JITTER
+    previous = amounts[pairs]
+    jumps = np.abs(amounts[pairs + 1] - previous) > previous * AMOUNT_JITTER
+    n_jumps = np.bincount(pair_group, weights=jumps, minlength=n_groups)
+    
+    jump_positions = pairs[jumps] + 1
+    last_jump = np.full(n_groups, -1, dtype=np.int64)
+    np.maximum.at(last_jump, group[jump_positions], jump_positions)
+    
+    regular = (
+        (n_intervals > 0)
+        & (counts >= _MIN_CHARGES[cycle_bin])
+        & (cycle_hits >= n_intervals * MIN_CYCLE_SHARE)
+        & (n_jumps <= n_intervals * MAX_PRICE_JUMP_SHARE)
+        & (amounts[ends] > 0)
+    )
+    active = today.toordinal() - days[ends] <= _CYCLE_MAX_DAYS[cycle_bin]
+    
+    patterns = []
+    for g in np.flatnonzero(regular):
+        end, jump = ends[g], last_jump[g]
+        patterns.append(RecurringPattern(
+            user_id=int(users[end]),
+            merchant=str(merchant_names[codes[end]]),
+            cycle=CYCLE_BINS[cycle_bin[g]][0],
+            price=round(float(amounts[end]), 2),
+            previous_price=round(float(amounts[jump - 1]), 2) if jump >= 0 else None,
+            price_changed_on=date.fromordinal(int(days[jump])) if jump >= 0 else None,
+            first_charged_on=date.fromordinal(int(days[starts[g]])),
+            last_charged_on=date.fromordinal(int(days[end])),
+            charges=int(counts[g]),
+            is_active=bool(active[g]),
+            last_index=int(order[end]),
+        ))
+    return patterns
@@ -0,0 +1,163 @@
+"""
+🔁 Регулярные списания из истории операций
+Расходы из загруженных выписок копятся в ledger_charges, фоновая задача
+пачками пользователей пересчитывает recurring_charges: период, смены цены, забытые подписки
+"""
+
+import logging
+from datetime import date, datetime
+from typing import List
+
+from sqlalchemy import select, delete, insert
+
+from ..data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
+from ..database import async_session, _insert_ignore_conflicts
+from ..models import User, Subscription, SubscriptionStatus, LedgerCharge, RecurringCharge
+from .importer import merchant_key
+from .periodicity import detect_recurring_charges, to_ordinals
+
+logger = logging.getLogger(__name__)
+
+
+async def _scan_users(session, user_ids: List[int], today: date) -> int:
+    """Пересчитать recurring_charges пачки пользователей по всей их истории"""
+    result = await session.execute(
+        select(
+            LedgerCharge.user_id, LedgerCharge.merchant, LedgerCharge.charged_on, LedgerCharge.amount,
+            LedgerCharge.service_id, LedgerCharge.description, LedgerCharge.currency
+        )
+        .where(LedgerCharge.user_id.in_(user_ids))
+    )
+    charges = result.all()
+    
+    patterns = detect_recurring_charges(
+        [row.user_id for row in charges],
+        [row.merchant for row in charges],
+        to_ordinals([row.charged_on for row in charges]),
+        [row.amount for row in charges],
+        today
+    )
+    
+    updated_at = datetime.utcnow()
+    rows = []
+    for pattern in patterns:
+        last = charges[pattern.last_index]
+        catalog_name = SUBSCRIPTIONS_CATALOG.get(last.service_id, {}).get("name") if last.service_id else None
+        rows.append({
+            "user_id": pattern.user_id,
+            "merchant": pattern.merchant,
+            "service_id": last.service_id,
+            "name": catalog_name or (last.description or pattern.merchant)[:100],
+            "billing_cycle": pattern.cycle,
+            "price": pattern.price,
+            "currency": last.currency or "RUB",
+            "previous_price": pattern.previous_price,
+            "price_changed_on": pattern.price_changed_on,
+            "first_charged_on": pattern.first_charged_on,
+            "last_charged_on": pattern.last_charged_on,
+            "next_expected_on": pattern.next_expected_on(today) if pattern.is_active else None,
+            "charges_count": pattern.charges,
+            "is_active": pattern.is_active,
+            "updated_at": updated_at,
+        })
+    
+    await session.execute(delete(RecurringCharge).where(RecurringCharge.user_id.in_(user_ids)))
+    if rows:
+        await session.execute(insert(RecurringCharge), rows)
+    return len(rows)
+
+
+async def scan_recurring_charges(today: date = None, chunk_size: int = 500) -> int:
+    """
+    Пересчитать регулярные списания всех пользователей с историей.
+    Пользователи обходятся пачками по id, история пачки разбирается
+    одним векторным проходом и сохраняется своей транзакцией.
+    """
+    today = today or date.today()
+    last_user_id = 0
+    saved = 0
+    
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(LedgerCharge.user_id)
+                .where(LedgerCharge.user_id > last_user_id)
+                .group_by(LedgerCharge.user_id)
+                .order_by(LedgerCharge.user_id)
+                .limit(chunk_size)
+            )
+            user_ids = list(result.scalars().all())
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+            
+            saved += await _scan_users(session, user_ids, today)
+            await session.commit()
+    
+    logger.info(f"Регулярные списания: найдено {saved}")
+    return saved
+
+
+async def add_ledger_charges(telegram_id: int, entries: List[dict], today: date = None) -> int:
+    """
+    Сохранить расходы выписки (importer.ledger_entries) и пересчитать регулярные списания пользователя.
+    Уже загруженные операции пропускаются. Возвращает число регулярных списаний пользователя.
+    """
+    if not entries:
+        return 0
+    
+    async with async_session() as session:
+        result = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+        user_id = result.scalar_one_or_none()
+        if user_id is None:
+            return 0
+        
+        await session.execute(
+            _insert_ignore_conflicts(LedgerCharge),
+            [dict(entry, user_id=user_id, source="import") for entry in entries]
+        )
+        found = await _scan_users(session, [user_id], today or date.today())
+        await session.commit()
+    
+    return found
+
+
+async def get_recurring_charges(telegram_id: int) -> List[RecurringCharge]:
+    """Найденные регулярные списания пользователя, дорогие первыми"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(RecurringCharge)
+            .join(User, RecurringCharge.user_id == User.id)
+            .where(User.telegram_id == telegram_id)
+            .order_by(RecurringCharge.price.desc())
+        )
+        return list(result.scalars().all())
+
+
+def find_untracked(charges: List[RecurringCharge], subscriptions: List[Subscription]) -> List[RecurringCharge]:
+    """
+    Забытые подписки: деньги списываются до сих пор, а в боте подписки нет
+    (или она отмечена отменённой).
+    """
+    tracked_services = set()
+    tracked_merchants = set()
+    for sub in subscriptions:
+        if sub.status == SubscriptionStatus.CANCELLED:
+            continue
+        key, service_id = merchant_key(sub.name)
+        if key:
+            tracked_merchants.add(key)
+        service_id = sub.service_id or service_id
+        if service_id:
+            tracked_services.add(service_id)
+    
+    def is_tracked(charge: RecurringCharge) -> bool:
+        if charge.service_id and charge.service_id in tracked_services:
+            return True
+        # «Netflix» в боте и «NETFLIX.COM AMSTERDAM» в выписке — один продавец
+        return any(
+            charge.merchant == key or charge.merchant.startswith(key + " ")
+            for key in tracked_merchants
+        )
+    
+    return [charge for charge in charges if charge.is_active and not is_tracked(charge)]
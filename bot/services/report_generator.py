@@ -8,7 +8,7 @@ from dataclasses import dataclass
 
 from ..models import Subscription, BillingCycle
 from ..database import get_user_subscriptions, get_user
-from .smart_analytics import generate_full_report, calculate_monthly_price
+from .smart_analytics import generate_full_report, calculate_monthly_price, MONTH_NAMES
 
 
 async def generate_monthly_text_report(telegram_id: int) -> str:
@@ -17,12 +17,7 @@ async def generate_monthly_text_report(telegram_id: int) -> str:
     report = await generate_full_report(telegram_id)
     user = await get_user(telegram_id)
     
-    month_names = [
-        "", "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-        "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
-    ]
-    
-    current_month = month_names[date.today().month]
+    current_month = MONTH_NAMES[date.today().month]
     
     text = f"""
 ╔══════════════════════════════════════╗
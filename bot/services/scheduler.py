@@ -2,32 +2,108 @@
 ⏰ Планировщик уведомлений
 """
 
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
+from typing import AsyncIterator, List, Optional, Tuple
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from aiogram import Bot
 import logging
 
-from ..database import async_session, get_upcoming_billings, get_expiring_trials
-from ..models import User, Reminder
+from ..database import (
+    async_session, iter_due_billings, refresh_notify_slots, get_expiring_trials,
+    roll_forward_billing_dates, refresh_spending_snapshots, reconcile_spending_summaries
+)
+from ..models import User, Reminder, Subscription
 from ..services.trial_tracker import get_critical_trials
 from ..services.report_generator import generate_monthly_text_report
+from ..services.delivery import DeliveryEngine
+from ..services.delta_sync import purge_sync_tombstones
+from ..services.duplicate_scan import scan_all_duplicates
+from ..services.recurring_scan import scan_recurring_charges
 from sqlalchemy import select, and_
 
 logger = logging.getLogger(__name__)
 
+# Минуты, пропущенные рассылкой (опоздание, misfire, долгий прогон), досылаются,
+# но не старше этого — после долгого простоя напоминание не придёт посреди ночи
+MAX_CATCHUP_MINUTES = 30
+
+# Последняя минута (UTC), чьи слоты уже разосланы
+_last_dispatched: Optional[datetime] = None
+
 
 async def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
     """Настройка планировщика"""
     
     scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
     
-    # Ежедневная проверка уведомлений в 10:00
+    # Слоты отправки могли устареть (летнее время, новые пользователи)
+    await refresh_notify_slots()
+    
+    # Напоминания о списаниях — каждую минуту для тех, у кого сейчас notify_time
     scheduler.add_job(
-        send_daily_reminders,
-        CronTrigger(hour=10, minute=0),
+        dispatch_reminders,
+        CronTrigger(minute="*"),
         args=[bot],
         id="daily_reminders",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=3,
+        misfire_grace_time=50
+    )
+    
+    scheduler.add_job(
+        refresh_notify_slots,
+        CronTrigger(hour=3, minute=0),
+        id="refresh_notify_slots",
+        replace_existing=True
+    )
+    
+    # Просроченные даты списаний — переносим вперёд и пишем историю списаний
+    scheduler.add_job(
+        roll_forward_billing_dates,
+        CronTrigger(hour=3, minute=30),
+        id="roll_forward_billing",
+        replace_existing=True
+    )
+    
+    # Новые списания — в помесячную историю расходов (только прирост с прошлого прогона)
+    scheduler.add_job(
+        refresh_spending_snapshots,
+        CronTrigger(hour=3, minute=45),
+        id="spending_snapshots",
+        replace_existing=True
+    )
+    
+    # Сверка итогов расходов с подписками — находит и исправляет расхождения
+    scheduler.add_job(
+        reconcile_spending_summaries,
+        CronTrigger(hour=4, minute=45),
+        id="reconcile_spending_summaries",
+        replace_existing=True
+    )
+    
+    # Пересчёт дубликатов по всем пользователям
+    scheduler.add_job(
+        scan_all_duplicates,
+        CronTrigger(hour=4, minute=0),
+        id="duplicate_scan",
+        replace_existing=True
+    )
+    
+    # Регулярные списания по истории выписок: период, подорожания, забытые подписки
+    scheduler.add_job(
+        scan_recurring_charges,
+        CronTrigger(hour=4, minute=30),
+        id="recurring_scan",
+        replace_existing=True
+    )
+    
+    # Старые надгробия дельта-синхронизации
+    scheduler.add_job(
+        purge_sync_tombstones,
+        CronTrigger(hour=5, minute=0),
+        id="purge_sync_tombstones",
         replace_existing=True
     )
     
@@ -63,47 +139,77 @@ async def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
     return scheduler
 
 
-async def send_daily_reminders(bot: Bot):
-    """Отправка ежедневных напоминаний о списаниях"""
-    
-    logger.info("Запуск ежедневных напоминаний...")
+def format_billing_reminder(upcoming: List[Subscription], today: date) -> str:
+    """Текст напоминания о ближайших списаниях"""
+    text = "🔔 <b>Напоминание о списаниях</b>\n\n"
     
-    async with async_session() as session:
-        # Получаем всех пользователей
-        result = await session.execute(select(User))
-        users = result.scalars().all()
+    for sub in upcoming:
+        days = (sub.next_billing_date - today).days
         
-        for user in users:
-            try:
-                # Получаем ближайшие списания
-                upcoming = await get_upcoming_billings(
-                    user.telegram_id, 
-                    days=user.notify_before_days
-                )
-                
-                if not upcoming:
-                    continue
-                
-                text = "🔔 <b>Напоминание о списаниях</b>\n\n"
-                
-                for sub in upcoming:
-                    days = (sub.next_billing_date - date.today()).days
-                    
-                    if days == 0:
-                        text += f"⚠️ <b>Сегодня</b>: {sub.name} — {sub.price:,.0f}₽\n"
-                    elif days == 1:
-                        text += f"🟡 <b>Завтра</b>: {sub.name} — {sub.price:,.0f}₽\n"
-                    else:
-                        text += f"🟢 <b>Через {days} дн.</b>: {sub.name} — {sub.price:,.0f}₽\n"
-                
-                total = sum(s.price for s in upcoming)
-                text += f"\n💰 Итого: <b>{total:,.0f}₽</b>"
-                
-                await bot.send_message(user.telegram_id, text)
-                logger.info(f"Напоминание отправлено пользователю {user.telegram_id}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка отправки напоминания {user.telegram_id}: {e}")
+        if days == 0:
+            text += f"⚠️ <b>Сегодня</b>: {sub.name} — {sub.price:,.0f}₽\n"
+        elif days == 1:
+            text += f"🟡 <b>Завтра</b>: {sub.name} — {sub.price:,.0f}₽\n"
+        else:
+            text += f"🟢 <b>Через {days} дн.</b>: {sub.name} — {sub.price:,.0f}₽\n"
+    
+    total = sum(s.price for s in upcoming)
+    text += f"\n💰 Итого: <b>{total:,.0f}₽</b>"
+    
+    return text
+
+
+async def build_daily_reminders(slots: Optional[List[int]] = None) -> AsyncIterator[List[Tuple[int, str]]]:
+    """Готовые напоминания (telegram_id, текст) пачками — по странице запроса, сессия уже закрыта"""
+    async for batch in iter_due_billings(slots=slots):
+        yield [(telegram_id, format_billing_reminder(upcoming, today)) for telegram_id, today, upcoming in batch]
+
+
+def get_current_slot(now: datetime = None) -> int:
+    """Текущая минута суток по UTC"""
+    now = now or datetime.now(timezone.utc)
+    return now.hour * 60 + now.minute
+
+
+def claim_slots(now: datetime = None) -> List[int]:
+    """
+    Слоты от последнего разосланного (не включая) по текущую минуту.
+    Отмечаются разосланными сразу, до первого await: параллельный прогон (max_instances)
+    их не возьмёт, а опоздавший — не перескочит свою минуту
+    """
+    global _last_dispatched
+    now = (now or datetime.now(timezone.utc)).replace(second=0, microsecond=0)
+    
+    start = now
+    if _last_dispatched is not None:
+        start = max(_last_dispatched + timedelta(minutes=1), now - timedelta(minutes=MAX_CATCHUP_MINUTES))
+    if start > now:
+        return []
+    
+    _last_dispatched = now
+    minutes = (now - start) // timedelta(minutes=1)
+    return [get_current_slot(start + timedelta(minutes=i)) for i in range(minutes + 1)]
+
+
+async def dispatch_reminders(bot: Bot):
+    """Разослать напоминания пользователям слотов с прошлого прогона"""
+    slots = claim_slots()
+    if slots:
+        await send_daily_reminders(bot, slots=slots)
+
+
+async def send_daily_reminders(bot: Bot, slots: Optional[List[int]] = None):
+    """Отправка ежедневных напоминаний о списаниях (slots=None — всем сразу)"""
+    
+    logger.info(f"Запуск напоминаний, слоты {slots}...")
+    
+    async with DeliveryEngine(bot) as engine:
+        # Очередь доставки ограничена лимитами Telegram — ждём её без открытого курсора
+        async for reminders in build_daily_reminders(slots):
+            for telegram_id, text in reminders:
+                await engine.submit(telegram_id, text)
+    
+    logger.info(f"Напоминания: {engine.stats}")
 
 
 async def send_trial_alerts(bot: Bot):
@@ -112,12 +218,13 @@ async def send_trial_alerts(bot: Bot):
     logger.info("Проверка критических триалов...")
     
     async with async_session() as session:
-        result = await session.execute(select(User))
-        users = result.scalars().all()
-        
-        for user in users:
+        result = await session.execute(select(User.telegram_id))
+        telegram_ids = result.scalars().all()
+    
+    async with DeliveryEngine(bot) as engine:
+        for telegram_id in telegram_ids:
             try:
-                alerts = await get_critical_trials(user.telegram_id)
+                alerts = await get_critical_trials(telegram_id)
                 
                 if not alerts:
                     continue
@@ -134,11 +241,12 @@ async def send_trial_alerts(bot: Bot):
                 
                 text += "\n💡 Не забудь отменить, если не планируешь продлевать!"
                 
-                await bot.send_message(user.telegram_id, text)
-                logger.info(f"Триал-алерт отправлен {user.telegram_id}")
+                await engine.submit(telegram_id, text)
                 
             except Exception as e:
-                logger.error(f"Ошибка отправки триал-алерта {user.telegram_id}: {e}")
+                logger.error(f"Ошибка подготовки триал-алерта {telegram_id}: {e}")
+    
+    logger.info(f"Триал-алерты: {engine.stats}")
 
 
 async def send_monthly_reports(bot: Bot):
@@ -149,24 +257,23 @@ async def send_monthly_reports(bot: Bot):
     async with async_session() as session:
         # Только пользователи с включёнными отчётами
         result = await session.execute(
-            select(User).where(User.notify_monthly_report == True)
+            select(User.telegram_id).where(User.notify_monthly_report == True)
         )
-        users = result.scalars().all()
-        
-        for user in users:
+        telegram_ids = result.scalars().all()
+    
+    async with DeliveryEngine(bot) as engine:
+        for telegram_id in telegram_ids:
             try:
-                report = await generate_monthly_text_report(user.telegram_id)
+                report = await generate_monthly_text_report(telegram_id)
                 
                 intro = "📊 <b>Твой месячный отчёт готов!</b>\n\n"
                 
-                await bot.send_message(
-                    user.telegram_id,
-                    intro + report
-                )
-                logger.info(f"Месячный отчёт отправлен {user.telegram_id}")
+                await engine.submit(telegram_id, intro + report)
                 
             except Exception as e:
-                logger.error(f"Ошибка отправки отчёта {user.telegram_id}: {e}")
+                logger.error(f"Ошибка подготовки отчёта {telegram_id}: {e}")
+    
+    logger.info(f"Месячные отчёты: {engine.stats}")
 
 
 async def send_custom_reminder(bot: Bot, reminder: Reminder):
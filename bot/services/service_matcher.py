@@ -0,0 +1,147 @@
+"""
+🔎 Сопоставление названий подписок с каталогом
+Автомат Ахо-Корасик по названиям, ID и синонимам — один проход по строке
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
+
+# Написания, которые пользователи вводят вместо названия из каталога
+SERVICE_ALIASES = {
+    "yandex_plus": ["яндекс плюс", "яндекс+", "yandex plus", "yandex+"],
+    "yandex_plus_multi": ["яндекс плюс мульти", "плюс мульти", "yandex plus multi"],
+    "sber_prime": ["сберпрайм", "сбер прайм", "sberprime", "sber prime"],
+    "mts_premium": ["мтс premium", "мтс премиум", "mts premium"],
+    "tinkoff_pro": ["тинькофф pro", "тинькофф про", "tinkoff pro", "т-банк pro", "т-банк про"],
+    "vk_combo": ["вк комбо", "vk комбо"],
+    "kinopoisk": ["кинопоиск", "kinopoisk"],
+    "ivi": ["иви", "ivi"],
+    "okko": ["окко", "okko"],
+    "kion": ["кион", "kion"],
+    "premier": ["премьер тв", "premier tv", "premier.one"],
+    "wink": ["винк", "wink tv", "wink.ru", "wink ростелеком"],
+    "start": ["старт тв", "start tv", "start.ru", "кинотеатр старт", "кинотеатр start"],
+    "amediateka": ["амедиатека", "amediateka"],
+    "yandex_music": ["яндекс музыка", "yandex music"],
+    "vk_music": ["вк музыка", "vk музыка", "vk music", "boom музыка", "boom music"],
+    "apple_music": ["эпл мьюзик"],
+    "sber_zvuk": ["сберзвук", "sberzvuk", "сбер звук"],
+    "mts_music": ["мтс музыка", "mts music"],
+    "zvuk": ["zvuk", "zvuk.com", "звук музыка"],
+    "litres": ["литрес", "litres"],
+    "bookmate": ["букмейт"],
+    "yandex_disk": ["яндекс диск", "yandex disk"],
+    "mail_cloud": ["облако mail", "облако маил", "mail cloud"],
+    "icloud": ["icloud", "айклауд"],
+    "google_one": ["гугл ван"],
+    "telegram_premium": ["телеграм премиум", "telegram premium", "tg premium"],
+    "ps_plus": ["ps plus", "playstation plus"],
+    "xbox_game_pass": ["game pass", "xbox game pass"],
+    "yandex_taxi": ["яндекс go", "yandex go"],
+}
+
+# Обычные слова, совпадающие с названием или ID сервиса: «Netflix Start», тариф «Старт», «Звук».
+# Сами по себе сервис не определяют — только синонимы из двух слов выше
+GENERIC_WORDS = frozenset({"start", "старт", "premier", "премьер", "wink", "звук", "boom"})
+
+_SPACES = re.compile(r"[\s_]+")
+
+
+def normalize_name(name: str) -> str:
+    """Нижний регистр, ё → е, подчёркивания и повторные пробелы → один пробел"""
+    return _SPACES.sub(" ", (name or "").lower().replace("ё", "е")).strip()
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо-Корасик: все вхождения всех шаблонов за один проход по тексту.
+    Узлы — словари переходов, выходы узла уже включают выходы суффиксных ссылок.
+    """
+    
+    def __init__(self, patterns: Dict[str, str]):
+        # patterns: шаблон → значение
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[Tuple[int, str], ...]] = [()]
+        
+        for pattern, value in patterns.items():
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = next_node
+            self._out[node] = ((len(pattern), value),)
+        
+        # Суффиксные ссылки — обходом в ширину
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+    
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """(начало, конец, значение) каждого вхождения"""
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._out[node]:
+                yield end - length, end, value
+
+
+def _build_patterns() -> Dict[str, str]:
+    """Шаблон → service_id: названия и ID каталога плюс синонимы"""
+    patterns: Dict[str, str] = {}
+    
+    for service_id, info in SUBSCRIPTIONS_CATALOG.items():
+        patterns.setdefault(normalize_name(info["name"]), service_id)
+        patterns.setdefault(normalize_name(service_id), service_id)
+    
+    # Синонимы важнее случайных совпадений с ID
+    for service_id, aliases in SERVICE_ALIASES.items():
+        for alias in aliases:
+            patterns[normalize_name(alias)] = service_id
+    
+    for word in GENERIC_WORDS:
+        patterns.pop(word, None)
+    return patterns
+
+
+# Строится один раз при импорте
+SERVICE_AUTOMATON = AhoCorasick(_build_patterns())
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+@lru_cache(maxsize=4096)
+def match_service_id(name: str) -> Optional[str]:
+    """
+    service_id каталога по произвольному названию или None.
+    Совпадение должно стоять на границах слов; из нескольких берётся самое длинное,
+    при равной длине — самое левое («Яндекс Плюс Мульти» → yandex_plus_multi).
+    """
+    text = normalize_name(name)
+    best = None
+    
+    for start, end, service_id in SERVICE_AUTOMATON.iter_matches(text):
+        if not (_is_boundary(text, start - 1) and _is_boundary(text, end)):
+            continue
+        if best is None or end - start > best[1] - best[0] or (end - start == best[1] - best[0] and start < best[0]):
+            best = (start, end, service_id)
+    
+    return best[2] if best else None
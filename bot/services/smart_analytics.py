@@ -10,8 +10,12 @@ from enum import Enum
 from collections import defaultdict
 
 from ..models import Subscription, BillingCycle, SubscriptionStatus
-from ..database import get_user_subscriptions, get_monthly_spending, get_spending_by_category
+from ..database import (
+    get_user_subscriptions, get_monthly_spending, get_spending_by_category, get_spending_history, add_months,
+    get_spending_summary
+)
 from ..data.subscriptions_catalog import SUBSCRIPTION_CATEGORIES
+from .recurring_scan import get_recurring_charges, find_untracked
 
 
 class TipPriority(Enum):
@@ -124,12 +128,11 @@ async def generate_full_report(telegram_id: int) -> AnalyticsReport:
             days_until_next_billing=0
         )
     
-    # Считаем основные метрики
+    # Основные метрики — из итогов, которые обновляются вместе с подписками
+    summary = await get_spending_summary(telegram_id)
     active_subs = [s for s in subscriptions if s.status == SubscriptionStatus.ACTIVE]
-    paused_subs = [s for s in subscriptions if s.status == SubscriptionStatus.PAUSED]
-    trial_subs = [s for s in subscriptions if s.is_trial]
     
-    total_monthly = sum(calculate_monthly_price(s.price, s.billing_cycle) for s in active_subs)
+    total_monthly = summary.monthly_total
     total_yearly = total_monthly * 12
     
     # Разбивка по категориям
@@ -156,29 +159,22 @@ async def generate_full_report(telegram_id: int) -> AnalyticsReport:
     
     # Ближайшее списание
     next_billing_amount = 0
-    days_until_next = 999
-    today = date.today()
-    
-    for sub in active_subs:
-        if sub.next_billing_date:
-            days = (sub.next_billing_date - today).days
-            if 0 <= days < days_until_next:
-                days_until_next = days
-                next_billing_amount = sub.price
+    days_until_next = 0
     
-    if days_until_next == 999:
-        days_until_next = 0
+    if summary.next_billing_date and summary.next_billing_date >= date.today():
+        days_until_next = (summary.next_billing_date - date.today()).days
+        next_billing_amount = summary.next_billing_amount
     
-    # Тренды (упрощённо — в реальном проекте нужна история)
-    trends = _generate_mock_trends(total_monthly)
+    # Тренды — по фактическим списаниям прошлых месяцев
+    trends = await get_spending_trends(telegram_id)
     
     return AnalyticsReport(
         total_monthly=round(total_monthly, 2),
         total_yearly=round(total_yearly, 2),
-        subscriptions_count=len(subscriptions),
-        active_count=len(active_subs),
-        paused_count=len(paused_subs),
-        trials_count=len(trial_subs),
+        subscriptions_count=summary.subscriptions_count,
+        active_count=summary.active_count,
+        paused_count=summary.paused_count,
+        trials_count=summary.trials_count,
         by_category=by_category,
         trends=trends,
         tips=tips,
@@ -224,30 +220,45 @@ async def _calculate_category_breakdown(
     return result
 
 
-def _generate_mock_trends(current_monthly: float) -> List[SpendingTrend]:
-    """Генерация трендов (заглушка — в реальном проекте нужна история)"""
-    
-    # Симулируем небольшие изменения
-    return [
-        SpendingTrend(
-            period="Этот месяц",
-            amount=current_monthly,
-            change_percent=0,
-            direction="stable"
-        ),
-        SpendingTrend(
-            period="Прошлый месяц",
-            amount=current_monthly * 0.95,
-            change_percent=5.3,
-            direction="up"
-        ),
-        SpendingTrend(
-            period="3 месяца назад",
-            amount=current_monthly * 0.85,
-            change_percent=17.6,
-            direction="up"
-        )
-    ]
+MONTH_NAMES = [
+    "", "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+    "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
+]
+
+
+async def get_spending_trends(telegram_id: int, months: int = 6, today: date = None) -> List[SpendingTrend]:
+    """
+    Фактические списания за последние закрытые месяцы, новые первыми.
+    Изменение — к предыдущему месяцу; суммы берутся из spending_snapshots одним запросом.
+    """
+    current_month = (today or date.today()).replace(day=1)
+    history = await get_spending_history(telegram_id, add_months(current_month, -months), current_month)
+    if not history:
+        return []
+    
+    trends = []
+    month = min(history)
+    previous = None
+    
+    # Месяцы без списаний после начала истории — честный ноль
+    while month < current_month:
+        amount = history.get(month, 0.0)
+        if previous:
+            change = (amount - previous) / previous * 100
+        else:
+            change = 100.0 if amount and previous is not None else 0.0
+        
+        trends.append(SpendingTrend(
+            period=f"{MONTH_NAMES[month.month]} {month.year}",
+            amount=amount,
+            change_percent=round(abs(change), 1),
+            direction="up" if change >= 1 else "down" if change <= -1 else "stable"
+        ))
+        previous = amount
+        month = add_months(month, 1)
+    
+    trends.reverse()
+    return trends
 
 
 async def generate_smart_tips(
@@ -271,6 +282,7 @@ async def generate_smart_tips(
             action_text="Добавить подписку",
             action_callback="add_subscription"
         ))
+        tips.extend(await _recurring_charge_tips(telegram_id, subscriptions))
         return tips
     
     active_subs = [s for s in subscriptions if s.status == SubscriptionStatus.ACTIVE]
@@ -407,6 +419,9 @@ async def generate_smart_tips(
             category=TipCategory.INSIGHT
         ))
     
+    # 10. Забытые подписки и подорожания по истории выписок
+    tips.extend(await _recurring_charge_tips(telegram_id, subscriptions))
+    
     # Сортируем по приоритету и экономии
     priority_order = {TipPriority.HIGH: 0, TipPriority.MEDIUM: 1, TipPriority.LOW: 2}
     tips.sort(key=lambda t: (priority_order[t.priority], -t.potential_saving))
@@ -414,6 +429,48 @@ async def generate_smart_tips(
     return tips[:10]  # Максимум 10 советов
 
 
+async def _recurring_charge_tips(telegram_id: int, subscriptions: List[Subscription]) -> List[SmartTip]:
+    """Советы по регулярным списаниям из загруженных выписок"""
+    tips = []
+    
+    # Регулярные списания из выписок, которых нет в боте
+    recurring = await get_recurring_charges(telegram_id)
+    forgotten = find_untracked(recurring, subscriptions)
+    
+    if forgotten:
+        forgotten_monthly = sum(calculate_monthly_price(c.price, c.billing_cycle) for c in forgotten)
+        names = ", ".join(c.name for c in forgotten[:3])
+        tips.append(SmartTip(
+            title="🕵️ Забытые подписки",
+            description=f"По выписке регулярно списываются деньги за: {names}"
+                       f"{' и другие' if len(forgotten) > 3 else ''}. "
+                       f"В боте их нет, а это {forgotten_monthly:,.0f}₽/мес.",
+            potential_saving=forgotten_monthly,
+            priority=TipPriority.HIGH,
+            category=TipCategory.SAVING,
+            action_text="Импортировать выписку",
+            action_callback="import_subscriptions"
+        ))
+    
+    # Подорожания за последние 3 месяца
+    for charge in recurring:
+        if not (charge.is_active and charge.previous_price and charge.price_changed_on):
+            continue
+        if charge.price <= charge.previous_price or (date.today() - charge.price_changed_on).days > 90:
+            continue
+        tips.append(SmartTip(
+            title=f"📈 {charge.name} подорожала",
+            description=f"С {charge.price_changed_on.strftime('%d.%m.%Y')} списывается "
+                       f"{charge.price:,.0f}₽ вместо {charge.previous_price:,.0f}₽. "
+                       f"Проверь, не сменился ли тариф.",
+            potential_saving=calculate_monthly_price(charge.price - charge.previous_price, charge.billing_cycle),
+            priority=TipPriority.MEDIUM,
+            category=TipCategory.INSIGHT
+        ))
+    
+    return tips
+
+
 def get_priority_emoji(priority: TipPriority) -> str:
     """Эмодзи приоритета"""
     return {
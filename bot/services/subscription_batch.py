@@ -0,0 +1,216 @@
+"""
+📦 Пакетные правки подписок
+create / update / delete одной транзакцией: один INSERT на новые строки,
+UPDATE по первичному ключу пачкой (executemany) и один DELETE на удалённые
+(история их списаний остаётся, без subscription_id).
+Результат — по каждой правке, в порядке запроса
+"""
+
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, insert, update, delete
+
+from ..cache import invalidate_user
+from ..database import async_session, calculate_next_billing, mark_duplicates_stale, refresh_user_summaries
+from ..models import (
+    User, Subscription, SubscriptionStatus, BillingCycle, Reminder, SubscriptionCharge, SyncTombstone
+)
+
+logger = logging.getLogger(__name__)
+
+CHANGE_OPS = ("create", "update", "delete")
+
+# Правок в одном запросе
+MAX_BATCH_CHANGES = 200
+
+
+@dataclass
+class SubscriptionChange:
+    """Правка подписки от клиента"""
+    op: str  # create, update, delete
+    id: Optional[int] = None  # Подписка на сервере (update, delete)
+    client_id: Optional[str] = None  # Временный id новой подписки на клиенте
+    values: dict = field(default_factory=dict)  # Поля Subscription
+    error: Optional[str] = None  # Правка не разобрана — не применяется
+
+
+# ============ ФОРМАТ MINI APP ============
+
+def _parse_date(value) -> date:
+    if isinstance(value, date):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).date()
+
+
+def subscription_values(data: dict) -> dict:
+    """Поля Subscription из подписки в формате Mini App — только переданные (ValueError — неверное значение)"""
+    values = {}
+    if data.get('name'):
+        values['name'] = str(data['name'])[:255]
+    if data.get('price') is not None:
+        values['price'] = float(data['price'])
+    if data.get('billingCycle'):
+        values['billing_cycle'] = BillingCycle(str(data['billingCycle']).lower())
+    if data.get('status'):
+        values['status'] = SubscriptionStatus(str(data['status']).lower())
+    if data.get('nextPayment'):
+        values['next_billing_date'] = _parse_date(data['nextPayment'])
+    for key in ('icon', 'category', 'color', 'currency'):
+        if data.get(key):
+            values[key] = str(data[key])
+    return values
+
+
+def parse_change(raw) -> SubscriptionChange:
+    """Правка из запроса Mini App: {"op", "id" | "clientId", "subscription": {...}}"""
+    if not isinstance(raw, dict):
+        return SubscriptionChange(op="", error="change must be an object")
+    
+    change = SubscriptionChange(op=str(raw.get('op', '')).lower(), client_id=raw.get('clientId'))
+    try:
+        if change.op not in CHANGE_OPS:
+            raise ValueError(f"unknown op: {raw.get('op')}")
+        if change.op != "create":
+            change.id = int(raw['id'])
+        change.values = subscription_values(raw.get('subscription') or {})
+    except (KeyError, TypeError, ValueError) as e:
+        change.error = str(e)
+    return change
+
+
+# ============ ПРИМЕНЕНИЕ ============
+
+def _new_subscription_row(user_id: int, values: dict, today: date) -> dict:
+    """
+    Строка INSERT: start_date — переданная или дата следующего списания
+    (Mini App присылает только её), next_billing_date считается от неё
+    """
+    row = dict(values, user_id=user_id)
+    next_payment = row.pop("next_billing_date", None)
+    start_date = row.setdefault("start_date", next_payment or today + timedelta(days=30))
+    billing_cycle = row.setdefault("billing_cycle", BillingCycle.MONTHLY)
+    row["next_billing_date"] = calculate_next_billing(start_date, billing_cycle, today)
+    return row
+
+
+async def apply_subscription_changes(
+    session, user: User, changes: List[SubscriptionChange], since: Optional[datetime] = None, today: date = None
+) -> List[dict]:
+    """
+    Правки по порядку, одной транзакцией и тремя пачками запросов.
+    Несколько правок одной подписки складываются; удаление отменяет её обновления.
+    Если передан since (курсор клиента), подписка, которую пользователь правил позже (edited_at),
+    не трогается (conflict); служебные записи сервера конфликтом не считаются.
+    Результат на каждую правку: {"op", "status": ok | conflict | not_found | invalid, "id", "clientId"}
+    """
+    today = today or date.today()
+    
+    ids = {change.id for change in changes if change.id is not None and not change.error}
+    existing: Dict[int, Optional[datetime]] = {}
+    if ids:
+        result = await session.execute(
+            select(Subscription.id, Subscription.edited_at)
+            .where(Subscription.user_id == user.id)
+            .where(Subscription.id.in_(ids))
+        )
+        existing = dict(result.all())
+    
+    results = []
+    created: List[Tuple[dict, dict]] = []
+    updates: Dict[int, dict] = {}
+    deleted: List[int] = []
+    
+    for change in changes:
+        result = {"op": change.op, "status": "ok", "id": change.id, "clientId": change.client_id}
+        results.append(result)
+        
+        if change.error:
+            result.update(status="invalid", error=change.error)
+        elif change.op == "create":
+            if "name" not in change.values or "price" not in change.values:
+                result.update(status="invalid", error="name and price are required")
+            else:
+                created.append((result, _new_subscription_row(user.id, change.values, today)))
+        elif change.id not in existing:
+            result["status"] = "not_found"
+        elif since is not None and existing[change.id] and existing[change.id] > since:
+            result["status"] = "conflict"
+        elif change.op == "delete":
+            del existing[change.id]
+            updates.pop(change.id, None)
+            deleted.append(change.id)
+        else:
+            updates.setdefault(change.id, {}).update(change.values)
+    
+    if not (created or updates or deleted):
+        return results
+    
+    if created:
+        inserted = await session.execute(
+            insert(Subscription).returning(Subscription.id, sort_by_parameter_order=True),
+            [row for _, row in created]
+        )
+        for (result, _), subscription_id in zip(created, inserted.scalars().all()):
+            result["id"] = subscription_id
+    
+    # UPDATE ... WHERE id = ? — executemany, строки с одинаковым набором полей идут одной пачкой
+    updates = {subscription_id: values for subscription_id, values in updates.items() if values}
+    if updates:
+        await session.execute(
+            update(Subscription),
+            [dict(values, id=subscription_id) for subscription_id, values in updates.items()]
+        )
+    
+    if deleted:
+        await session.execute(delete(Reminder).where(Reminder.subscription_id.in_(deleted)))
+        await session.execute(
+            update(SubscriptionCharge)
+            .where(SubscriptionCharge.subscription_id.in_(deleted))
+            .values(subscription_id=None)
+        )
+        await session.execute(
+            delete(Subscription)
+            .where(Subscription.id.in_(deleted))
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(
+            insert(SyncTombstone),
+            [{"user_id": user.id, "entity_id": subscription_id} for subscription_id in deleted]
+        )
+    
+    await mark_duplicates_stale(session, [user.id])
+    await refresh_user_summaries(session, [user.id])
+    await session.commit()
+    await invalidate_user(user.telegram_id)
+    return results
+
+
+async def apply_subscription_batch(
+    telegram_id: int, changes: List[SubscriptionChange]
+) -> Tuple[List[dict], Dict[int, Subscription]]:
+    """
+    Пакет правок пользователя (POST /api/subscriptions/batch).
+    Возвращает результаты и созданные / изменённые подписки — одним SELECT после коммита.
+    """
+    async with async_session() as session:
+        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        user = result.scalar_one_or_none()
+        if not user:
+            user = User(telegram_id=telegram_id)
+            session.add(user)
+            await session.flush()
+        
+        results = await apply_subscription_changes(session, user, changes)
+        
+        ids = [item["id"] for item in results if item["status"] == "ok" and item["op"] != "delete"]
+        subscriptions = {}
+        if ids:
+            result = await session.execute(select(Subscription).where(Subscription.id.in_(ids)))
+            subscriptions = {sub.id: sub for sub in result.scalars().all()}
+    
+    applied = sum(1 for item in results if item["status"] == "ok")
+    logger.info(f"Пакет правок {telegram_id}: применено {applied} из {len(results)}")
+    return results, subscriptions
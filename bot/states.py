@@ -30,6 +30,11 @@ class SearchSubscription(StatesGroup):
     """Поиск подписки"""
     entering_query = State()
 
+class ImportSubscriptions(StatesGroup):
+    """Импорт подписок из файла"""
+    waiting_file = State()
+    confirming = State()
+
 class AddTrial(StatesGroup):
     """Добавление триала"""
     choosing_service = State()
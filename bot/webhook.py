@@ -0,0 +1,126 @@
+"""
+🪝 Приём апдейтов через webhook
+aiohttp-эндпоинт → ограниченная очередь → пул воркеров dp.feed_update
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def get_webhook_secret() -> str:
+    """
+    Секрет для заголовка X-Telegram-Bot-Api-Secret-Token.
+    Если WEBHOOK_SECRET не задан — выводится из токена, одинаково на всех репликах.
+    """
+    if config.WEBHOOK_SECRET:
+        return config.WEBHOOK_SECRET
+    return hashlib.sha256(config.BOT_TOKEN.encode()).hexdigest()
+
+
+class WebhookIngestor:
+    """
+    Принимает апдейты от Telegram и сразу отвечает 200,
+    обработка — в фоне, не больше workers апдейтов одновременно.
+    Очередь переполнена → 503: Telegram повторит доставку позже.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        workers: int = None,
+        queue_size: int = None,
+        secret: str = None
+    ):
+        self.bot = bot
+        self.dp = dp
+        self.workers = workers or config.WEBHOOK_WORKERS
+        self.secret = secret or get_webhook_secret()
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or config.WEBHOOK_QUEUE_SIZE)
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+
+    def setup(self, app: web.Application, path: str = None):
+        """Подключить эндпоинт и запуск/остановку воркеров к aiohttp-приложению"""
+        app.router.add_post(path or config.WEBHOOK_PATH, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+
+    async def _on_startup(self, app: web.Application):
+        self.start()
+
+    async def _on_shutdown(self, app: web.Application):
+        await self.close()
+
+    def start(self):
+        """Запустить воркеры"""
+        self._accepting = True
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker())
+                for _ in range(self.workers)
+            ]
+
+    async def close(self, timeout: float = 10):
+        """Перестать принимать апдейты, дообработать очередь и остановить воркеры"""
+        self._accepting = False
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook: не обработано {self._queue.qsize()} апдейтов при остановке")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """POST /webhook/telegram"""
+        # Байты, а не str: compare_digest падает на не-ASCII строках (TypeError → 500 вместо 401).
+        # aiohttp декодирует заголовки с surrogateescape — так исходные байты и вернутся
+        token = request.headers.get(SECRET_HEADER, "").encode("utf-8", "surrogateescape")
+        if not hmac.compare_digest(token, self.secret.encode()):
+            return web.Response(status=401)
+
+        if not self._accepting:
+            return web.Response(status=503, headers={"Retry-After": "5"})
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            # Битый апдейт повторять бессмысленно — подтверждаем и пропускаем
+            logger.error(f"Webhook: некорректный апдейт: {e}")
+            return web.Response()
+
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Webhook: очередь переполнена, апдейт отклонён")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Webhook: ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
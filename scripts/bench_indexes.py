@@ -0,0 +1,170 @@
+"""
+Бенчмарк индексов подписок: планы запросов и время до/после
+
+Запуск:
+    python scripts/bench_indexes.py
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python scripts/bench_indexes.py
+
+По умолчанию работает на временной SQLite, рабочую БД не трогает.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from bot.models import Base, User, Subscription, SubscriptionStatus, BillingCycle
+
+USERS = int(os.getenv("BENCH_USERS", "20000"))
+SUBS_PER_USER = int(os.getenv("BENCH_SUBS_PER_USER", "8"))
+REPEATS = 20
+
+SUBSCRIPTION_INDEXES = [
+    "ix_subscriptions_user_status_next_billing",
+    "ix_subscriptions_status_next_billing",
+    "ix_subscriptions_user_trial_end",
+]
+
+
+def hot_queries(user_id: int) -> dict:
+    """Те же условия, что в bot/database.py"""
+    today = date.today()
+
+    return {
+        "Список подписок пользователя": (
+            select(Subscription.id)
+            .where(Subscription.user_id == user_id)
+            .where(Subscription.status != SubscriptionStatus.CANCELLED)
+            .order_by(Subscription.next_billing_date)
+        ),
+        "Ближайшие списания пользователя": (
+            select(Subscription.id)
+            .where(Subscription.user_id == user_id)
+            .where(Subscription.status == SubscriptionStatus.ACTIVE)
+            .where(Subscription.next_billing_date >= today)
+            .where(Subscription.next_billing_date <= today + timedelta(days=7))
+            .order_by(Subscription.next_billing_date)
+        ),
+        "Окно списаний для рассылки": (
+            select(Subscription.id)
+            .where(Subscription.status == SubscriptionStatus.ACTIVE)
+            .where(Subscription.next_billing_date >= today)
+            .where(Subscription.next_billing_date <= today + timedelta(days=1))
+        ),
+        "Триалы пользователя": (
+            select(Subscription.id)
+            .where(Subscription.user_id == user_id)
+            .where(Subscription.is_trial == True)
+            .where(Subscription.trial_end_date >= today)
+            .where(Subscription.trial_end_date <= today + timedelta(days=30))
+        ),
+    }
+
+
+async def seed(conn):
+    print(f"🌱 {USERS} пользователей × {SUBS_PER_USER} подписок...")
+
+    await conn.execute(insert(User), [
+        {"telegram_id": 10_000_000 + i, "notify_slot_utc": 420}
+        for i in range(USERS)
+    ])
+
+    today = date.today()
+    statuses = [SubscriptionStatus.ACTIVE] * 6 + [SubscriptionStatus.PAUSED, SubscriptionStatus.CANCELLED]
+    rows = []
+
+    for user_id in range(1, USERS + 1):
+        for _ in range(SUBS_PER_USER):
+            is_trial = random.random() < 0.05
+            rows.append({
+                "user_id": user_id,
+                "name": "Bench",
+                "price": random.choice([99, 199, 299, 399, 599]),
+                "billing_cycle": BillingCycle.MONTHLY,
+                "start_date": today - timedelta(days=random.randint(0, 700)),
+                "next_billing_date": today + timedelta(days=random.randint(-30, 60)),
+                "trial_end_date": today + timedelta(days=random.randint(0, 30)) if is_trial else None,
+                "is_trial": is_trial,
+                "status": random.choice(statuses),
+            })
+
+        if len(rows) >= 20_000:
+            await conn.execute(insert(Subscription), rows)
+            rows = []
+
+    if rows:
+        await conn.execute(insert(Subscription), rows)
+
+
+async def explain(conn, stmt) -> str:
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+
+    if conn.dialect.name == "sqlite":
+        result = await conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        return "\n".join(f"      {row[-1]}" for row in result)
+
+    result = await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"))
+    return "\n".join(f"      {row[0]}" for row in result)
+
+
+async def measure(conn, title: str):
+    print(f"\n{'=' * 60}\n{title}\n{'=' * 60}")
+
+    user_ids = [random.randint(1, USERS) for _ in range(REPEATS)]
+
+    for name in hot_queries(1):
+        plan = await explain(conn, hot_queries(user_ids[0])[name])
+
+        started = time.perf_counter()
+        for user_id in user_ids:
+            await conn.execute(hot_queries(user_id)[name])
+        elapsed = (time.perf_counter() - started) / REPEATS * 1000
+
+        print(f"\n📌 {name}: {elapsed:.2f} мс/запрос\n{plan}")
+
+
+async def main():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        url = f"sqlite+aiosqlite:///{path}"
+
+    engine = create_async_engine(url)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await seed(conn)
+
+    indexes = [
+        index for index in Subscription.__table__.indexes
+        if index.name in SUBSCRIPTION_INDEXES
+    ]
+
+    async with engine.begin() as conn:
+        for index in indexes:
+            await conn.run_sync(lambda sync_conn, index=index: index.drop(sync_conn))
+        await conn.execute(text("ANALYZE"))
+        await measure(conn, "❌ БЕЗ индексов")
+
+    async with engine.begin() as conn:
+        for index in indexes:
+            await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn))
+        await conn.execute(text("ANALYZE"))
+        await measure(conn, "✅ С индексами")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
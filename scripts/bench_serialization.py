@@ -0,0 +1,160 @@
+"""
+Бенчмарк сериализации подписок: как было (словари + stdlib json) и сейчас (структуры + orjson)
+
+Запуск:
+    python scripts/bench_serialization.py
+    BENCH_SIZES=100,10000 python scripts/bench_serialization.py
+
+База не нужна: подписки — несохранённые объекты ORM, как после загрузки из сессии.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.api import resolve_service_style, subscription_to_struct
+from bot.models import Subscription, SubscriptionStatus, BillingCycle
+from bot.serialization import api_subscription, dumps
+
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "10,100,1000,10000").split(",")]
+REPEATS = int(os.getenv("BENCH_REPEATS", "20"))
+
+NAMES = ["Яндекс Плюс", "Netflix", "Spotify", "Кинопоиск", "iCloud+", "ChatGPT Plus", "Okko", "Telegram Premium"]
+
+
+def make_subscriptions(count: int) -> list:
+    today = date.today()
+    return [
+        Subscription(
+            id=i + 1,
+            user_id=1,
+            name=random.choice(NAMES),
+            price=float(random.choice([99, 199, 299, 399, 599])),
+            currency="RUB",
+            billing_cycle=random.choice(list(BillingCycle)),
+            status=random.choice([SubscriptionStatus.ACTIVE, SubscriptionStatus.PAUSED]),
+            start_date=today - timedelta(days=random.randint(0, 700)),
+            next_billing_date=today + timedelta(days=random.randint(0, 60)),
+            is_trial=False,
+            trial_end_date=None,
+            notes=None,
+            # Как в рабочей БД: у части подписок стиль ещё не сохранён
+            icon=random.choice([None, "🎬"]),
+            category=random.choice([None, "video"]),
+            color=random.choice([None, "#E50914"]),
+        )
+        for i in range(count)
+    ]
+
+
+# ============ КАК БЫЛО ============
+
+def legacy_subscription_to_dict(sub) -> dict:
+    """bot/api.py до перехода на структуры"""
+    style = resolve_service_style(sub.name)
+    icon = getattr(sub, 'icon', None) or style[0]
+    category = getattr(sub, 'category', None) or style[1]
+    color = getattr(sub, 'color', None) or style[2]
+
+    next_payment = None
+    if sub.next_billing_date:
+        if isinstance(sub.next_billing_date, date):
+            next_payment = datetime.combine(sub.next_billing_date, datetime.min.time()).isoformat()
+        else:
+            next_payment = sub.next_billing_date.isoformat()
+
+    billing_cycle = 'monthly'
+    if hasattr(sub, 'billing_cycle') and sub.billing_cycle:
+        billing_cycle = sub.billing_cycle.value if hasattr(sub.billing_cycle, 'value') else str(sub.billing_cycle)
+
+    return {
+        'id': sub.id,
+        'name': sub.name,
+        'price': float(sub.price),
+        'currency': getattr(sub, 'currency', 'RUB'),
+        'billingCycle': billing_cycle,
+        'nextPayment': next_payment,
+        'icon': icon,
+        'category': category,
+        'color': color,
+        'notifyDays': getattr(sub, 'notify_days', 3),
+        'status': sub.status.value if hasattr(sub.status, 'value') else str(sub.status)
+    }
+
+
+def legacy_api_dict(sub) -> dict:
+    """api/server.py до перехода на структуры"""
+    return {
+        "id": sub.id,
+        "name": sub.name,
+        "price": sub.price,
+        "currency": sub.currency,
+        "billing_cycle": sub.billing_cycle.value,
+        "category": sub.category,
+        "icon": sub.icon,
+        "color": sub.color,
+        "status": sub.status.value,
+        "is_trial": sub.is_trial,
+        "trial_end_date": sub.trial_end_date.isoformat() if sub.trial_end_date else None,
+        "next_billing_date": sub.next_billing_date.isoformat() if sub.next_billing_date else None,
+        "notes": sub.notes
+    }
+
+
+def legacy_fastapi_encode(subscriptions: list) -> bytes:
+    """Ответ-словарь FastAPI: jsonable_encoder, затем json.dumps в JSONResponse"""
+    from fastapi.encoders import jsonable_encoder
+
+    content = jsonable_encoder({"subscriptions": [legacy_api_dict(sub) for sub in subscriptions]})
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# ============ ЗАМЕРЫ ============
+
+def per_subscription_us(encode, subscriptions: list) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        encode(subscriptions)
+    return (time.perf_counter() - started) / REPEATS / len(subscriptions) * 1_000_000
+
+
+def main():
+    cases = {
+        "Mini App (bot/api.py)": (
+            lambda subs: json.dumps({'subscriptions': [legacy_subscription_to_dict(sub) for sub in subs]}).encode("utf-8"),
+            lambda subs: dumps({'subscriptions': [subscription_to_struct(sub) for sub in subs]}),
+        ),
+        "FastAPI (api/server.py)": (
+            legacy_fastapi_encode,
+            lambda subs: dumps({"subscriptions": [api_subscription(sub) for sub in subs]}),
+        ),
+    }
+
+    try:
+        import fastapi  # noqa: F401
+    except ImportError:
+        del cases["FastAPI (api/server.py)"]
+        print("⚠️ FastAPI не установлен — замер api/server.py пропущен")
+
+    for title, (legacy, current) in cases.items():
+        print(f"\n{'=' * 60}\n{title}: мкс на подписку\n{'=' * 60}")
+        print(f"{'подписок':>10} {'было':>10} {'стало':>10} {'ускорение':>10}")
+
+        for size in SIZES:
+            subscriptions = make_subscriptions(size)
+            # Прогрев: кэш стилей по названию, ленивые атрибуты ORM
+            legacy(subscriptions)
+            current(subscriptions)
+
+            before = per_subscription_us(legacy, subscriptions)
+            after = per_subscription_us(current, subscriptions)
+            print(f"{size:>10} {before:>10.2f} {after:>10.2f} {before / after:>9.1f}×")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,30 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from sqlalchemy import text
 from bot.database import engine
 
+def concurrent_index(name: str, table: str, columns: str, where: str = None, unique: bool = False) -> dict:
+    """
+    Миграция-индекс без блокировки таблицы на запись.
+    CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции, а при сбое он оставляет
+    невалидный индекс — поэтому проверяем indisvalid и пересоздаём его.
+    """
+    create = f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {table} ({columns})"
+    if where:
+        create += f" WHERE {where}"
+    
+    return {
+        "name": name,
+        "check": (
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            f"WHERE c.relname = '{name}' AND i.indisvalid"
+        ),
+        "up": [
+            f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+            create,
+        ],
+        "autocommit": True,
+    }
+
+
 MIGRATIONS = [
     # Миграция 1: Добавление поля total_saved
     {
@@ -25,29 +49,165 @@ MIGRATIONS = [
         "check": "SELECT column_name FROM information_schema.columns WHERE table_name='subscriptions' AND column_name='included_services'",
         "up": "ALTER TABLE subscriptions ADD COLUMN included_services JSON"
     },
+    # Миграция 3: Слот отправки уведомлений по UTC (заполняется refresh_notify_slots при старте бота)
+    {
+        "name": "add_notify_slot_utc",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='users' AND column_name='notify_slot_utc'",
+        "up": "ALTER TABLE users ADD COLUMN notify_slot_utc INTEGER"
+    },
+    concurrent_index("ix_users_notify_slot_utc", "users", "notify_slot_utc"),
+    # Миграция 4: Индексы под горячие запросы к подпискам
+    concurrent_index(
+        "ix_subscriptions_user_status_next_billing", "subscriptions",
+        "user_id, status, next_billing_date"
+    ),
+    concurrent_index(
+        "ix_subscriptions_status_next_billing", "subscriptions",
+        "status, next_billing_date"
+    ),
+    concurrent_index(
+        "ix_subscriptions_user_trial_end", "subscriptions",
+        "user_id, trial_end_date", where="is_trial"
+    ),
+    # Миграция 5: Сохранённые результаты поиска дубликатов
+    {
+        "name": "add_duplicates_scanned_at",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='users' AND column_name='duplicates_scanned_at'",
+        "up": "ALTER TABLE users ADD COLUMN duplicates_scanned_at TIMESTAMP"
+    },
+    {
+        "name": "add_duplicate_alerts_priority",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='duplicate_alerts' AND column_name='priority'",
+        "up": "ALTER TABLE duplicate_alerts ADD COLUMN priority INTEGER DEFAULT 3"
+    },
+    {
+        "name": "add_duplicate_alerts_details",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='duplicate_alerts' AND column_name='details'",
+        "up": "ALTER TABLE duplicate_alerts ADD COLUMN details JSON"
+    },
+    {
+        "name": "add_duplicate_alerts_updated_at",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='duplicate_alerts' AND column_name='updated_at'",
+        "up": "ALTER TABLE duplicate_alerts ADD COLUMN updated_at TIMESTAMP"
+    },
+    concurrent_index(
+        "uq_duplicate_alerts_pair", "duplicate_alerts",
+        "user_id, main_subscription_id, duplicate_subscription_id, overlap_type", unique=True
+    ),
+    # Миграция 6: Дельта-синхронизация Mini App (таблицу sync_tombstones создаёт init_db)
+    concurrent_index(
+        "ix_subscriptions_user_updated_at", "subscriptions",
+        "user_id, updated_at"
+    ),
+    {
+        "name": "add_subscriptions_edited_at",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='subscriptions' AND column_name='edited_at'",
+        "up": [
+            "ALTER TABLE subscriptions ADD COLUMN edited_at TIMESTAMP",
+            "UPDATE subscriptions SET edited_at = updated_at",
+        ]
+    },
+    # Миграция 7: Списания, свёрнутые в spending_snapshots, отмечаются флагом вместо водяного знака
+    {
+        "name": "add_subscription_charges_in_snapshot",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='subscription_charges' AND column_name='in_snapshot'",
+        "up": [
+            "ALTER TABLE subscription_charges ADD COLUMN in_snapshot BOOLEAN NOT NULL DEFAULT FALSE",
+            "UPDATE subscription_charges SET in_snapshot = TRUE "
+            "WHERE id <= (SELECT COALESCE(MAX(last_charge_id), 0) FROM spending_snapshots)",
+        ]
+    },
+    concurrent_index(
+        "ix_subscription_charges_pending", "subscription_charges",
+        "id", where="NOT in_snapshot"
+    ),
+    # Миграция 8: План с бандлом, отменяющий одну подписку, хранится без пары (duplicate_subscription_id = 0)
+    {
+        "name": "bundle_plan_alerts_without_pair",
+        "check": (
+            "SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM duplicate_alerts "
+            "WHERE overlap_type = 'bundle_plan' AND duplicate_subscription_id = main_subscription_id)"
+        ),
+        "up": (
+            "UPDATE duplicate_alerts SET duplicate_subscription_id = 0 "
+            "WHERE overlap_type = 'bundle_plan' AND duplicate_subscription_id = main_subscription_id"
+        )
+    },
+    # Миграция 9: Списания переживают удаление подписки — subscription_id обнуляется, название хранится в списании
+    {
+        "name": "add_subscription_charges_name",
+        "check": "SELECT column_name FROM information_schema.columns WHERE table_name='subscription_charges' AND column_name='name'",
+        "up": [
+            "ALTER TABLE subscription_charges ADD COLUMN name VARCHAR(255)",
+            "UPDATE subscription_charges c SET name = s.name FROM subscriptions s WHERE s.id = c.subscription_id",
+        ]
+    },
+    {
+        "name": "subscription_charges_keep_on_delete",
+        "check": (
+            "SELECT 1 FROM information_schema.columns WHERE table_name='subscription_charges' "
+            "AND column_name='subscription_id' AND is_nullable='YES'"
+        ),
+        "up": [
+            "ALTER TABLE subscription_charges ALTER COLUMN subscription_id DROP NOT NULL",
+            "ALTER TABLE subscription_charges DROP CONSTRAINT IF EXISTS subscription_charges_subscription_id_fkey",
+            "ALTER TABLE subscription_charges ADD CONSTRAINT subscription_charges_subscription_id_fkey "
+            "FOREIGN KEY (subscription_id) REFERENCES subscriptions (id) ON DELETE SET NULL",
+        ]
+    },
+    # Миграция 10: spending_snapshots.last_charge_id — номер пачки, а не водяной знак (повторы исключает in_snapshot)
+    {
+        "name": "spending_snapshots_last_charge_id_batch_only",
+        "check": (
+            "SELECT 1 FROM information_schema.columns WHERE table_name='spending_snapshots' "
+            "AND column_name='last_charge_id' AND is_nullable='YES'"
+        ),
+        "up": [
+            "ALTER TABLE spending_snapshots DROP CONSTRAINT IF EXISTS uq_spending_snapshots_batch",
+            "DROP INDEX IF EXISTS ix_spending_snapshots_last_charge_id",
+            "ALTER TABLE spending_snapshots ALTER COLUMN last_charge_id DROP NOT NULL",
+        ]
+    },
     # Добавляйте новые миграции здесь
 ]
 
+async def apply_migration(conn, migration: dict) -> bool:
+    """Применить миграцию, если check ничего не нашёл. False — уже применена"""
+    result = await conn.execute(text(migration["check"]))
+    if result.fetchone():
+        return False
+    
+    statements = migration["up"]
+    if isinstance(statements, str):
+        statements = [statements]
+    
+    for statement in statements:
+        await conn.execute(text(statement))
+    return True
+
 async def run_migrations():
     print("🔄 Запуск миграций...")
     
-    async with engine.begin() as conn:
-        for migration in MIGRATIONS:
-            try:
-                # Проверяем, нужна ли миграция
-                result = await conn.execute(text(migration["check"]))
-                exists = result.fetchone()
-                
-                if exists:
-                    print(f"⏭️  {migration['name']}: уже применена")
-                    continue
-                
-                # Применяем миграцию
-                await conn.execute(text(migration["up"]))
+    # Обычная миграция — одна транзакция вместе с check: при сбое откатывается целиком
+    # и на следующем запуске применяется заново. CONCURRENTLY-индексы — вне транзакции
+    autocommit_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+    
+    for migration in MIGRATIONS:
+        try:
+            if migration.get("autocommit"):
+                async with autocommit_engine.connect() as conn:
+                    applied = await apply_migration(conn, migration)
+            else:
+                async with engine.begin() as conn:
+                    applied = await apply_migration(conn, migration)
+            
+            if applied:
                 print(f"✅ {migration['name']}: применена")
-                
-            except Exception as e:
-                print(f"⚠️  {migration['name']}: {e}")
+            else:
+                print(f"⏭️  {migration['name']}: уже применена")
+            
+        except Exception as e:
+            print(f"⚠️  {migration['name']}: {e}")
     
     print("✅ Миграции завершены!")
 
@@ -0,0 +1,146 @@
+"""
+Оптимизатор бандлов: точность DP, обязательные варианты, предел MAX_PLAN_ITEMS
+"""
+
+import itertools
+import random
+
+import pytest
+
+from bot.data.subscriptions_catalog import SUBSCRIPTIONS_CATALOG
+from bot.models import Subscription, BillingCycle
+from bot.services.bundle_optimizer import MAX_PLAN_ITEMS, find_best_bundle_plan, solve_min_cost_cover
+
+YANDEX_PLUS_PRICE = SUBSCRIPTIONS_CATALOG["yandex_plus"]["default_price"]
+
+
+def make_subscriptions(*services) -> list:
+    return [
+        Subscription(id=i + 1, service_id=service_id, name=service_id, price=price, billing_cycle=BillingCycle.MONTHLY)
+        for i, (service_id, price) in enumerate(services)
+    ]
+
+
+def monthly_price(sub) -> float:
+    return sub.price
+
+
+def brute_force_cover(full_mask: int, options: list):
+    best = None
+    for size in range(len(options) + 1):
+        for chosen in itertools.combinations(range(len(options)), size):
+            mask = 0
+            for index in chosen:
+                mask |= options[index][0]
+            if mask == full_mask:
+                cost = sum(options[index][1] for index in chosen)
+                if best is None or cost < best:
+                    best = cost
+    return best
+
+
+# ============ DP ПО МАСКАМ ============
+
+def test_cover_of_nothing_is_free():
+    assert solve_min_cost_cover(0, [(0b1, 5.0)]) == (0.0, [])
+
+
+def test_uncoverable_mask():
+    assert solve_min_cost_cover(0b111, [(0b001, 1.0), (0b010, 1.0)]) is None
+
+
+def test_bundle_beats_singles():
+    cost, chosen = solve_min_cost_cover(0b111, [(0b001, 1.0), (0b010, 1.0), (0b100, 1.0), (0b111, 2.5)])
+    assert cost == 2.5
+    assert chosen == [3]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_cover_matches_brute_force(seed):
+    rng = random.Random(seed)
+    bits = rng.randint(1, 6)
+    full_mask = (1 << bits) - 1
+    options = [(rng.randint(1, full_mask), float(rng.randint(1, 20))) for _ in range(rng.randint(1, 8))]
+
+    expected = brute_force_cover(full_mask, options)
+    solution = solve_min_cost_cover(full_mask, options)
+
+    if expected is None:
+        assert solution is None
+        return
+    cost, chosen = solution
+    assert cost == pytest.approx(expected)
+    assert sum(options[index][1] for index in chosen) == pytest.approx(cost)
+    covered = 0
+    for index in chosen:
+        covered |= options[index][0]
+    assert covered == full_mask
+
+
+# ============ ПЛАН ============
+
+def test_buys_bundle_instead_of_parts():
+    music, movies = make_subscriptions(("yandex_music", 249.0), ("kinopoisk", 269.0))
+    plan = find_best_bundle_plan([music, movies], {"yandex_plus": ("yandex_music", "kinopoisk")}, monthly_price)
+
+    assert plan.buy == ["yandex_plus"]
+    assert plan.buy_names == [SUBSCRIPTIONS_CATALOG["yandex_plus"]["name"]]
+    assert plan.cancel == [music, movies]
+    assert plan.keep == []
+    assert plan.current_cost == 518.0
+    assert plan.plan_cost == YANDEX_PLUS_PRICE
+    assert plan.saving == round(518.0 - YANDEX_PLUS_PRICE, 2)
+
+
+def test_service_with_single_option_is_forced():
+    # Spotify не входит ни в один бандл — остаётся в плане без перебора
+    spotify, music, movies = make_subscriptions(("spotify", 199.0), ("yandex_music", 249.0), ("kinopoisk", 269.0))
+    plan = find_best_bundle_plan(
+        [spotify, music, movies], {"yandex_plus": ("yandex_music", "kinopoisk")}, monthly_price
+    )
+
+    assert plan.keep == [spotify]
+    assert plan.cancel == [music, movies]
+    assert plan.buy == ["yandex_plus"]
+    assert plan.plan_cost == 199.0 + YANDEX_PLUS_PRICE
+
+
+def test_owned_bundle_cancels_included_service():
+    plus, movies = make_subscriptions(("yandex_plus", 299.0), ("kinopoisk", 269.0))
+    plan = find_best_bundle_plan([plus, movies], {"yandex_plus": ("yandex_music", "kinopoisk")}, monthly_price)
+
+    assert plan.keep == [plus]
+    assert plan.cancel == [movies]
+    assert plan.buy == []
+    assert plan.saving == 269.0
+
+
+def test_no_plan_without_saving():
+    subscriptions = make_subscriptions(("yandex_music", 100.0), ("kinopoisk", 100.0))
+    assert find_best_bundle_plan(subscriptions, {"yandex_plus": ("yandex_music", "kinopoisk")}, monthly_price) is None
+
+
+def test_subscriptions_without_service_id_are_ignored():
+    subscriptions = make_subscriptions(("yandex_music", 249.0), (None, 999.0))
+    assert find_best_bundle_plan(subscriptions, {"yandex_plus": ("yandex_music", "kinopoisk")}, monthly_price) is None
+
+
+def contested_services(count: int):
+    """count сервисов, каждый покрывают своя подписка и два бандла — ни один вариант не обязателен"""
+    services = tuple(f"service_{i}" for i in range(count))
+    subscriptions = make_subscriptions(*((service_id, 100.0) for service_id in services))
+    return subscriptions, {"yandex_plus": services, "sber_prime": services}
+
+
+def test_plan_at_max_plan_items():
+    subscriptions, included_index = contested_services(MAX_PLAN_ITEMS)
+    plan = find_best_bundle_plan(subscriptions, included_index, monthly_price)
+
+    assert plan.buy == ["yandex_plus"]
+    assert plan.cancel == subscriptions
+    assert plan.plan_cost == YANDEX_PLUS_PRICE
+
+
+def test_no_plan_above_max_plan_items():
+    subscriptions, included_index = contested_services(MAX_PLAN_ITEMS + 1)
+    assert find_best_bundle_plan(subscriptions, included_index, monthly_price) is None
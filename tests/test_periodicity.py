@@ -0,0 +1,150 @@
+"""
+Поиск регулярных списаний: корзины периодов, склейка операций одного дня, смены цены
+"""
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from bot.models import BillingCycle
+from bot.services.periodicity import detect_recurring_charges
+
+START = date(2024, 1, 1)
+
+
+def charge_days(count: int, interval: int, start: date = START) -> list:
+    return [start.toordinal() + i * interval for i in range(count)]
+
+
+def detect(days, amounts, today: date = None, user_id: int = 1, merchant: str = "netflix"):
+    today = today or date.fromordinal(max(days))
+    return detect_recurring_charges([user_id] * len(days), [merchant] * len(days), days, amounts, today)
+
+
+def test_empty_history():
+    assert detect_recurring_charges([], [], [], []) == []
+
+
+def test_monthly_price_change():
+    days = charge_days(6, 30)
+    patterns = detect(days, [599.0] * 3 + [699.0] * 3, today=START + timedelta(days=160))
+
+    assert len(patterns) == 1
+    pattern = patterns[0]
+    assert pattern.cycle == BillingCycle.MONTHLY
+    assert pattern.price == 699.0
+    assert pattern.previous_price == 599.0
+    assert pattern.price_changed_on == date.fromordinal(days[3])
+    assert pattern.first_charged_on == START
+    assert pattern.last_charged_on == date.fromordinal(days[-1])
+    assert pattern.charges == 6
+    assert pattern.is_active
+    assert pattern.last_index == 5
+
+
+# ============ КОРЗИНЫ ПЕРИОДОВ ============
+
+@pytest.mark.parametrize("interval, cycle", [
+    (6, BillingCycle.WEEKLY),
+    (8, BillingCycle.WEEKLY),
+    (26, BillingCycle.MONTHLY),
+    (35, BillingCycle.MONTHLY),
+    (84, BillingCycle.QUARTERLY),
+    (98, BillingCycle.QUARTERLY),
+    (350, BillingCycle.YEARLY),
+    (380, BillingCycle.YEARLY),
+])
+def test_bin_edges_are_inclusive(interval, cycle):
+    patterns = detect(charge_days(3, interval), [100.0] * 3)
+    assert [p.cycle for p in patterns] == [cycle]
+
+
+@pytest.mark.parametrize("interval", [5, 9, 25, 36, 83, 99, 349, 381])
+def test_intervals_outside_bins_are_not_regular(interval):
+    assert detect(charge_days(3, interval), [100.0] * 3) == []
+
+
+def test_minimum_charges_per_cycle():
+    # Неделе нужно три списания, месяцу хватает двух
+    assert detect(charge_days(2, 7), [100.0] * 2) == []
+    assert [p.cycle for p in detect(charge_days(3, 7), [100.0] * 3)] == [BillingCycle.WEEKLY]
+    assert [p.cycle for p in detect(charge_days(2, 30), [100.0] * 2)] == [BillingCycle.MONTHLY]
+
+
+def test_cycle_share():
+    # Два интервала из трёх в корзине месяца — ещё регулярно, один из трёх — уже нет
+    start = START.toordinal()
+    assert len(detect([start, start + 30, start + 60, start + 75], [100.0] * 4)) == 1
+    assert detect([start, start + 30, start + 45, start + 60], [100.0] * 4) == []
+
+
+def test_is_active_within_one_period():
+    days = charge_days(3, 30)
+    last = date.fromordinal(days[-1])
+    assert detect(days, [100.0] * 3, today=last + timedelta(days=35))[0].is_active
+    assert not detect(days, [100.0] * 3, today=last + timedelta(days=36))[0].is_active
+
+
+# ============ ОПЕРАЦИИ ОДНОГО ДНЯ ============
+
+def test_same_day_operations_merge():
+    # Без склейки интервалы были бы [30, 0] — меньше 2/3 в корзине месяца
+    start = START.toordinal()
+    patterns = detect([start, start + 30, start + 30], [100.0, 100.0, 100.0])
+
+    assert len(patterns) == 1
+    assert patterns[0].charges == 2
+    assert patterns[0].cycle == BillingCycle.MONTHLY
+
+
+def test_same_day_merge_is_per_user_and_merchant():
+    days = charge_days(3, 30)
+    patterns = detect_recurring_charges(
+        [1, 1, 1, 2, 2, 2, 1, 1, 1],
+        ["netflix"] * 6 + ["spotify"] * 3,
+        days * 3,
+        [100.0] * 9,
+        date.fromordinal(days[-1]),
+    )
+    assert sorted((p.user_id, p.merchant, p.charges) for p in patterns) == [
+        (1, "netflix", 3), (1, "spotify", 3), (2, "netflix", 3)
+    ]
+
+
+def test_row_order_does_not_matter():
+    days = charge_days(6, 30)
+    amounts = [599.0] * 3 + [699.0] * 3
+    rows = list(zip(days, amounts))
+    random.Random(7).shuffle(rows)
+
+    shuffled = detect([d for d, _ in rows], [a for _, a in rows], today=date.fromordinal(days[-1]))
+
+    assert len(shuffled) == 1
+    assert shuffled[0].previous_price == 599.0
+    assert rows[shuffled[0].last_index] == (days[-1], 699.0)
+
+
+# ============ СМЕНЫ ЦЕНЫ ============
+
+def test_jitter_within_five_percent_is_one_price():
+    patterns = detect(charge_days(4, 30), [100.0, 104.0, 100.0, 104.9])
+    assert len(patterns) == 1
+    assert patterns[0].previous_price is None
+    assert patterns[0].price_changed_on is None
+
+
+def test_jump_above_five_percent_changes_price():
+    patterns = detect(charge_days(4, 30), [100.0, 100.0, 100.0, 105.1])
+    assert patterns[0].previous_price == 100.0
+
+
+def test_price_jump_share_limit():
+    # Три интервала: одна смена цены допустима, две — уже не подписка
+    assert len(detect(charge_days(4, 30), [100.0, 100.0, 150.0, 150.0])) == 1
+    assert detect(charge_days(4, 30), [100.0, 150.0, 100.0, 100.0]) == []
+
+
+def test_refunds_count_by_absolute_amount():
+    patterns = detect(charge_days(3, 30), [-299.0, -299.0, -299.0])
+    assert patterns[0].price == 299.0